@@ -0,0 +1,210 @@
+"""
+Process-wide texture registry.
+
+Every image and spritesheet the game uses is decoded from disk once, sliced
+into its animation frames once, and then handed out as shared references, so
+switching between views does no file I/O. preload() does the decoding on a
+thread pool so the menu can show while the rest of the game loads. Loaded textures are packed into the
+window's default atlas, which all SpriteLists share, so they are uploaded to
+the GPU once as well.
+"""
+import arcade
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from PIL import Image
+
+from hitboxes import CHARACTER_SHEETS, FRAME_HEIGHT, FRAME_WIDTH
+from simulation import NUM_FRAMES_ATTACK_1, NUM_FRAMES_ATTACK_2, NUM_FRAMES_DEATH, NUM_FRAMES_WALK
+
+DIR = path.dirname(path.abspath(__file__))
+# Collisions are the simulation's, from hitboxes.py, so arcade never needs to trace outlines from the pixels. Its
+# default walks every pixel of an image the first time a sprite shows it, which takes seconds for heart.png
+HIT_BOX_ALGORITHM = "None"
+
+# Spritesheets for each player: (file name, frame count, frame duration in ms) for walk, attack and death
+PLAYER_SHEETS = [
+    (("Captain_walk.png", NUM_FRAMES_WALK, 85),
+     ("Captain_attack1.png", NUM_FRAMES_ATTACK_1, 60),
+     ("Captain_death.png", NUM_FRAMES_DEATH, 100)),
+    (("Knightro_walk_flip.png", NUM_FRAMES_WALK, 85),
+     ("Knightro_attack.png", NUM_FRAMES_ATTACK_2, 60),
+     ("Knightro_deathflipped.png", NUM_FRAMES_DEATH, 100)),
+]
+# Way each character's spritesheets face: 1 for right, -1 for left. Frames for the other way are mirrored
+PLAYER_FACING = [facing for _, _, _, facing in CHARACTER_SHEETS]
+# Icon shown in the HUD for each character: (file name, flipped horizontally)
+PLAYER_ICONS = [("captain_icon.png", True), ("Knightro_icon.png", False)]
+# Whole images used by the views: (file name, flipped horizontally)
+IMAGES = [
+    ("main_background.png", False),
+    ("how_to_pic.png", False),
+    ("esc_red.png", False),
+    ("esc_black.png", False),
+    ("down_arrow.png", False),
+    ("heart.png", False),
+    ("island_map.jpg", False),
+    ("captain_icon.png", True),
+    ("Knightro_icon.png", False),
+    (":resources:images/tiles/grassMid.png", False),
+]
+
+_textures = {}  # (file name, flipped) -> arcade.Texture
+_animations = {}  # (file name, count, duration, flipped) -> [arcade.AnimationKeyframe]
+_tiles = {}  # (file name, column, row, size) -> arcade.Texture
+_tilesets = {}  # File name -> decoded tileset image, so each tileset is decoded once
+_packed = set()  # Names of textures already added to the atlas
+_futures = {}  # Cache key -> Future for assets the preloader is still working on
+_lock = threading.Lock()
+_executor = None
+
+
+def resolve(file_name):
+    """ Absolute path for a file next to main.py or an arcade :resources: path """
+    if file_name.startswith(":resources:"):
+        return str(arcade.resources.resolve_resource_path(file_name))
+    return path.join(DIR, file_name)
+
+
+def get_texture(file_name, flipped_horizontally=False):
+    """ Load a whole image as a texture, or return the cached one """
+    key = (file_name, flipped_horizontally)
+    texture = _textures.get(key)
+    if texture is None:
+        texture = _wait_or_load(key, _load_texture)
+    return texture
+
+
+def get_frames(file_name, count, duration, flipped_horizontally=False):
+    """ Slice a horizontal spritesheet into animation keyframes, or return the cached ones """
+    key = (file_name, count, duration, flipped_horizontally)
+    frames = _animations.get(key)
+    if frames is None:
+        frames = _wait_or_load(key, _load_frames)
+    return frames
+
+
+def get_tile(file_name, column, row, size):
+    """ One square of a tileset image, or the cached one """
+    key = (file_name, column, row, size)
+    texture = _tiles.get(key)
+    if texture is None:
+        image = _tilesets.get(file_name)
+        if image is None:
+            image = _tilesets[file_name] = _decode(file_name)
+        box = (column * size, row * size, (column + 1) * size, (row + 1) * size)
+        texture = arcade.Texture(f"{file_name}-tile-{column}-{row}-{size}", image=image.crop(box),
+                                  hit_box_algorithm=HIT_BOX_ALGORITHM)
+        with _lock:
+            _tiles[key] = texture
+    return texture
+
+
+def _wait_or_load(key, loader):
+    """ Block on the preloader if it already has this asset queued, otherwise load it here """
+    with _lock:
+        future = _futures.get(key)
+    if future is not None:
+        return future.result()
+    return loader(*key)
+
+
+def _decode(file_name):
+    # convert() forces the full decode here, on whichever thread called us
+    return Image.open(resolve(file_name)).convert("RGBA")
+
+
+def _load_texture(file_name, flipped_horizontally):
+    image = _decode(file_name)
+    if flipped_horizontally:
+        image = image.transpose(Image.FLIP_LEFT_RIGHT)
+    name = f"{file_name}-flipped" if flipped_horizontally else file_name
+    texture = arcade.Texture(name, image=image, hit_box_algorithm=HIT_BOX_ALGORITHM)
+    with _lock:
+        _textures[(file_name, flipped_horizontally)] = texture
+    return texture
+
+
+def _load_frames(file_name, count, duration, flipped_horizontally):
+    # Decode the sheet once and crop every frame out of it in memory
+    sheet = _decode(file_name)
+    suffix = "-flipped" if flipped_horizontally else ""
+    frames = []
+    for i in range(count):
+        box = (i * FRAME_WIDTH, 0, (i + 1) * FRAME_WIDTH, FRAME_HEIGHT)
+        image = sheet.crop(box)
+        if flipped_horizontally:
+            image = image.transpose(Image.FLIP_LEFT_RIGHT)
+        texture = arcade.Texture(f"{file_name}-{i}{suffix}", image=image, hit_box_algorithm=HIT_BOX_ALGORITHM)
+        frames.append(arcade.AnimationKeyframe(i, duration, texture))
+    with _lock:
+        _animations[(file_name, count, duration, flipped_horizontally)] = frames
+    return frames
+
+
+def is_loaded(file_name, flipped_horizontally=False):
+    """ True once an image can be fetched without blocking """
+    return (file_name, flipped_horizontally) in _textures
+
+
+def preload(max_workers=4):
+    """ Start decoding every asset on a thread pool, in the order the game needs them """
+    global _executor
+    if _executor is not None:
+        return
+    _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="preload")
+    jobs = [((file_name, flipped), _load_texture) for file_name, flipped in IMAGES]
+    jobs += [((*sheet, flipped), _load_frames) for sheets in PLAYER_SHEETS for sheet in sheets
+             for flipped in (False, True)]
+    with _lock:
+        for key, loader in jobs:
+            if key not in _textures and key not in _animations:
+                _futures[key] = _executor.submit(loader, *key)
+
+
+def progress():
+    """ (finished, total) preload jobs """
+    with _lock:
+        futures = list(_futures.values())
+    return sum(future.done() for future in futures), len(futures)
+
+
+def wait_all():
+    """ Block until the preloader has finished, returns the seconds spent waiting """
+    start = time.perf_counter()
+    with _lock:
+        futures = list(_futures.values())
+    for future in futures:
+        future.result()
+    return time.perf_counter() - start
+
+
+def load_all():
+    """ Load every image and slice every spritesheet the game uses """
+    for file_name, flipped in IMAGES:
+        get_texture(file_name, flipped)
+    for sheets in PLAYER_SHEETS:
+        for file_name, count, duration in sheets:
+            get_frames(file_name, count, duration)
+            get_frames(file_name, count, duration, True)
+
+
+def all_textures():
+    """ Every texture currently held by the registry """
+    with _lock:
+        textures = list(_textures.values())
+        textures.extend(_tiles.values())
+        for frames in _animations.values():
+            textures.extend(frame.texture for frame in frames)
+    return textures
+
+
+def pack_atlas(ctx):
+    """ Add every cached texture to the shared atlas that SpriteLists draw from """
+    atlas = ctx.default_atlas
+    for texture in all_textures():  # Only textures that finished loading are listed
+        if texture.name not in _packed:
+            atlas.add(texture)
+            _packed.add(texture.name)
+    return atlas
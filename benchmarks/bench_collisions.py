@@ -0,0 +1,96 @@
+"""
+Per-frame collision cost versus entity count, brute force against the spatial hash.
+
+Every frame each fighter moves a little, checks its attack box against every
+other fighter and checks its body against the platform tiles, which is the
+worst case of GameBoard's attack and ground checks (everyone swinging at
+once). Two layouts are measured: everyone packed into the 1000px arena, and a
+level that grows by one screen per 16 fighters with a row of 64px tiles.
+
+    python benchmarks/bench_collisions.py
+"""
+import random
+import sys
+import time
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from simulation import FIGHTER_HEIGHT, FIGHTER_WIDTH  # noqa: E402
+from spatial import SpatialHash  # noqa: E402
+
+COUNTS = [2, 8, 32, 128, 512]
+TILE_SIZE = 64
+FRAMES = 30
+
+
+def overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def make_world(count, width, seed):
+    rng = random.Random(seed)
+    fighters = [[rng.uniform(0, width), rng.uniform(114, 400)] for _ in range(count)]
+    tiles = [(x, 50, x + TILE_SIZE, 114) for x in range(0, int(width), TILE_SIZE)]
+    return rng, fighters, tiles
+
+
+def box(fighter):
+    x, y = fighter
+    return x - FIGHTER_WIDTH / 2, y, x + FIGHTER_WIDTH / 2, y + FIGHTER_HEIGHT
+
+
+def step(rng, fighters, width):
+    for fighter in fighters:
+        fighter[0] = min(max(fighter[0] + rng.uniform(-5, 5), 0), width)
+        fighter[1] = min(max(fighter[1] + rng.uniform(-5, 5), 114), 400)
+
+
+def run_brute_force(count, width):
+    rng, fighters, tiles = make_world(count, width, count)
+    hits = 0
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        step(rng, fighters, width)
+        boxes = [box(fighter) for fighter in fighters]
+        for index, attacker in enumerate(boxes):
+            hits += sum(1 for other, target in enumerate(boxes) if other != index and overlaps(attacker, target))
+            hits += sum(1 for tile in tiles if overlaps(attacker, tile))
+    return (time.perf_counter() - start) / FRAMES, hits
+
+
+def run_spatial_hash(count, width):
+    rng, fighters, tiles = make_world(count, width, count)
+    fighter_hash = SpatialHash()
+    tile_hash = SpatialHash()
+    for index, fighter in enumerate(fighters):
+        fighter_hash.insert(index, *box(fighter))
+    for index, tile in enumerate(tiles):
+        tile_hash.insert(index, *tile)
+    hits = 0
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        step(rng, fighters, width)
+        for index, fighter in enumerate(fighters):
+            fighter_hash.move(index, *box(fighter))
+        for index, fighter in enumerate(fighters):
+            attacker = box(fighter)
+            hits += sum(1 for other in fighter_hash.query(*attacker) if other != index)
+            hits += len(tile_hash.query(*attacker))
+    return (time.perf_counter() - start) / FRAMES, hits
+
+
+def main():
+    print(f"{'layout':<8}{'fighters':>10}{'tiles':>8}{'brute us/frame':>16}{'hash us/frame':>15}{'speedup':>9}")
+    for layout in ("arena", "level"):
+        for count in COUNTS:
+            width = 1000 if layout == "arena" else 1000 * max(1, count // 16)
+            brute, brute_hits = run_brute_force(count, width)
+            hashed, hash_hits = run_spatial_hash(count, width)
+            assert brute_hits == hash_hits, "spatial hash disagrees with brute force"
+            tiles = len(range(0, width, TILE_SIZE))
+            print(f"{layout:<8}{count:>10}{tiles:>8}{brute * 1e6:>16.0f}{hashed * 1e6:>15.0f}{brute / hashed:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
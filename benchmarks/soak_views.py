@@ -0,0 +1,112 @@
+"""
+Soak test for the view lifecycle.
+
+Goes menu -> match -> menu hundreds of times through the same ViewManager the
+game uses, playing a short scripted match and drawing it each time and
+visiting How To Play every few cycles. Once the first cycles have warmed
+every cache up, traced memory and the number of live objects should stay
+flat; the run fails if either keeps growing or if any view was built more
+than once. Needs arcade and a GL context, like the view benchmarks in suite.py.
+
+    python benchmarks/soak_views.py                 # 300 cycles
+    python benchmarks/soak_views.py --cycles 1000
+"""
+import argparse
+import gc
+import statistics
+import sys
+import time
+import tracemalloc
+from os import path
+
+sys.path.insert(0, path.dirname(path.abspath(__file__)))
+
+from suite import Skipped, headless_window, scripted_inputs  # noqa: E402
+
+CYCLES = 300
+WARMUP_CYCLES = 20  # Cycles run before the baseline is taken, while caches and pools fill
+FRAMES_PER_MATCH = 240
+DRAW_EVERY = 8  # Frames between draws, drawing is what touches the GPU buffers
+HOW_TO_EVERY = 10  # Cycles between visits to How To Play
+# A 300-cycle run on arcade 2.6.17 (headless EGL) gained 10.7 KB and no objects after warming up. The limits leave
+# room for allocator noise but fail a leak of one object or half a kilobyte per cycle
+MAX_MEMORY_GROWTH = 128 * 1024  # Bytes of traced memory the run may gain after warming up
+MAX_OBJECT_GROWTH = 250  # Live objects the run may gain after warming up
+
+
+def cycle(views, number, script):
+    """ Menu, one match, back to the menu. Returns the seconds the menu took to start the match """
+    menu = views.views["menu"]
+    start = time.perf_counter()
+    menu.switch_to_game_board(0)
+    rematch = time.perf_counter() - start
+
+    board = views.views["game"]
+    board.read_inputs = lambda until: list(next(script))
+    for frame in range(FRAMES_PER_MATCH):
+        board.on_update(1 / 60)
+        if frame % DRAW_EVERY == 0:
+            board.on_draw()
+    board.switch_to_main_menu()
+
+    if number % HOW_TO_EVERY == 0:
+        menu.switch_to_how_to_play(0)
+        views.views["howto"].switch_main_menu(0)
+    return rematch
+
+
+def measure():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0], len(gc.get_objects())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play hundreds of menu and match cycles and check for leaks")
+    parser.add_argument("--cycles", type=int, default=CYCLES)
+    args = parser.parse_args()
+
+    try:
+        window = headless_window()
+    except Skipped as error:
+        print(f"skipped: {error}")
+        return 0
+    import assets
+    import main as game
+
+    assets.load_all()
+    game.VIEWS = views = game.new_view_manager(window)
+    views.show("menu")
+    script = scripted_inputs(2, 0)
+
+    rematches = []
+    tracemalloc.start()
+    for number in range(WARMUP_CYCLES):
+        rematches.append(cycle(views, number, script))
+    memory, objects = measure()
+    for number in range(WARMUP_CYCLES, args.cycles):
+        rematches.append(cycle(views, number, script))
+    final_memory, final_objects = measure()
+    tracemalloc.stop()
+    window.close()
+
+    memory_growth = final_memory - memory
+    object_growth = final_objects - objects
+    print(f"{args.cycles} cycles, {views.builds} views built")
+    print(f"rematch: median {statistics.median(rematches) * 1000:.2f} ms, worst after warmup "
+          f"{max(rematches[WARMUP_CYCLES:] or rematches) * 1000:.2f} ms")
+    print(f"after warmup: memory {memory_growth / 1024:+.1f} KB, objects {object_growth:+d}")
+
+    failures = []
+    if views.builds > len(views.factories):
+        failures.append(f"{views.builds} views built for {len(views.factories)} screens")
+    if memory_growth > MAX_MEMORY_GROWTH:
+        failures.append(f"memory grew by {memory_growth / 1024:.0f} KB")
+    if object_growth > MAX_OBJECT_GROWTH:
+        failures.append(f"{object_growth} more live objects")
+    for failure in failures:
+        print(f"LEAK: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
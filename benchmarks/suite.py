@@ -0,0 +1,474 @@
+"""
+Benchmark suite with a stored baseline.
+
+Measures match ticks per second for 2 to 64 fighters, on levels of growing
+width and stepped in NumPy batches, ticks with hundreds of projectiles in flight,
+snapshot save, load and delta cost, collision checks against entity count, particle updates, view construction, setup (cold and warm) and rematch resets,
+and draw calls per frame. Benchmarks that need arcade run in a hidden window on
+a headless GL context (ARCADE_HEADLESS); where arcade, numpy or GL is missing
+they are reported as skipped instead of failing.
+
+Results are compared with benchmarks/baseline.json and any metric more than
+--tolerance worse than its baseline fails the run. Baselines only mean something
+on the machine they were recorded on, so re-record them when that changes.
+Machine noise only ever makes code look slower, so with --runs each metric is
+its best value over the runs; use the same --runs for the baseline and checks.
+
+    python benchmarks/suite.py                      # run everything, compare with the baseline
+    python benchmarks/suite.py --only simulation    # just the groups named
+    python benchmarks/suite.py --json results.json  # also write the results
+    python benchmarks/suite.py --save-baseline      # make this the new baseline
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from os import path
+
+HERE = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from simulation import Match  # noqa: E402
+
+BASELINE = path.join(HERE, "baseline.json")
+RUNS = 3
+TOLERANCE = 0.25  # Fraction worse than the baseline a metric may get before the run fails
+REPEATS = 5  # Every timing is the best of this many runs, which filters out most scheduler noise
+PLAYER_COUNTS = [2, 8, 32, 64]
+COLLISION_COUNTS = [32, 128, 512]
+SIMULATION_TICKS = 6000
+VECENV_MATCHES = [64, 4096]
+PROJECTILE_COUNTS = [64, 256, 512]
+PROJECTILE_TICKS = 600
+SNAPSHOT_TICKS = 600
+VECENV_TICKS = 600
+WARM_SETUPS = 10
+DRAW_FRAMES = 60
+
+# One window for the whole run: when a closed arcade window is garbage collected it closes again, which clears
+# whichever window is active by then, so groups and runs after the first would find none
+_window = None
+
+
+class Skipped(Exception):
+    """ A benchmark can't run on this machine, e.g. arcade or GL is missing """
+
+
+def best_of(function, repeats=REPEATS, clock=time.process_time):
+    """ Shortest time of several calls, and what the last call returned.
+
+    CPU-bound benchmarks use process time, which leaves out time the process
+    spent descheduled and so varies far less on a busy or virtual machine.
+    Anything that waits on the GPU has to pass clock=time.perf_counter.
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        start = clock()
+        result = function()
+        best = min(best, clock() - start)
+    return best, result
+
+
+def scripted_inputs(num_players, seed):
+    """ Random input held for 6 ticks at a time, like run_match(), as one list per tick """
+    rng = random.Random(seed)
+    inputs = [0] * num_players
+    tick = 0
+    while True:
+        if tick % 6 == 0:
+            inputs = [rng.randrange(32) for _ in range(num_players)]
+        yield inputs
+        tick += 1
+
+
+def bench_simulation():
+    """ Match.step() ticks per second, restarting matches as they end so every count runs the same ticks """
+    results = []
+    for players in PLAYER_COUNTS:
+        def run():
+            script = scripted_inputs(players, players)
+            match = Match(0, players)
+            for _ in range(SIMULATION_TICKS):
+                if match.frozen:
+                    match = Match(match.seed + 1, players)
+                match.step(next(script))
+        elapsed, _ = best_of(run)
+        results.append((f"simulation.ticks_per_s.{players}p", SIMULATION_TICKS / elapsed, "ticks/s", "higher"))
+    return results
+
+
+def bench_collisions():
+    """ The worst case of bench_collisions.py, everyone swinging at once, in the crowded arena layout """
+    import bench_collisions
+
+    results = []
+    for count in COLLISION_COUNTS:
+        # Includes making the world, which is small next to FRAMES frames of checks. Small counts
+        # finish in a few ms, so they get more tries to find a clean one
+        repeats = max(REPEATS, 640 // count)
+        brute, _ = best_of(lambda: bench_collisions.run_brute_force(count, 1000), repeats)
+        hashed, _ = best_of(lambda: bench_collisions.run_spatial_hash(count, 1000), repeats)
+        frames = bench_collisions.FRAMES
+        results.append((f"collisions.brute_us_per_frame.{count}", brute / frames * 1e6, "us", "lower"))
+        results.append((f"collisions.hash_us_per_frame.{count}", hashed / frames * 1e6, "us", "lower"))
+    return results
+
+
+def wide_level(screens):
+    """ A generated level `screens` screens wide: three rows of ground with gaps and a ledge every 12 tiles """
+    from levels import Level
+
+    columns = screens * 1000 // 64
+    rows = [["." for _ in range(columns)] for _ in range(12)]
+    for column in range(columns):
+        if column % 40 < 37:
+            rows[9][column] = "="
+            rows[10][column] = rows[11][column] = "%"
+        if column % 12 < 6:
+            rows[5 + column // 12 % 3][column] = "="
+    rows[8][columns // 2 - 8] = rows[8][columns // 2 + 8] = "P"
+    return Level(f"wide-{screens}", ["".join(row) for row in rows], tileset="island_map_platform.jpg",
+                 tileset_tile_size=62, tiles={"=": (10, 0), "%": (10, 2)})
+
+
+def bench_levels():
+    """ Match ticks per second on the single-screen arena, the island level and much wider generated levels """
+    from levels import load_level
+
+    results = []
+    levels = [("arena", None), ("island", load_level("levels/island.txt"))]
+    levels += [(f"wide{screens}", wide_level(screens)) for screens in (10, 50)]
+    for name, level in levels:
+        def run():
+            script = scripted_inputs(2, 2)
+            match = Match(0, 2) if level is None else level.new_match(0, 2)
+            for _ in range(SIMULATION_TICKS):
+                if match.frozen:
+                    match = Match(match.seed + 1, 2) if level is None else level.new_match(match.seed + 1, 2)
+                match.step(next(script))
+        elapsed, _ = best_of(run)
+        results.append((f"levels.ticks_per_s.{name}", SIMULATION_TICKS / elapsed, "ticks/s", "higher"))
+    return results
+
+
+def bench_projectiles():
+    """ Match ticks per second with a pool kept topped up to a fixed number of projectiles, and raw spawn cost """
+    from projectiles import BARREL, BOTTLE, CANNONBALL, ProjectilePool
+
+    results = []
+    for count in PROJECTILE_COUNTS:
+        def run():
+            rng = random.Random(0)
+            script = scripted_inputs(2, 3)
+            match = Match(0, 2)
+            pool = match.projectiles
+            for _ in range(PROJECTILE_TICKS):
+                # Replace whatever broke last tick: bottles lobbed, cannonballs along the ground, barrels falling
+                while pool.count < count:
+                    kind = rng.choice((BOTTLE, CANNONBALL, BARREL))
+                    pool.spawn(kind, -1, rng.uniform(0, 1000), rng.uniform(130, 480), rng.choice((-1, 1)))
+                match.step(next(script))
+                if match.game_over:
+                    match.set_state(start)
+            return match
+        start = Match(0, 2).get_state()
+        elapsed, _ = best_of(run)
+        results.append((f"projectiles.ticks_per_s.{count}", PROJECTILE_TICKS / elapsed, "ticks/s", "higher"))
+
+    pool = ProjectilePool()
+
+    def churn():
+        for _ in range(100):
+            for index in range(pool.capacity):
+                pool.spawn(BOTTLE, 0, index, 200.0, 1)
+            while pool.count:
+                pool.despawn(0)
+    elapsed, _ = best_of(churn)
+    results.append(("projectiles.spawns_per_s", 100 * pool.capacity / elapsed, "spawns/s", "higher"))
+    return results
+
+
+def bench_snapshot():
+    """ Snapshots saved, loaded and diffed per second over a match on the island level, and the average delta size """
+    from levels import load_level
+    from snapshot import Snapshotter
+
+    match = load_level("levels/island.txt").new_match(0, 2)
+    snapshotter = Snapshotter(match)
+    script = scripted_inputs(2, 4)
+    snapshots = []
+    for _ in range(SNAPSHOT_TICKS):
+        match.step(next(script))
+        snapshots.append(snapshotter.save())
+    pairs = list(zip(snapshots, snapshots[1:]))
+    buffer = snapshotter.new_buffer()
+
+    results = []
+    elapsed, _ = best_of(lambda: [snapshotter.save(buffer) for _ in range(SNAPSHOT_TICKS)])
+    results.append(("snapshot.saves_per_s", SNAPSHOT_TICKS / elapsed, "saves/s", "higher"))
+    elapsed, _ = best_of(lambda: [snapshotter.load(snapshot) for snapshot in snapshots])
+    results.append(("snapshot.loads_per_s", SNAPSHOT_TICKS / elapsed, "loads/s", "higher"))
+    elapsed, deltas = best_of(lambda: [snapshotter.diff(previous, current) for previous, current in pairs])
+    results.append(("snapshot.diffs_per_s", len(pairs) / elapsed, "diffs/s", "higher"))
+    results.append(("snapshot.delta_bytes", sum(map(len, deltas)) / len(deltas), "bytes", "lower"))
+    return results
+
+
+def bench_vecenv():
+    """ Match ticks per second stepped as one NumPy batch, which models the simulation without throws or hazards """
+    np = import_or_skip("numpy")
+    vecenv = import_or_skip("vecenv")
+
+    results = []
+    for matches in VECENV_MATCHES:
+        rng = np.random.default_rng(0)
+        script = [rng.integers(16, size=(matches, 2), dtype=np.uint8) for _ in range(VECENV_TICKS // 6)]
+
+        def run():
+            batch = vecenv.BatchMatch(matches, 2)
+            for tick in range(VECENV_TICKS):
+                batch.step(script[tick // 6])
+        elapsed, _ = best_of(run)
+        results.append((f"vecenv.ticks_per_s.{matches}", matches * VECENV_TICKS / elapsed, "ticks/s", "higher"))
+    return results
+
+
+def bench_particles():
+    """ Particle updates per second for the confetti and for a full spark system that keeps expiring """
+    particles = import_or_skip("particles")
+    results = []
+
+    confetti = particles.ConfettiSystem(10_000, 1000, 500, seed=0)
+    elapsed, _ = best_of(lambda: [confetti.update() for _ in range(100)])
+    results.append(("particles.confetti_updates_per_s", 100 * confetti.count / elapsed, "particles/s", "higher"))
+
+    sparks = particles.ParticleSystem(50_000, gravity=0.3, seed=0)
+
+    def burst():
+        for _ in range(100):
+            particles.emit_hit_sparks(sparks, 500, 250, count=500)
+            sparks.update()
+    elapsed, _ = best_of(burst)
+    results.append(("particles.sparks_frames_per_s", 100 / elapsed, "frames/s", "higher"))
+    return results
+
+
+def bench_views():
+    """ View construction and GameBoard.setup(), the first (cold, assets decoding) and later ones (warm), and reset() """
+    headless_window()
+    import assets
+    import main
+
+    results = []
+    cold = not assets.all_textures()  # Only the first run in a process decodes the assets
+    start = time.perf_counter()
+    board = main.GameBoard()
+    board.setup()
+    if cold:
+        results.append(("views.gameboard_setup_cold_ms", (time.perf_counter() - start) * 1000, "ms", "lower"))
+
+    def warm():
+        for _ in range(WARM_SETUPS):
+            main.GameBoard().setup()
+    elapsed, _ = best_of(warm, clock=time.perf_counter)
+    results.append(("views.gameboard_setup_warm_ms", elapsed / WARM_SETUPS * 1000, "ms", "lower"))
+
+    # A rematch reuses the board and only starts a new match
+    elapsed, _ = best_of(lambda: [board.reset() for _ in range(WARM_SETUPS)], clock=time.perf_counter)
+    results.append(("views.gameboard_reset_ms", elapsed / WARM_SETUPS * 1000, "ms", "lower"))
+
+    for name, view in (("mainmenu", main.MainMenu), ("howto", main.HowTo)):
+        elapsed, _ = best_of(lambda: [view() for _ in range(WARM_SETUPS)], clock=time.perf_counter)
+        results.append((f"views.{name}_init_ms", elapsed / WARM_SETUPS * 1000, "ms", "lower"))
+
+    # The whole GameBoard.on_update, simulation plus HUD and particles, and the sprite sync on_draw starts with
+    for players in (2, 8):
+        board = main.GameBoard(num_players=players)
+        board.setup()
+        script = scripted_inputs(players, players)
+        board.read_inputs = lambda until: next(script)
+
+        def update(board=board):
+            board.on_update(1 / 60)
+            board.sync_sprites(board.alpha)
+            board.projectiles.sync(board.match.projectiles, board.alpha)
+
+        elapsed, _ = best_of(lambda: [update() for _ in range(600)], repeats=3, clock=time.perf_counter)
+        results.append((f"views.gameboard_updates_per_s.{players}p", 600 / elapsed, "updates/s", "higher"))
+
+    assets.wait_all()
+    return results
+
+
+def bench_draw_calls():
+    """ GL draw calls and text draws per frame for each view, counted by wrapping the render entry points """
+    window = headless_window()
+    import arcade
+    from arcade.gl import Geometry
+    import main
+
+    counts = {"draws": 0, "texts": 0}
+    render = Geometry.render
+    draw_text = arcade.Text.draw
+
+    def counted_render(self, *args, **kwargs):
+        counts["draws"] += 1
+        return render(self, *args, **kwargs)
+
+    def counted_text(self, *args, **kwargs):
+        counts["texts"] += 1
+        return draw_text(self, *args, **kwargs)
+
+    Geometry.render = counted_render
+    arcade.Text.draw = counted_text
+    results = []
+    try:
+        board = main.GameBoard()
+        board.setup()
+        level_board = main.GameBoard(level=wide_level(50))
+        level_board.setup()
+        views = (("mainmenu", main.MainMenu()), ("howto", main.HowTo()), ("gameboard", board),
+                 ("gameboard_wide50", level_board))
+        for name, view in views:
+            window.show_view(view)
+            view.on_draw()  # Let lazy textures and sprite lists build first
+            counts.update(draws=0, texts=0)
+            start = time.perf_counter()
+            for _ in range(DRAW_FRAMES):
+                view.on_draw()
+            window.ctx.finish()
+            elapsed = time.perf_counter() - start
+            results.append((f"draw.{name}_gl_draws_per_frame", counts["draws"] / DRAW_FRAMES, "calls", "lower"))
+            results.append((f"draw.{name}_text_draws_per_frame", counts["texts"] / DRAW_FRAMES, "calls", "lower"))
+            results.append((f"draw.{name}_frame_ms", elapsed / DRAW_FRAMES * 1000, "ms", "lower"))
+    finally:
+        Geometry.render = render
+        arcade.Text.draw = draw_text
+    return results
+
+
+GROUPS = {
+    "simulation": bench_simulation,
+    "collisions": bench_collisions,
+    "levels": bench_levels,
+    "projectiles": bench_projectiles,
+    "snapshot": bench_snapshot,
+    "vecenv": bench_vecenv,
+    "particles": bench_particles,
+    "views": bench_views,
+    "draw": bench_draw_calls,
+}
+
+
+def import_or_skip(name):
+    try:
+        return __import__(name)
+    except ImportError as error:
+        raise Skipped(f"needs {error.name}")
+
+
+def headless_window():
+    """ A hidden arcade window, on EGL without a display when ARCADE_HEADLESS is set (the default here) """
+    global _window
+    if _window is not None:
+        return _window
+    os.environ.setdefault("ARCADE_HEADLESS", "1")
+    arcade = import_or_skip("arcade")
+    import_or_skip("numpy")
+    import_or_skip("PIL")
+    try:
+        _window = arcade.Window(1000, 500, "benchmark", visible=False)
+    except Exception as error:  # No GL at all on this box, pyglet raises several kinds
+        raise Skipped(f"no GL context: {error}")
+    return _window
+
+
+def compare(results, baseline, tolerance):
+    """ Print every result next to its baseline and return the names of the ones that regressed """
+    regressions = []
+    print(f"{'benchmark':<44}{'value':>14}  {'unit':<12}{'baseline':>14}{'change':>9}")
+    for name, value, unit, better in results:
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<44}{value:>14.2f}  {unit:<12}{'-':>14}")
+            continue
+        change = (value - base["value"]) / base["value"] if base["value"] else 0.0
+        worse = -change if better == "higher" else change
+        flag = ""
+        if worse > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<44}{value:>14.2f}  {unit:<12}{base['value']:>14.2f}{change:>+8.0%}{flag}")
+    return regressions
+
+
+def machine():
+    return {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.machine(),
+            "cpus": os.cpu_count()}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite and compare it with the baseline")
+    parser.add_argument("--only", nargs="+", choices=list(GROUPS), help="benchmark groups to run")
+    parser.add_argument("--json", metavar="FILE", help="write the results to this file")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--runs", type=int, default=RUNS, help="run the suite this many times, keep the best")
+    args = parser.parse_args(argv)
+
+    runs = {}  # Name -> (values, unit, better)
+    skipped = {}
+    for _ in range(args.runs):
+        for group in args.only or GROUPS:
+            if group in skipped:
+                continue
+            try:
+                for name, value, unit, better in GROUPS[group]():
+                    runs.setdefault(name, ([], unit, better))[0].append(value)
+            except Skipped as reason:
+                skipped[group] = str(reason)
+                print(f"Skipped {group}: {reason}")
+    results = [(name, max(values) if better == "higher" else min(values), unit, better)
+               for name, (values, unit, better) in runs.items()]
+
+    baseline = {"machine": None, "results": {}}
+    if path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["machine"] != machine():
+            print(f"Baseline was recorded on {baseline['machine']}, comparisons may be off")
+    regressions = compare(results, baseline["results"], args.tolerance)
+
+    report = {
+        "machine": machine(),
+        "results": {name: {"value": value, "unit": unit, "better": better} for name, value, unit, better in results},
+        "skipped": skipped,
+        "regressions": regressions,
+    }
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.save_baseline:
+        # Keep baselines for groups that were skipped or not run this time
+        baseline["results"].update(report["results"])
+        baseline["machine"] = report["machine"]
+        with open(args.baseline, "w") as file:
+            json.dump({"machine": baseline["machine"], "results": baseline["results"]}, file, indent=2)
+        print(f"Saved {len(results)} results to {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"FAILED: {len(regressions)} benchmarks regressed by more than {args.tolerance:.0%}: "
+              f"{', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,279 @@
+"""
+Computer-controlled fighters.
+
+A bot picks its input by trying each one out on a copy of the match: it
+restores the match state, holds an input for a few ticks, and scores where
+that leaves everyone. Deeper searches chain several of those segments, and
+every search stops when its time budget runs out, keeping the best answer from
+the deepest search it finished. Everyone else is assumed to keep holding
+whatever they held last, except that the bot also plans for the nearest one
+swinging straight away.
+
+Searches run in worker processes, so the game only copies the match state
+out and picks finished answers up, and never waits on a bot. Until a fresh
+answer arrives a bot keeps holding its last one, which also gives easier bots
+their slower reactions.
+
+    python bots.py [matches] [difficulty] [difficulty]    play bots against each other without a window
+"""
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from simulation import INPUT_ATTACK, INPUT_JUMP, INPUT_LEFT, INPUT_RIGHT, INPUT_THROW, REACH, STEERABLE, Match
+
+# Inputs a bot chooses between, each held for a whole search segment
+CHOICES = [
+    0,
+    INPUT_LEFT,
+    INPUT_RIGHT,
+    INPUT_JUMP,
+    INPUT_LEFT | INPUT_JUMP,
+    INPUT_RIGHT | INPUT_JUMP,
+    INPUT_ATTACK,
+    INPUT_LEFT | INPUT_ATTACK,
+    INPUT_RIGHT | INPUT_ATTACK,
+    INPUT_THROW,
+]
+SEGMENT_TICKS = 6  # Ticks each choice is held for in the search, about as often as a person changes keys
+SETTLE_TICKS = 60  # Most ticks a searched line is run on past its last segment to finish a swing or hitstun
+
+# Scoring a searched position, from the bot's point of view
+HEALTH_WEIGHT = 100  # Per point of health the bot has, and minus this per point anyone else has
+WIN_SCORE = 10000
+FALL_PENALTY = 1000  # For dropping below the bottom of the world, which is the same as losing
+PREFERRED_RANGE = REACH * 2 // 3  # Close enough for a swing to connect
+DISTANCE_WEIGHT = 1  # Per world unit further than that from the nearest opponent
+FACING_SCORE = 20  # For facing the nearest opponent
+
+
+class Difficulty:
+    """ How hard a bot tries: search depth, seconds of search per decision, and how often it decides """
+
+    def __init__(self, name, depth, budget, think_ticks, blunder):
+        self.name = name
+        self.depth = depth  # Segments looked ahead
+        self.budget = budget  # Seconds a search may run, the deepest finished search wins
+        self.think_ticks = think_ticks  # Ticks between decisions
+        self.blunder = blunder  # Chance of holding a random input instead of the best one
+
+
+DIFFICULTIES = {difficulty.name: difficulty for difficulty in (
+    Difficulty("easy", depth=1, budget=0.002, think_ticks=20, blunder=0.3),
+    Difficulty("normal", depth=2, budget=0.006, think_ticks=10, blunder=0.1),
+    Difficulty("hard", depth=3, budget=0.012, think_ticks=4, blunder=0.0),
+)}
+
+_executor = None
+_matches = {}  # Layout -> scratch match, one per worker process
+
+
+def layout_of(match):
+    """ What a worker needs to build a match the state can be loaded into """
+    return len(match.fighters), match.width, tuple(match.platforms), match.hazards
+
+
+def score(match, player):
+    """ How good the match looks for one fighter, higher is better """
+    fighters = match.fighters
+    me = fighters[player]
+    if match.game_over:
+        if match.winner == player:
+            return WIN_SCORE
+        if me.health == 0:
+            return -WIN_SCORE
+    value = HEALTH_WEIGHT * (me.health - sum(fighter.health for index, fighter in enumerate(fighters)
+                                             if index != player))
+    if me.y < 0:
+        value -= FALL_PENALTY
+
+    opponents = [fighter for index, fighter in enumerate(fighters) if index != player and fighter.health > 0]
+    if opponents:
+        nearest = min(opponents, key=lambda fighter: abs(fighter.x - me.x))
+        distance = nearest.x - me.x
+        value -= DISTANCE_WEIGHT * max(0, abs(distance) - PREFERRED_RANGE)
+        if distance * me.facing >= 0:
+            value += FACING_SCORE
+    return value
+
+
+def search(match, player, depth, deadline):
+    """
+    Best input for one fighter found by looking depth segments ahead, as (input, depth searched).
+    Stops at the deadline, except that a one segment search always finishes
+    """
+    root = match.get_state()
+    fighter = match.fighters[player]
+    inputs = [other.prev_input for other in match.fighters]  # Everyone else keeps doing what they were
+
+    def play(state, bits, ticks=SEGMENT_TICKS):
+        match.set_state(state)
+        inputs[player] = bits
+        for _ in range(ticks):
+            match.step(inputs)
+
+    def value_of(state, remaining):
+        """ Score of the best line from a state, with remaining segments left to choose """
+        if remaining == 0 or match.frozen:
+            # Let a swing or hitstun already under way play out, so it counts even past the horizon
+            ticks = 0
+            while fighter.state not in STEERABLE and not match.frozen and ticks < SETTLE_TICKS:
+                match.step(inputs)
+                ticks += 1
+            return score(match, player)
+        # Input does nothing mid-swing or in hitstun, so there is only one way forward
+        choices = CHOICES if fighter.state in STEERABLE else CHOICES[:1]
+        best = None
+        for bits in choices:
+            if time.perf_counter() > deadline:
+                raise TimeoutError
+            play(state, bits)
+            value = value_of(match.get_state(), remaining - 1)
+            if best is None or value > best:
+                best = value
+        return best
+
+    # The nearest opponent might hold on or swing during the first segment, the bot plans for the worse of the two
+    opponents = [index for index, other in enumerate(match.fighters) if index != player and other.health > 0]
+    nearest = min(opponents, key=lambda index: abs(match.fighters[index].x - fighter.x)) if opponents else None
+    held = inputs[nearest] if nearest is not None else 0
+    replies = [held, held | INPUT_ATTACK] if nearest is not None and not held & INPUT_ATTACK else [held]
+
+    choice = 0
+    searched = 0
+    try:
+        for level in range(1, depth + 1):
+            best = None
+            for bits in CHOICES:
+                value = None
+                for reply in replies:
+                    if level > 1 and time.perf_counter() > deadline:
+                        raise TimeoutError
+                    if nearest is not None:
+                        inputs[nearest] = reply
+                    play(root, bits)
+                    if nearest is not None:
+                        inputs[nearest] = held
+                    reply_value = value_of(match.get_state(), level - 1)
+                    if value is None or reply_value < value:
+                        value = reply_value
+                if best is None or value > best:  # Ties go to the earliest choice, standing still first
+                    best = value
+                    level_choice = bits
+            choice = level_choice
+            searched = level
+    except TimeoutError:
+        pass
+    match.set_state(root)
+    return choice, searched
+
+
+def decide(layout, state, player, depth, budget):
+    """ Worker process entry point: load the state into a scratch match and search it """
+    deadline = time.perf_counter() + budget
+    match = _matches.get(layout)
+    if match is None:
+        num_players, width, platforms, hazards = layout
+        match = _matches[layout] = Match(num_players=num_players, platforms=platforms, width=width, hazards=hazards)
+    match.set_state(state)
+    return search(match, player, depth, deadline)
+
+
+def start_workers(max_workers=None):
+    """ Start the search processes, shared by every match so later matches don't pay to start them """
+    global _executor
+    if _executor is None:
+        # Leave a core for the game itself
+        _executor = ProcessPoolExecutor(max_workers=max_workers or max(1, (os.cpu_count() or 2) - 1))
+        _executor.submit(int)  # Starts the processes now rather than on a bot's first decision
+    return _executor
+
+
+def stop_workers():
+    """ Stop the search processes, waiting at most one search budget for any still running """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+class Bot:
+    """ Chooses the input for one fighter, searching in a worker process or, without one, right away """
+
+    def __init__(self, player, difficulty="normal", seed=0, executor=None):
+        self.player = player
+        self.difficulty = DIFFICULTIES[difficulty] if isinstance(difficulty, str) else difficulty
+        self.rng = random.Random(seed)
+        self.executor = executor
+        self.future = None
+        self.bits = 0  # Held until the next decision arrives
+        self.next_tick = 0  # Match tick of the next decision
+        self.decisions = 0
+        self.depth_total = 0  # Segments searched over all decisions, for the average
+
+    def inputs(self, match):
+        """ This tick's input bits. Never blocks: a search still running keeps the previous input held """
+        future = self.future
+        if future is not None and future.done():
+            self.future = None
+            self.take(future.result())
+        if self.future is None and match.tick >= self.next_tick and not match.game_over:
+            self.next_tick = match.tick + self.difficulty.think_ticks
+            difficulty = self.difficulty
+            if self.executor is None:
+                self.take(search(match, self.player, difficulty.depth, time.perf_counter() + difficulty.budget))
+            else:
+                self.future = self.executor.submit(decide, layout_of(match), match.get_state(), self.player,
+                                                   difficulty.depth, difficulty.budget)
+        return self.bits
+
+    def take(self, result):
+        bits, depth = result
+        if self.rng.random() < self.difficulty.blunder:
+            bits = self.rng.choice(CHOICES)
+        self.bits = bits
+        self.decisions += 1
+        self.depth_total += depth
+
+    @property
+    def average_depth(self):
+        return self.depth_total / self.decisions if self.decisions else 0.0
+
+    def cancel(self):
+        if self.future is not None:
+            self.future.cancel()
+            self.future = None
+
+
+def play_match(difficulties, seed=0, max_ticks=60 * 120):
+    """ Bots against each other with searches run inline, returns the finished match and its bots """
+    match = Match(seed, len(difficulties))
+    bots = [Bot(player, difficulty, seed + player) for player, difficulty in enumerate(difficulties)]
+    while not match.frozen and match.tick < max_ticks:
+        match.step([bot.inputs(match) for bot in bots])
+    return match, bots
+
+
+if __name__ == "__main__":
+    import sys
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    difficulties = sys.argv[2:4] if len(sys.argv) > 3 else ["hard", "easy"]
+    wins = [0, 0]
+    depths = [0.0, 0.0]
+    ticks = 0
+    start = time.perf_counter()
+    for seed in range(count):
+        # The characters aren't evenly matched, so the bots swap sides every match
+        sides = [0, 1] if seed % 2 == 0 else [1, 0]  # Player -> bot
+        match, bots = play_match([difficulties[side] for side in sides], seed)
+        ticks += match.tick
+        if match.winner is not None:
+            wins[sides[match.winner]] += 1
+        for player, bot in enumerate(bots):
+            depths[sides[player]] += bot.average_depth / count
+    elapsed = time.perf_counter() - start
+    for side, difficulty in enumerate(difficulties):
+        print(f"Bot {side + 1} ({difficulty}): {wins[side]} wins, searched {depths[side]:.1f} segments deep")
+    print(f"{count - sum(wins)} draws or timeouts, {ticks} ticks in {elapsed:.1f}s")
@@ -0,0 +1,465 @@
+"""
+Player input: bindings, gamepads, per-tick input state and input latency.
+
+Key and gamepad events arrive whenever the window gets them, in between
+simulation ticks. InputState stamps each one with the time it arrived and
+queues it, and each tick folds the events up to that tick's time into the
+input bits the simulation reads:
+
+    held        left/right are whatever is held when the tick runs, so
+                releasing A while D is held keeps walking right
+    taps        a press and release between two ticks still counts once
+    presses     jump, attack and throw act on presses (the simulation looks
+                for the bit going from 0 to 1). A press the fighter can't act
+                on yet, mid-swing or in the air, is kept for buffer_ticks and
+                offered again until it takes, then it is dropped
+
+Whether a press took is read back from the fighter after the tick that used
+it, which online is input_delay ticks later. The simulation only ever sees
+the bits, so replays and rollback are unaffected.
+
+Bindings are per player: a dict of action -> key names (arcade.key names)
+and, for a player with a gamepad, the gamepad's index and a dict of action
+-> controls on it: "button0", an axis direction such as "x-" or "y+", or a
+hat direction such as "hat_left". --controls FILE loads them from JSON in
+the same shape as DEFAULT_BINDINGS.
+
+LatencyMeter times each input from the event to the end of the buffer swap
+of the first frame drawn after the tick that applied it, which is as close to
+the photons as software can see; with vsync on the swap returns when the
+frame starts going out to the display. Presses that had to wait in the buffer
+aren't timed, that wait is the fighter being busy rather than the game being
+slow.
+
+    python controls.py defaults     print the default bindings, to edit into a --controls file
+    python controls.py check        play scripted key sequences and check what the simulation saw
+    python controls.py latency      model input-to-photon latency at several frame rates and loads
+"""
+import argparse
+import json
+import random
+import sys
+from collections import deque
+
+from profiler import NULL_PROFILER, percentiles
+from simulation import (ATTACK, CHARACTERS, FIXED_DT, INPUT_ATTACK, INPUT_JUMP, INPUT_LEFT, INPUT_MOVES, INPUT_RIGHT,
+                        INPUT_THROW, JUMP, Match)
+from timestep import FixedTimestep
+
+ACTIONS = {"left": INPUT_LEFT, "right": INPUT_RIGHT, "jump": INPUT_JUMP, "attack": INPUT_ATTACK,
+           "throw": INPUT_THROW}
+HELD_BITS = INPUT_LEFT | INPUT_RIGHT  # Act for as long as they're held
+PRESS_BITS = INPUT_JUMP | INPUT_ATTACK | INPUT_THROW  # Act once per press
+MOVE_OF_BIT = {bit: move for bit, move in INPUT_MOVES}
+DEFAULT_BUFFER_TICKS = 6  # How long a press waits for the fighter to be able to act on it, 100 ms
+AXIS_DEADZONE = 0.5  # How far a stick has to be pushed to count as held
+HAT_DIRECTIONS = ("hat_left", "hat_right", "hat_up", "hat_down")
+LATENCY_WINDOW = 300  # Inputs the latency percentiles are taken over
+
+DEFAULT_BINDINGS = [
+    {"keys": {"left": ["A"], "right": ["D"], "jump": ["W"], "attack": ["R"], "throw": ["F"]},
+     "gamepad": 0,
+     "pad": {"left": ["x-", "hat_left"], "right": ["x+", "hat_right"], "jump": ["button0", "hat_up"],
+             "attack": ["button2"], "throw": ["button1"]}},
+    {"keys": {"left": ["LEFT"], "right": ["RIGHT"], "jump": ["UP"], "attack": ["SLASH"], "throw": ["PERIOD"]},
+     "gamepad": 1,
+     "pad": {"left": ["x-", "hat_left"], "right": ["x+", "hat_right"], "jump": ["button0", "hat_up"],
+             "attack": ["button2"], "throw": ["button1"]}},
+]
+
+
+class ControlsError(Exception):
+    """ The bindings couldn't be understood """
+
+
+def load_bindings(file_name):
+    """ Per-player bindings from a JSON file, see DEFAULT_BINDINGS for the shape """
+    try:
+        with open(file_name) as file:
+            players = json.load(file)
+    except (OSError, ValueError) as error:
+        raise ControlsError(f"Can't read {file_name}: {error}")
+    if not isinstance(players, list) or not all(isinstance(player, dict) for player in players):
+        raise ControlsError(f"{file_name} should hold a list with one object per player")
+    return players
+
+
+def is_pad_control(name):
+    if name.startswith("button"):
+        return name[6:].isdigit()
+    return name in HAT_DIRECTIONS or (len(name) > 1 and name[-1] in "+-" and name[:-1].isalpha())
+
+
+class Bindings:
+    """ Which keys and gamepad controls drive which player's input bits """
+
+    def __init__(self, players, key_code):
+        """ players as in DEFAULT_BINDINGS, key_code turns a key name into the code key events carry (or None) """
+        self.num_players = len(players)
+        self.sources = {}  # ("key", code) or ("pad", gamepad, control) -> (player, bit)
+        for player, spec in enumerate(players):
+            for action, names in spec.get("keys", {}).items():
+                for name in names:
+                    code = key_code(name)
+                    if code is None:
+                        raise ControlsError(f"Player {player + 1} {action}: there is no key called {name!r}")
+                    self.add(("key", code), player, action, name)
+            gamepad = spec.get("gamepad")
+            if gamepad is None:
+                continue
+            for action, names in spec.get("pad", {}).items():
+                for name in names:
+                    if not is_pad_control(name):
+                        raise ControlsError(f"Player {player + 1} {action}: {name!r} isn't a gamepad button, axis "
+                                            f"direction or hat direction")
+                    self.add(("pad", gamepad, name), player, action, name)
+
+    def add(self, source, player, action, name):
+        if action not in ACTIONS:
+            raise ControlsError(f"Player {player + 1}: unknown action {action!r}, pick from {', '.join(ACTIONS)}")
+        if source in self.sources:
+            raise ControlsError(f"{name} is bound twice")
+        self.sources[source] = (player, ACTIONS[action])
+
+
+class InputState:
+    """ Folds timestamped key and gamepad events into one tick of input bits per player at a time """
+
+    def __init__(self, bindings, buffer_ticks=DEFAULT_BUFFER_TICKS, latency=None):
+        self.bindings = bindings
+        self.buffer_ticks = buffer_ticks
+        self.latency = latency
+        self.events = deque()  # (timestamp, source, down) not folded into a tick yet
+        self.axes = {}  # (gamepad, axis) -> direction it's pushed, -1, 0 or 1
+        self.hats = {}  # gamepad -> (hat_x, hat_y)
+        self.expired = 0  # Presses dropped because the fighter couldn't act on them in time
+        self.reset(bindings.num_players)
+
+    def reset(self, num_players, delay=0):
+        """ Forget everything held and pending, for a new match whose inputs reach the fighters delay ticks late """
+        self.num_players = num_players
+        self.delay = delay
+        self.ticks = 0  # Ticks produced so far
+        self.events.clear()
+        self.held = [{} for _ in range(num_players)]  # Per player, source -> bit
+        # Per player, bit -> [timestamp (None once it's been turned down), last tick it may be offered on,
+        # tick it was offered on or None]
+        self.pending = [{} for _ in range(num_players)]
+        self.suppressed = [0] * num_players  # Press bits still held after their press expired, 0 until released
+        self.sent = [0] * num_players
+        self.last_sent = [0] * num_players  # What sent was before the latest tick, to undo it
+
+    def event(self, source, down, timestamp):
+        if source in self.bindings.sources:
+            self.events.append((timestamp, source, down))
+
+    def key_press(self, key, timestamp):
+        self.event(("key", key), True, timestamp)
+
+    def key_release(self, key, timestamp):
+        self.event(("key", key), False, timestamp)
+
+    def pad_button(self, gamepad, button, down, timestamp):
+        self.event(("pad", gamepad, f"button{button}"), down, timestamp)
+
+    def pad_axis(self, gamepad, axis, value, timestamp):
+        """ Sticks only send an event when they cross the dead zone, not for every small movement """
+        direction = 1 if value > AXIS_DEADZONE else -1 if value < -AXIS_DEADZONE else 0
+        previous = self.axes.get((gamepad, axis), 0)
+        if direction == previous:
+            return
+        self.axes[(gamepad, axis)] = direction
+        if previous:
+            self.event(("pad", gamepad, f"{axis}{'+' if previous > 0 else '-'}"), False, timestamp)
+        if direction:
+            self.event(("pad", gamepad, f"{axis}{'+' if direction > 0 else '-'}"), True, timestamp)
+
+    def pad_hat(self, gamepad, hat_x, hat_y, timestamp):
+        previous_x, previous_y = self.hats.get(gamepad, (0, 0))
+        self.hats[gamepad] = (hat_x, hat_y)
+        for previous, current, negative, positive in ((previous_x, hat_x, "hat_left", "hat_right"),
+                                                      (previous_y, hat_y, "hat_down", "hat_up")):
+            if previous != current:
+                if previous:
+                    self.event(("pad", gamepad, positive if previous > 0 else negative), False, timestamp)
+                if current:
+                    self.event(("pad", gamepad, positive if current > 0 else negative), True, timestamp)
+
+    def tick(self, until):
+        """ Input bits for the next tick, from every event up to the time until """
+        tick = self.ticks
+        events = self.events
+        sources = self.bindings.sources
+        while events and events[0][0] <= until:
+            timestamp, source, down = events.popleft()
+            player, bit = sources[source]
+            if player >= self.num_players:
+                continue
+            held = self.held[player]
+            if not down:
+                held.pop(source, None)
+            elif source not in held:  # Not a key repeat
+                held[source] = bit
+                # A newer press of the same bit takes over from one still waiting
+                self.pending[player][bit] = [timestamp, tick + self.buffer_ticks, None]
+
+        inputs = []
+        for player in range(self.num_players):
+            held_bits = 0
+            for bit in self.held[player].values():
+                held_bits |= bit
+            sent = self.sent[player]
+            bits = held_bits & HELD_BITS
+            waiting = 0
+            for bit, press in self.pending[player].items():
+                waiting |= bit
+                if press[2] is not None:
+                    bits |= held_bits & bit  # On its way, hold it as the keys are
+                elif bit & HELD_BITS or not sent & bit:
+                    bits |= bit  # Even if it was already released, so taps count
+                    press[2] = tick
+                # Otherwise it stays 0 this tick so the next offer is a fresh press
+            suppressed = self.suppressed[player] & held_bits
+            self.suppressed[player] = suppressed
+            bits |= held_bits & PRESS_BITS & ~waiting & ~suppressed
+            inputs.append(bits)
+        self.last_sent = self.sent
+        self.sent = inputs
+        self.ticks = tick + 1
+        return inputs
+
+    def confirm(self, fighters, applied=True):
+        """
+        After the tick's step: see which offered presses took. fighters[player]
+        is the fighter that player's bits drive, or None if they drive nobody
+        here. applied=False means the tick's inputs were never used (an online
+        stall) and the tick is taken back
+        """
+        if not applied:
+            self.ticks -= 1
+            self.sent = self.last_sent
+            for pending in self.pending:
+                for press in pending.values():
+                    if press[2] == self.ticks:
+                        press[2] = None
+            return
+        due = self.ticks - 1 - self.delay  # The tick whose inputs the step just used
+        for player, fighter in enumerate(fighters[:self.num_players]):
+            pending = self.pending[player]
+            for bit in [bit for bit, press in pending.items() if press[2] == due]:
+                timestamp, last_tick, _ = pending[bit]
+                if fighter is None or bit & HELD_BITS or took(fighter, bit):
+                    del pending[bit]
+                    if fighter is not None and timestamp is not None and self.latency is not None:
+                        self.latency.delivered(timestamp)
+                elif due >= last_tick:
+                    del pending[bit]
+                    self.expired += 1
+                    # Held on past its window it would be a late press the moment it's offered again
+                    self.suppressed[player] |= bit
+                else:
+                    # Waiting on the fighter says nothing about how responsive the game is, so it isn't timed
+                    pending[bit][0] = None
+                    pending[bit][2] = None
+
+
+def took(fighter, bit):
+    """ Whether the tick that just ran acted on a press of bit """
+    if bit == INPUT_JUMP:
+        return fighter.state == JUMP and fighter.state_ticks == 0 and fighter.change_y > 0
+    return fighter.state == ATTACK and fighter.state_ticks == 0 and fighter.move == MOVE_OF_BIT[bit]
+
+
+class GamepadEvents:
+    """ pyglet joystick event handlers feeding one gamepad into an InputState, for joystick.push_handlers() """
+
+    def __init__(self, controls, gamepad, clock):
+        self.controls = controls
+        self.gamepad = gamepad
+        self.clock = clock
+
+    def on_joybutton_press(self, joystick, button):
+        self.controls.pad_button(self.gamepad, button, True, self.clock())
+
+    def on_joybutton_release(self, joystick, button):
+        self.controls.pad_button(self.gamepad, button, False, self.clock())
+
+    def on_joyaxis_motion(self, joystick, axis, value):
+        self.controls.pad_axis(self.gamepad, axis, value, self.clock())
+
+    def on_joyhat_motion(self, joystick, hat_x, hat_y):
+        self.controls.pad_hat(self.gamepad, hat_x, hat_y, self.clock())
+
+
+class LatencyMeter:
+    """ Milliseconds from each input event to the frame that first shows it reaching the screen """
+
+    def __init__(self, window=LATENCY_WINDOW, profiler=NULL_PROFILER):
+        self.history = deque(maxlen=window)
+        self.profiler = profiler
+        self.waiting = []  # Timestamps of inputs a tick has applied that no frame has shown yet
+        self.count = 0
+
+    def delivered(self, timestamp):
+        self.waiting.append(timestamp)
+
+    def frame_shown(self, now):
+        """ Call once a frame has been swapped to the screen """
+        if not self.waiting:
+            return
+        for timestamp in self.waiting:
+            latency = (now - timestamp) * 1000
+            self.history.append(latency)
+            self.profiler.sample("input latency", latency)
+        self.count += len(self.waiting)
+        self.waiting.clear()
+
+    def report(self):
+        """ (inputs measured, p50, p95, p99) in milliseconds, over the last `window` inputs """
+        return (self.count, *percentiles(self.history))
+
+
+def name_codes(name):
+    """ Key codes for running without a window: each key's name is its code """
+    return name
+
+
+def play(script, buffer_ticks=DEFAULT_BUFFER_TICKS, delay=0):
+    """
+    Run a match with one scripted player. script maps a tick to the key
+    events (name, down) that arrive partway through it. Returns the
+    InputState and the bits player 1 was given on every tick
+    """
+    controls = InputState(Bindings(DEFAULT_BINDINGS, name_codes), buffer_ticks)
+    match = Match(0)
+    controls.reset(len(match.fighters), delay)
+    queued = deque([0] * delay)  # Online-style input delay: bits reach the match this many ticks late
+    given = []
+    for tick in range(max(script) + 60):
+        for name, down in script.get(tick, []):
+            controls.event(("key", name), down, tick + 0.5)
+        inputs = controls.tick(tick + 1)
+        given.append(inputs[0])
+        queued.append(inputs[0])
+        match.step([queued.popleft(), 0])
+        controls.confirm(match.fighters)
+    return controls, given
+
+
+def presses(given, bit):
+    """ Ticks where bit went from 0 to 1, which is what the simulation acts on """
+    return [tick for tick, bits in enumerate(given) if bits & bit and not (tick and given[tick - 1] & bit)]
+
+
+def check():
+    """ Scripted key sequences and what the simulation must have seen for each. Returns the number that failed """
+    attack_ticks = CHARACTERS[Match(0).fighters[0].character].moves[MOVE_OF_BIT[INPUT_ATTACK]].duration
+    cases = [
+        # Releasing left while right is held keeps walking right
+        ("release while another is held", {0: [("D", True)], 2: [("A", True)], 4: [("A", False)]},
+         lambda given, controls: given[3] & HELD_BITS == HELD_BITS and given[5] & HELD_BITS == INPUT_RIGHT),
+        # Pressed and released between two ticks, the attack still happens
+        ("tap between ticks", {3: [("R", True), ("R", False)]},
+         lambda given, controls: presses(given, INPUT_ATTACK) == [3]),
+        # Pressed again mid-swing and held, the second attack starts as soon as the first one ends
+        ("press buffered through a swing",
+         {0: [("R", True), ("R", False)], attack_ticks - 3: [("R", True)]},
+         lambda given, controls: len(presses(given, INPUT_ATTACK)) >= 2 and controls.expired == 0),
+        # Pressed too early for the buffer, it's dropped rather than firing late
+        ("press expires", {0: [("R", True), ("R", False)], 2: [("R", True)]},
+         lambda given, controls: controls.expired == 1 and all(tick < attack_ticks for tick in
+                                                              presses(given, INPUT_ATTACK))),
+        # Holding attack doesn't repeat it
+        ("hold doesn't repeat", {0: [("R", True)]},
+         lambda given, controls: presses(given, INPUT_ATTACK) == [0]),
+    ]
+    failures = 0
+    for delay in (0, 2):
+        for name, script, passed in cases:
+            controls, given = play(script, delay=delay)
+            ok = passed(given, controls)
+            print(f"{name + (f' (input delay {delay})' if delay else ''):<48}{'ok' if ok else 'FAILED'}")
+            if not ok:
+                failures += 1
+    return failures
+
+
+def model_latency(fps, load_ms, seconds=30, buffer_ticks=DEFAULT_BUFFER_TICKS, seed=0):
+    """
+    Input-to-photon latency of the game loop, modelled without a window. A
+    frame starts every 1/fps seconds (0 for back to back, as --fps 0 does) or
+    as soon as the last one finished if it ran long, and spends load_ms
+    updating and drawing. Key presses arrive at random times and are picked up
+    at the start of the next frame, but timed from when they arrived. Uses the
+    real FixedTimestep, InputState and Match. Returns the LatencyMeter and how
+    many presses expired
+    """
+    rng = random.Random(seed)
+    meter = LatencyMeter()
+    controls = InputState(Bindings(DEFAULT_BINDINGS, name_codes), buffer_ticks, meter)
+    events = []
+    time = 0.0
+    while time < seconds:
+        time += rng.expovariate(4)
+        key = rng.choice("ADWRF")
+        events.append((time, key, True))
+        events.append((time + rng.uniform(0.03, 0.2), key, False))
+    events.sort()
+    events = deque(events)
+
+    match = Match(seed)
+    controls.reset(len(match.fighters))
+    timestep = FixedTimestep()
+    frame_time = 1 / fps if fps else 0.0
+    now = last_frame = 0.0
+    while now < seconds:
+        start = now
+        while events and events[0][0] <= now:
+            timestamp, key, down = events.popleft()
+            controls.event(("key", key), down, timestamp)
+        ticks = timestep.advance(now - last_frame)
+        last_frame = now
+        for index in range(ticks):
+            match.step(controls.tick(now - (ticks - 1 - index) * FIXED_DT))
+            controls.confirm(match.fighters)
+            if match.frozen:
+                match = Match(match.seed + 1)
+                controls.reset(len(match.fighters))
+        now += load_ms / 1000 * rng.uniform(0.8, 1.2)
+        meter.frame_shown(now)
+        now = max(now, start + frame_time)
+    return meter, controls.expired
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Input bindings, buffering and latency")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("defaults", help="print the default bindings as JSON")
+    commands.add_parser("check", help="play scripted key sequences and check what the simulation saw")
+    latency = commands.add_parser("latency", help="model input-to-photon latency at several frame rates and loads")
+    latency.add_argument("--fps", type=int, nargs="+", default=[60, 144, 240, 0], help="0 for uncapped")
+    latency.add_argument("--load", type=float, nargs="+", default=[2, 8, 14],
+                         help="milliseconds each frame spends updating and drawing")
+    latency.add_argument("--buffer", type=int, default=DEFAULT_BUFFER_TICKS, help="press buffer in ticks")
+    latency.add_argument("--seconds", type=float, default=30)
+    args = parser.parse_args(argv)
+
+    if args.command == "defaults":
+        print(json.dumps(DEFAULT_BINDINGS, indent=2))
+        return 0
+    if args.command == "check":
+        failures = check()
+        print("Inputs reach the simulation as expected" if not failures else f"{failures} input checks failed")
+        return 1 if failures else 0
+
+    print(f"{'fps':>8}{'load ms':>9}{'inputs':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'expired':>9}")
+    for fps in args.fps:
+        for load in args.load:
+            meter, expired = model_latency(fps, load, args.seconds, args.buffer)
+            count, p50, p95, p99 = meter.report()
+            print(f"{fps or 'uncapped':>8}{load:>9.1f}{count:>8}{p50:>8.1f}{p95:>8.1f}{p99:>8.1f}{expired:>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
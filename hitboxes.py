@@ -0,0 +1,169 @@
+"""
+Per-frame hitboxes and hurtboxes measured from the spritesheets.
+
+Every frame is scanned once for opaque pixels. Whatever sticks out in front of
+the character's standing pose (the first walk frame) is the blade and becomes
+the frame's hitboxes, everything else is body and becomes its hurtboxes. Each
+set is a few axis-aligned boxes, one per horizontal band of the frame, in world
+units relative to the bottom center of the sprite with the character facing
+right.
+
+Scanning needs PIL, so the results are kept in a sidecar file, hitboxes.json,
+along with a hash of each sheet. load() only rescans when a sheet has changed
+or the file is missing; servers and CI without PIL just read the file.
+
+    python hitboxes.py    rescan every sheet and rewrite hitboxes.json
+"""
+import hashlib
+import json
+from os import path
+
+import log
+
+DIR = path.dirname(path.abspath(__file__))
+SIDECAR = "hitboxes.json"
+SIDECAR_VERSION = 1
+
+# Each frame in the sprite sheets is 48x48 pixels, drawn at twice that size
+FRAME_WIDTH = 48
+FRAME_HEIGHT = 48
+SPRITE_SCALE = 2
+BANDS = 3  # Horizontal bands per frame: head, torso and legs each get their own box
+ALPHA_THRESHOLD = 0  # Pixels with more alpha than this are solid
+
+# Sheets measured for each character, in player order: (name, walk sheet, attack sheet, way the art faces)
+CHARACTER_SHEETS = [
+    ("captain", "Captain_walk.png", "Captain_attack1.png", 1),
+    ("knightro", "Knightro_walk_flip.png", "Knightro_attack.png", -1),
+]
+
+logger = log.get_logger("hitboxes")
+
+
+def file_hash(file_name):
+    with open(path.join(DIR, file_name), "rb") as file:
+        return hashlib.blake2b(file.read(), digest_size=8).hexdigest()
+
+
+def solid_columns(alpha, width, frame):
+    """ (first, last) solid column of one frame, counted from the frame's left edge """
+    columns = [x for x in range(FRAME_WIDTH)
+               if any(alpha[y * width + frame * FRAME_WIDTH + x] > ALPHA_THRESHOLD for y in range(FRAME_HEIGHT))]
+    return (columns[0], columns[-1]) if columns else (0, FRAME_WIDTH - 1)
+
+
+def band_boxes(pixels, facing):
+    """ One world-space box per band around the given (x, y) frame pixels, mirrored to face right """
+    bands = {}
+    for x, y in pixels:
+        band = bands.setdefault(y * BANDS // FRAME_HEIGHT, [x, y, x, y])
+        band[0] = min(band[0], x)
+        band[1] = min(band[1], y)
+        band[2] = max(band[2], x)
+        band[3] = max(band[3], y)
+
+    boxes = []
+    half = FRAME_WIDTH // 2
+    for x0, y0, x1, y1 in (bands[band] for band in sorted(bands, reverse=True)):  # Bottom band first
+        left = (x0 - half) * SPRITE_SCALE
+        right = (x1 + 1 - half) * SPRITE_SCALE
+        if facing < 0:
+            left, right = -right, -left
+        boxes.append([left, (FRAME_HEIGHT - 1 - y1) * SPRITE_SCALE, right, (FRAME_HEIGHT - y0) * SPRITE_SCALE])
+    return boxes
+
+
+def measure_sheet(alpha, width, facing, body=None):
+    """
+    Hurtboxes and hitboxes of every frame in a sheet, from its alpha channel (one byte per pixel, top row first).
+    body is the (first, last) column of the standing pose, pixels in front of it are hitboxes
+    """
+    frames = []
+    for frame in range(width // FRAME_WIDTH):
+        hurt = []
+        hit = []
+        for y in range(FRAME_HEIGHT):
+            row = y * width + frame * FRAME_WIDTH
+            for x in range(FRAME_WIDTH):
+                if alpha[row + x] <= ALPHA_THRESHOLD:
+                    continue
+                in_front = body is not None and (x > body[1] if facing > 0 else x < body[0])
+                (hit if in_front else hurt).append((x, y))
+        frames.append({"hurt": band_boxes(hurt, facing), "hit": band_boxes(hit, facing)})
+    return frames
+
+
+def read_alpha(file_name):
+    """ (alpha bytes, width) of an image, needs PIL """
+    from PIL import Image
+    image = Image.open(path.join(DIR, file_name)).convert("RGBA")
+    if image.height != FRAME_HEIGHT:
+        raise ValueError(f"{file_name} is {image.height} pixels tall, sheets are one row of {FRAME_HEIGHT}")
+    return image.getchannel("A").tobytes(), image.width
+
+
+def measure_character(name, walk_sheet, attack_sheet, facing, read=read_alpha):
+    walk_alpha, walk_width = read(walk_sheet)
+    attack_alpha, attack_width = read(attack_sheet)
+    body = solid_columns(walk_alpha, walk_width, 0)
+    return {
+        "name": name,
+        "sheets": {walk_sheet: file_hash(walk_sheet), attack_sheet: file_hash(attack_sheet)},
+        "walk": measure_sheet(walk_alpha, walk_width, facing),
+        "attack": measure_sheet(attack_alpha, attack_width, facing, body),
+    }
+
+
+def build(file_name=SIDECAR, read=read_alpha):
+    """ Measure every character and write the sidecar file """
+    data = {"version": SIDECAR_VERSION, "scale": SPRITE_SCALE,
+            "characters": [measure_character(*sheets, read=read) for sheets in CHARACTER_SHEETS]}
+    with open(path.join(DIR, file_name), "w") as file:
+        json.dump(data, file, separators=(",", ":"))
+    return data
+
+
+def is_current(data):
+    """ True if the sidecar was built from the sheets as they are now """
+    if data.get("version") != SIDECAR_VERSION or data.get("scale") != SPRITE_SCALE:
+        return False
+    characters = data.get("characters", [])
+    if [character["name"] for character in characters] != [sheets[0] for sheets in CHARACTER_SHEETS]:
+        return False
+    try:
+        return all(file_hash(sheet) == digest
+                   for character in characters for sheet, digest in character["sheets"].items())
+    except OSError:
+        return False
+
+
+def load(file_name=SIDECAR):
+    """ The measured characters, rescanning first if the sidecar is missing or out of date. [] if neither works """
+    data = None
+    try:
+        with open(path.join(DIR, file_name)) as file:
+            data = json.load(file)
+        if is_current(data):
+            return data["characters"]
+    except (OSError, ValueError):
+        pass
+
+    try:
+        return build(file_name)["characters"]
+    except ImportError:
+        reason = "PIL is not installed"
+    except (OSError, ValueError) as error:
+        reason = str(error)
+    if data is not None:
+        logger.warning("%s is out of date and can't be rebuilt (%s), using it anyway", file_name, reason)
+        return data.get("characters", [])
+    logger.warning("No %s and it can't be built (%s), falling back to plain body boxes", file_name, reason)
+    return []
+
+
+if __name__ == "__main__":
+    for character in build()["characters"]:
+        active = [index for index, frame in enumerate(character["attack"]) if frame["hit"]]
+        print(f"{character['name']}: {len(character['walk'])} walk frames, "
+              f"{len(character['attack'])} attack frames, blade out on frames {active}")
+    print(f"Wrote {SIDECAR}")
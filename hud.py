@@ -0,0 +1,152 @@
+"""
+Retained-mode HUD.
+
+Hearts, player icons and the game over box live in SpriteLists that are
+built once and only changed when the state they show changes, and text is
+kept in arcade.Text objects that are only re-laid-out when their string
+changes. Drawing the HUD is then a fixed handful of draw calls per frame.
+"""
+import arcade
+
+# Where each side of the HUD goes: (icon x, first heart x, step between hearts).
+# Even players are stacked down the left side and odd players down the right.
+PLAYER_HUD_LAYOUT = [(45, 110, 45), (955, 890, -45)]
+HEART_Y = 440
+HEART_WIDTH = 55
+HEART_HEIGHT = 45
+ICON_Y = 450
+ICON_SIZE = 75
+ROW_HEIGHT = 80  # Vertical gap between rows when there are more than two players
+
+OVERLAY_REFRESH = 15  # Frames between profiler overlay updates
+OVERLAY_FONT = ("Consolas", "Courier New", "DejaVu Sans Mono")
+OVERLAY_LINE_HEIGHT = 14
+OVERLAY_WIDTH = 330
+
+
+def texture_sprite(texture, center_x, center_y, width, height):
+    """ A sprite that shows a texture stretched to the given size """
+    sprite = arcade.Sprite(texture=texture, center_x=center_x, center_y=center_y)
+    sprite.width = width
+    sprite.height = height
+    return sprite
+
+
+class CachedText:
+    """ arcade.Text that only re-lays-out when its string or color actually changes """
+
+    def __init__(self, text, x, y, color, size, **kwargs):
+        self.value = text
+        self.label = arcade.Text(text, x, y, color, size, **kwargs)
+
+    def set(self, text=None, color=None):
+        if text is not None and text != self.value:
+            self.value = text
+            self.label.text = text
+        if color is not None and tuple(color) != tuple(self.label.color[:len(color)]):
+            self.label.color = color
+
+    def draw(self):
+        self.label.draw()
+
+
+class Hud:
+    """ Hearts, icons and game over overlay for GameBoard """
+
+    def __init__(self, heart_texture, icon_textures, screen_width, screen_height):
+        self.heart_texture = heart_texture
+        self.sprite_list = arcade.SpriteList()
+        self.hearts = [[] for _ in icon_textures]  # Heart sprites currently shown per player
+        # Rows shrink so every player still fits on screen
+        rows = (len(icon_textures) + 1) // 2
+        self.scale = min(1.0, screen_height / (rows * ROW_HEIGHT))
+
+        # Drawing player icons
+        for player, texture in enumerate(icon_textures):
+            icon_x, _, _ = PLAYER_HUD_LAYOUT[player % 2]
+            icon_size = ICON_SIZE * self.scale
+            self.sprite_list.append(
+                texture_sprite(texture, icon_x, self.row_y(player, ICON_Y), icon_size, icon_size)
+            )
+
+        # Game over box, drawn with the text over it
+        self.overlay = arcade.ShapeElementList()
+        self.overlay.append(arcade.create_rectangle_filled(500, 260, 390, 70, (200, 200, 200, 150)))
+        self.winner_text = CachedText("", screen_width // 2, screen_height // 2, arcade.color.BLACK, 25,
+                                      font_name="Kenney Rocket", anchor_x="center")
+        self.escape_text = CachedText("Press ESC to Return to Main Menu", screen_width // 2,
+                                      screen_height // 2 - 40, arcade.color.RED, 20,
+                                      font_name="Kenney Rocket", anchor_x="center")
+
+    def row_y(self, player, y):
+        return y - (player // 2) * ROW_HEIGHT * self.scale
+
+    def set_health(self, player, health):
+        """ Add or remove heart sprites, only when a player's health has changed """
+        hearts = self.hearts[player]
+        icon_x, first_x, step = PLAYER_HUD_LAYOUT[player % 2]
+        first_x = icon_x + (first_x - icon_x) * self.scale
+        while len(hearts) < health:
+            heart = texture_sprite(self.heart_texture, first_x + len(hearts) * step * self.scale,
+                                   self.row_y(player, HEART_Y), HEART_WIDTH * self.scale, HEART_HEIGHT * self.scale)
+            hearts.append(heart)
+            self.sprite_list.append(heart)
+        while len(hearts) > health:
+            self.sprite_list.remove(hearts.pop())
+
+    def set_winner(self, winner):
+        self.winner_text.set(f"{winner} Wins!")
+
+    def draw(self):
+        self.sprite_list.draw()
+
+    def draw_game_over(self):
+        self.overlay.draw()
+        self.winner_text.draw()
+        self.escape_text.draw()
+
+
+class ProfilerOverlay:
+    """ Per-stage frame times from a profiler.Profiler, refreshed a few times a second """
+
+    def __init__(self, profiler, x=10, y=10, refresh=OVERLAY_REFRESH):
+        self.profiler = profiler
+        self.x = x
+        self.y = y
+        self.refresh = refresh
+        self.visible = True
+        self.lines = []  # CachedText per row, the header first
+        self.background = None
+        self.rows = 0
+
+    def toggle(self):
+        self.visible = not self.visible
+
+    def draw(self):
+        if not self.visible:
+            return
+        # Re-reading the percentiles every frame would cost more than most of the stages it shows
+        if self.profiler.frames % self.refresh == 0 or not self.lines:
+            self.update()
+        if self.background is not None:
+            self.background.draw()
+        for line in self.lines:
+            line.draw()
+
+    def update(self):
+        rows = [f"{'stage':<16}{'last':>7}{'p50':>7}{'p95':>7}{'p99':>7}"]
+        rows += [f"{name:<16}{last:>7.2f}{p50:>7.2f}{p95:>7.2f}{p99:>7.2f}"
+                 for name, last, p50, p95, p99 in self.profiler.report()]
+        while len(self.lines) < len(rows):
+            self.lines.append(CachedText("", self.x + 6, 0, arcade.color.WHITE, 10, font_name=OVERLAY_FONT))
+        for index, (line, text) in enumerate(zip(self.lines, rows)):
+            line.set(text)
+            line.label.y = self.y + 6 + (len(rows) - 1 - index) * OVERLAY_LINE_HEIGHT
+
+        # The box only needs rebuilding when a stage shows up for the first time
+        if len(rows) != self.rows:
+            self.rows = len(rows)
+            height = len(rows) * OVERLAY_LINE_HEIGHT + 8
+            self.background = arcade.ShapeElementList()
+            self.background.append(arcade.create_rectangle_filled(self.x + OVERLAY_WIDTH / 2, self.y + height / 2,
+                                                                  OVERLAY_WIDTH, height, (0, 0, 0, 180)))
@@ -0,0 +1,159 @@
+"""
+Tile-map levels.
+
+A level is a text file: a few "key value" header lines, then the map itself,
+one character per tile with the top row first. Blank lines and lines starting
+with # are ignored, and a header key the loader doesn't know is an error
+rather than the first row of the map.
+
+    tile_size 64
+    tileset island_map_platform.jpg 62
+    background island_map.jpg
+    tile = 10 0
+    tile % 10 2
+
+    ..P........P..
+    ==============
+
+`tile <char> <column> <row>` picks which square of the tileset image a
+character is drawn with; every tile character is solid. P marks a spawn point,
+> and < are cannons firing right and left along their row, v drops barrels
+from the top of its square, and any other character is empty space. Like the
+rest of the simulation this module doesn't import arcade, so servers and
+benchmarks can load levels too.
+"""
+from os import path
+
+from projectiles import BARREL, BARREL_PERIOD, CANNON_PERIOD, CANNONBALL
+from simulation import FIGHTER_WIDTH, Match, build_platform_hash
+
+DIR = path.dirname(path.abspath(__file__))
+EMPTY = "."
+SPAWN = "P"
+CANNONS = {">": 1, "<": -1}  # Character -> direction it fires
+BARRELS = "v"
+SETTINGS = ("tile_size", "tileset", "background", "tile")  # Header keys, before the map
+HAZARD_STAGGER = 37  # Ticks between neighbouring hazards' shots, so they don't all fire at once
+CHUNK_TILES = 16  # Tiles per side of a chunk, the unit the renderer culls by
+
+
+class LevelError(ValueError):
+    """ The level file couldn't be understood """
+
+
+class Level:
+    """ A parsed tile map, in world coordinates with y going up from the bottom row """
+
+    def __init__(self, name, rows, tile_size=64, tileset=None, tileset_tile_size=None, background=None, tiles=None,
+                 file_path=None):
+        self.name = name
+        self.path = file_path or name  # The file it was read from, what another process should pass to load_level
+        self.tile_size = tile_size
+        self.tileset = tileset  # Image the tile textures are cut from
+        self.tileset_tile_size = tileset_tile_size or tile_size
+        self.background = background
+        self.tile_kinds = tiles or {}  # Character -> (column, row) in the tileset
+        self.columns = max(len(row) for row in rows)
+        self.rows = len(rows)
+        self.width = self.columns * tile_size
+        self.height = self.rows * tile_size
+
+        self.tiles = []  # (column, row, character), row 0 at the bottom
+        self.spawns = []  # (center x, bottom y)
+        self.hazards = []  # Emitters for Match, see projectiles.py
+        for index, line in enumerate(rows):
+            row = self.rows - 1 - index
+            for column, char in enumerate(line):
+                if char == SPAWN:
+                    self.spawns.append(((column + 0.5) * tile_size, row * tile_size))
+                elif char in self.tile_kinds:
+                    self.tiles.append((column, row, char))
+                elif char in CANNONS:
+                    direction = CANNONS[char]
+                    x = (column + 0.5 + direction / 2) * tile_size
+                    self.add_hazard(CANNONBALL, x, x, (row + 0.5) * tile_size, direction, CANNON_PERIOD)
+                elif char == BARRELS:
+                    self.add_hazard(BARREL, column * tile_size, (column + 1) * tile_size, (row + 1) * tile_size, 1,
+                                    BARREL_PERIOD)
+        if not self.spawns:
+            raise LevelError(f"{name} has no spawn points ({SPAWN})")
+        self.platforms = self.merge_runs()
+        self.platform_hash = build_platform_hash(self.platforms)  # Shared, read-only, by every match on the level
+
+    def add_hazard(self, kind, left, right, y, direction, period):
+        phase = len(self.hazards) * HAZARD_STAGGER % period
+        self.hazards.append((kind, left, right, y, direction, period, phase))
+
+    def merge_runs(self):
+        """ One box per horizontal run of solid tiles, so a long floor is one collision check, not dozens """
+        size = self.tile_size
+        solid = {(column, row) for column, row, _ in self.tiles}
+        boxes = []
+        for column, row, _ in sorted(self.tiles, key=lambda tile: (tile[1], tile[0])):
+            if (column - 1, row) in solid:
+                continue  # Part of a run that started further left
+            end = column
+            while (end + 1, row) in solid:
+                end += 1
+            boxes.append((column * size, row * size, (end + 1) * size, (row + 1) * size))
+        return boxes
+
+    def chunks(self):
+        """ Tiles grouped by (chunk x, chunk y) """
+        chunks = {}
+        for tile in self.tiles:
+            chunks.setdefault((tile[0] // CHUNK_TILES, tile[1] // CHUNK_TILES), []).append(tile)
+        return chunks
+
+    def spawn_positions(self, num_players):
+        """ Spawn points in file order, squeezing extra players in beside the marked ones """
+        positions = []
+        for index in range(num_players):
+            x, y = self.spawns[index % len(self.spawns)]
+            offset = (index // len(self.spawns)) * FIGHTER_WIDTH * 1.5
+            positions.append((min(max(x + offset, FIGHTER_WIDTH), self.width - FIGHTER_WIDTH), y))
+        return positions
+
+    def new_match(self, seed=0, num_players=2):
+        return Match(seed, num_players, platforms=self.platforms, width=self.width,
+                     spawns=self.spawn_positions(num_players), platform_hash=self.platform_hash, hazards=self.hazards)
+
+
+def load_level(file_name):
+    """ Read a level file, relative paths are looked up next to main.py """
+    full_path = path.join(DIR, file_name)
+    with open(full_path) as file:
+        lines = [line.rstrip("\n") for line in file]
+
+    settings = {"tile_size": 64, "tileset": None, "tileset_tile_size": None, "background": None, "tiles": {}}
+    rows = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip() or line.startswith("#"):
+            continue
+        key, _, value = line.partition(" ")
+        if not rows and value and key.isidentifier() and key not in SETTINGS:
+            raise LevelError(f"{file_name}:{number}: unknown setting {key!r}, expected one of {', '.join(SETTINGS)}")
+        try:
+            if rows or key not in SETTINGS:
+                rows.append(line)
+            elif key == "tile_size":
+                settings["tile_size"] = int(value)
+            elif key == "tileset":
+                image, _, size = value.partition(" ")
+                settings["tileset"] = image
+                settings["tileset_tile_size"] = int(size) if size else None
+            elif key == "background":
+                settings["background"] = value
+            else:
+                char, column, row = value.split()
+                settings["tiles"][char] = (int(column), int(row))
+        except ValueError:
+            raise LevelError(f"{file_name}:{number}: can't read {line!r}")
+    if not rows:
+        raise LevelError(f"{file_name} has no map")
+    try:
+        relative = path.relpath(full_path, DIR)
+    except ValueError:
+        relative = path.pardir  # On another drive
+    file_path = full_path if relative.startswith(path.pardir) else relative
+    return Level(file_name, rows, file_path=file_path, **settings)
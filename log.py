@@ -0,0 +1,71 @@
+"""
+Leveled logging that stays off the game loop.
+
+Records are put on a queue and written out by a background thread, so a slow
+terminal never holds up a frame. Each call site may log a few messages a
+second; extra ones are dropped and counted, and the count is added to the
+next message from that site that gets through.
+
+    log = get_logger("game")
+    log.info("Player %d hit! Health: %d", 2, 4)
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+
+ROOT = "pirate_cove"
+RATE_LIMIT = 5  # Messages per second from any one call site
+FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """ Lets at most `per_second` records a second through from each line of code """
+
+    def __init__(self, per_second=RATE_LIMIT):
+        super().__init__()
+        self.per_second = per_second
+        self.windows = {}  # (file, line) -> [window start, records let through, records dropped]
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        window = self.windows.get(key)
+        if window is None or record.created - window[0] >= 1.0:
+            dropped = window[2] if window is not None else 0
+            self.windows[key] = [record.created, 1, 0]
+            if dropped:
+                record.msg = f"{record.msg} ({dropped} more like this dropped)"
+            return True
+        if window[1] < self.per_second:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+def setup(level=logging.INFO):
+    """ Send the game's log records through the queue to stderr, safe to call more than once """
+    global _listener
+    logger = logging.getLogger(ROOT)
+    logger.setLevel(level)
+    if _listener is not None:
+        return logger
+
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(RateLimitFilter())  # Filter before queueing, dropped records cost almost nothing
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter(FORMAT, "%H:%M:%S"))
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop)  # Flush whatever is still queued on the way out
+    return logger
+
+
+def get_logger(name):
+    return logging.getLogger(f"{ROOT}.{name}")
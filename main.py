@@ -1,141 +1,287 @@
 import arcade
+import argparse
+import pyglet
+import logging
+import os
 import random
-from os import path
+import time
+
+import assets
+import bots
+import log
+from assets import FRAME_HEIGHT
+from controls import (DEFAULT_BINDINGS, DEFAULT_BUFFER_TICKS, Bindings, ControlsError, GamepadEvents, InputState,
+                      LatencyMeter, load_bindings)
+from hitboxes import SPRITE_SCALE
+from hud import CachedText, Hud, ProfilerOverlay, texture_sprite
+from levels import load_level
+from particles import ConfettiSystem, ParticleSystem, ProjectileLayer, emit_hit_sparks
+from netplay import NetworkThread, RollbackSession, parse_address
+from profiler import NULL_PROFILER, Profiler
+from replay import ReplayWriter
+from spectate import DEFAULT_DELAY, RELAY_PORT, SpectatorFeed, Watcher, start_relay
+from simulation import FIGHTER_HEIGHT, FIXED_DT, Match
+from tilemap import ChunkLayer, FollowCamera
+from timestep import FixedTimestep, lerp
+from views import ViewManager
 
 # Defined constants for the screen size
 SCREEN_WIDTH = 1000
 SCREEN_HEIGHT = 500
 SCREEN_TITLE = "Pirate Cove Multiplayer PvP"
-GRAVITY = 0.5  # Gravity constant
-PLAYER_JUMP_SPEED = 10  # Jumping speed
 SPRITE_SCALING = 1.0
 DELAY_TIME = 0.3  # Delay in seconds
+FIRST_FRAME_BUDGET = 0.25  # Seconds from launch to the first menu frame
+MATCH_LOAD_BUDGET = 0.1  # Seconds from the menu timer firing to the match showing
+DEFAULT_FPS = 60  # Frames drawn per second unless --fps says otherwise, the simulation always ticks at 60
+UNCAPPED_INTERVAL = 1 / 1000  # Update interval for --fps 0, pyglet needs some interval to schedule
+REPLAY_DIR = None  # Folder every match is recorded to, set with --record
+ONLINE = None  # (local player, local port, remote address, seed) when playing over the network
+PROFILER = NULL_PROFILER  # Set with --profile or --trace
+LEVEL = None  # Tile-map level to play on instead of the single-screen arena, set with --level
+BOT = None  # Difficulty the computer plays player 2 at, set with --bot
+BROADCAST = None  # Port of the local relay every match is streamed to, set with --broadcast
+WATCH = None  # Watcher playing back someone else's broadcast, set with --spectate
+BINDINGS = DEFAULT_BINDINGS  # Keys and gamepad controls per player, see controls.py, set with --controls
+INPUT_BUFFER = DEFAULT_BUFFER_TICKS  # Ticks a press waits for its fighter to be free to act, set with --input-buffer
+LATENCY = LatencyMeter()  # Input-to-photon latency, fed by GameWindow.flip()
+VIEWS = None  # One of each screen, built on first use and reused after, see views.py
+PROFILER_KEY = arcade.key.F3  # Shows and hides the profiler overlay
 
-# Each frame in the sprite sheet is 48x48 pixels
-FRAME_WIDTH = 48
-FRAME_HEIGHT = 48
-NUM_FRAMES_WALK = 6  # Number of frames for walking animations
-NUM_FRAMES_ATTACK_1 = 6  # Number of frames for player 1 attack animation
-NUM_FRAMES_ATTACK_2 = 6  # Number of frames for player 2 attack animation
+logger = log.get_logger("game")
 
-DIR = path.dirname(path.abspath(__file__))
+
+def key_code(name):
+    """ arcade.key's code for a key name in the bindings, such as "A" or "LEFT" """
+    return getattr(arcade.key, name.upper(), None)
+
+
+class GameWindow(arcade.Window):
+    """ The game's window, which notes when each frame has been handed to the display """
+
+    def flip(self):
+        super().flip()
+        LATENCY.frame_shown(time.perf_counter())
 
 
 class MainMenu(arcade.View):
     """ Main Menu View """
 
-    def __init__(self):
+    def __init__(self, launch_time=None):
         super().__init__()
-        self.texture = arcade.load_texture(path.join(DIR, "main_background.png"))
-        self.game_start_color = arcade.color.BLACK  # Default color for "START GAME"
-        self.how_to_play_color = arcade.color.BLACK  # Default color for "HOW TO PLAY"
+        self.texture = None  # Shown once the preloader has decoded it
+        self.background_list = arcade.SpriteList()
+        self.is_transitioning = False
+
+        # Text is laid out once here, key presses only change its color
+        self.title_text = CachedText("Pirate's Cove", 10, 440, arcade.color.BLACK, 40, font_name="Kenney Blocks")
+        self.game_start_text = CachedText("PLAY - B", 10, 390, arcade.color.BLACK, 30, font_name="Kenney Blocks")
+        self.how_to_play_text = CachedText("HOW TO PLAY - I", 10, 340, arcade.color.BLACK, 30,
+                                           font_name="Kenney Blocks")
+        self.loading_text = CachedText("LOADING", 220, 14, arcade.color.BLACK, 12, font_name="Kenney Blocks")
+        self.launch_time = launch_time  # Set on the first menu so time-to-first-frame can be checked
+        self.assets_packed = 0
+
+    def reset(self, launch_time=None):
+        """ Back to how the menu looked when it was first shown """
         self.is_transitioning = False
+        self.game_start_text.set(color=arcade.color.BLACK)
+        self.how_to_play_text.set(color=arcade.color.BLACK)
+        self.launch_time = launch_time
+
+    def on_update(self, delta_time):
+        # Upload whatever the preloader finished since last frame
+        done, total = assets.progress()
+        if done > self.assets_packed:
+            assets.pack_atlas(self.window.ctx)
+            self.assets_packed = done
 
     def on_draw(self):
         arcade.start_render()
         width, height = self.window.get_size()
 
+        if self.texture is None and assets.is_loaded("main_background.png"):
+            self.texture = assets.get_texture("main_background.png")
+            self.background_list.append(
+                texture_sprite(self.texture, width // 2, height // 2, SCREEN_WIDTH, SCREEN_HEIGHT)
+            )
+
         # Drawing the background
-        arcade.draw_texture_rectangle(
-            width // 2,
-            height // 2,
-            SCREEN_WIDTH,
-            SCREEN_HEIGHT,
-            self.texture
-        )
+        if self.texture is not None:
+            self.background_list.draw()
+        else:
+            arcade.set_background_color(arcade.color.SAND)
 
         # Draw text for the game
-        arcade.draw_text("Pirate's Cove", 10, 440, arcade.color.BLACK, 40, font_name="Kenney Blocks")
-        arcade.draw_text("PLAY - B", 10, 390, self.game_start_color, 30, font_name="Kenney Blocks")
-        arcade.draw_text("HOW TO PLAY - I", 10, 340, self.how_to_play_color, 30, font_name="Kenney Blocks")
+        self.title_text.draw()
+        self.game_start_text.draw()
+        self.how_to_play_text.draw()
+
+        # Loading bar while the preloader is still working
+        done, total = assets.progress()
+        if done < total:
+            arcade.draw_lrtb_rectangle_outline(10, 210, 30, 14, arcade.color.BLACK, 2)
+            arcade.draw_lrtb_rectangle_filled(12, 12 + 196 * done / total, 28, 16, arcade.color.BLACK)
+            self.loading_text.draw()
+
+        if self.launch_time is not None:
+            first_frame = time.perf_counter() - self.launch_time
+            self.launch_time = None
+            if first_frame > FIRST_FRAME_BUDGET:
+                logger.warning("First frame took %.0f ms (budget %.0f ms)", first_frame * 1000,
+                               FIRST_FRAME_BUDGET * 1000)
 
     def on_key_press(self, key, modifiers):
         if key == arcade.key.B:  # Start the game with "B"
-            print("B pressed, starting the game")
-            self.game_start_color = arcade.color.RED
+            logger.debug("B pressed, starting the game")
+            self.game_start_text.set(color=arcade.color.RED)
             arcade.schedule(self.switch_to_game_board, DELAY_TIME)
         elif key == arcade.key.I:  # How to play
-            print("I pressed, switching to How To Play")
-            self.how_to_play_color = arcade.color.RED
+            logger.debug("I pressed, switching to How To Play")
+            self.how_to_play_text.set(color=arcade.color.RED)
             arcade.schedule(self.switch_to_how_to_play, DELAY_TIME)
         elif key == arcade.key.ESCAPE:  # Exit the game (if intended)
-            print("ESCAPE pressed")
+            logger.debug("ESCAPE pressed")
             arcade.schedule(self.switch_main_menu, DELAY_TIME)
 
     def switch_to_game_board(self, delta_time):
         arcade.unschedule(self.switch_to_game_board)
-        game_view = GameBoard()  # Create the game view
-        game_view.setup()  # Set up the game elements
-        self.window.show_view(game_view)  # Show the game view
+        start = time.perf_counter()
+        waited = assets.wait_all()  # Only blocks on whatever isn't loaded yet
+        VIEWS.show("game", online=ONLINE, level=LEVEL, bot=BOT, watch=WATCH)  # Built the first time, a rematch after that
+        load_time = time.perf_counter() - start
+        if load_time > MATCH_LOAD_BUDGET:
+            logger.warning("Match took %.0f ms to load, %.0f ms waiting on assets (budget %.0f ms)",
+                           load_time * 1000, waited * 1000, MATCH_LOAD_BUDGET * 1000)
 
     def switch_to_how_to_play(self, delta_time):
         arcade.unschedule(self.switch_to_how_to_play)
-        how_to_view = HowTo()  # Create the "How to Play" view
-        self.window.show_view(how_to_view)
+        VIEWS.show("howto")
 
     def switch_main_menu(self, delta_time):
         """Switch to main menu"""
         arcade.unschedule(self.switch_main_menu)
-        main_menu = MainMenu()
-        self.window.show_view(main_menu)
-
-class Confetti:
-    def __init__(self):
-        # Set the position of the confetti randomly at the top of the screen
-        self.x = random.randint(0, SCREEN_WIDTH)
-        self.y = random.randint(SCREEN_HEIGHT, SCREEN_HEIGHT + 200)
-        # Random size for confetti rectangles (width and height)
-        self.width = random.randint(5, 10)
-        self.height = random.randint(5, 15)
-        # Random color
-        self.color = random.choice([arcade.color.RED, arcade.color.BLUE, arcade.color.YELLOW, arcade.color.GREEN, arcade.color.PURPLE])
-        # Random speed for falling
-        self.speed = random.uniform(1, 3)
-
-    def update(self):
-        # Move the confetti down
-        self.y -= self.speed
-        # If confetti goes off-screen, reset to the top
-        if self.y < 0:
-            self.y = random.randint(SCREEN_HEIGHT, SCREEN_HEIGHT + 200)
-            self.x = random.randint(0, SCREEN_WIDTH)
-            self.speed = random.uniform(1, 3)
-
-    def draw(self):
-        # Draw the confetti as a rectangle or circle
-        arcade.draw_rectangle_filled(self.x, self.y, self.width, self.height, self.color)
+        VIEWS.show("menu")
 
 class GameBoard(arcade.View):
     """ Main Gameplay View """
 
-    def __init__(self):
+    def __init__(self, num_players=2, online=None, level=None, bot=None, watch=None):
         super().__init__()
+        self.num_players = num_players
+        self.match = None
+        self.level = None
+        self.session = None
+        self.network = None
+        self.bots = []
+        self.watch = None
+        self.feed = SpectatorFeed(("127.0.0.1", BROADCAST)) if BROADCAST is not None else None
+        # Key and gamepad events are timestamped as they arrive and folded into each tick's inputs
+        self.controls = InputState(Bindings(BINDINGS, key_code), INPUT_BUFFER, LATENCY)
+        self.gamepads = []
+        # Ticks run at a fixed rate whatever the frame rate, and sprites are drawn alpha of the way between the
+        # positions before the last tick and after it
+        self.timestep = FixedTimestep()
+        self.previous_positions = None
+        self.alpha = 1.0
+        self.start_match(online, level, bot, watch)
         self.player_list = None
         self.platform_list = None
-        self.player1 = None
-        self.player2 = None
+        self.players = []  # One sprite per fighter, in the same order as match.fighters
+        # Per player, facing (1 or -1) -> animation frames
+        self.walk_frames = []
+        self.attack_frames = []
+        self.death_frames = []
         self.background = None
-        self.is_player1_attacking = False
-        self.is_player2_attacking = False
-        self.player1_attack_time = 0
-        self.player2_attack_time = 0
-        self.player1_has_dealt_damage = False  # Track if player 1 has dealt damage
-        self.player2_has_dealt_damage = False  # Track if player 2 has dealt damage
-        self.player1_health = 5
-        self.player2_health = 5
-        self.player1_is_dead = False  # Track if player 1 is dead
-        self.player2_is_dead = False  # Track if player 2 is dead
-        self.player1_death_animation_done = False
-        self.player2_death_animation_done = False
-        self.heart_texture = arcade.load_texture("heart.png")
-        self.attack_damage = 1  # Damage dealt per hit
-        self.heart_background_color = (0, 0, 0, 100)
-        self.player1_icon = None
-        self.player2_icon = None
-        self.player_icon_y = 0
-        self.game_over = False
-        self.winner = None
-        self.confetti_list = [Confetti() for _ in range(100)]  # Create 100 confetti particles
+        self.tiles = None  # Level tiles in chunks, only on tile-map levels
+        self.camera = None
+        self.heart_texture = assets.get_texture("heart.png")
+        self.hud = None
+        self.confetti = ConfettiSystem(100, SCREEN_WIDTH, SCREEN_HEIGHT)  # Create 100 confetti particles
+        self.sparks = ParticleSystem(5000, gravity=0.3)
+        self.projectiles = ProjectileLayer()
+        self.replay = None
+        self.profiler = PROFILER
+        self.profiler_overlay = ProfilerOverlay(PROFILER) if PROFILER is not NULL_PROFILER else None
+
+    def start_match(self, online, level, bot, watch=None):
+        """ A new match and everything that drives it, the visuals are left alone """
+        num_players = self.num_players
+        self.level = level
+        self.watch = watch
+        # Online, both peers build the same match from the shared seed and keep it in step with rollback
+        seed = random.randrange(2 ** 32) if online is None else online[3]
+        if watch is not None:
+            # Spectating, the match is rebuilt from the broadcast and never stepped here
+            self.match = watch.playback.match
+            watch.playback.layout_changed = False
+        elif level is None:
+            self.match = Match(seed=seed, num_players=num_players)
+        else:
+            self.match = level.new_match(seed, num_players)
+        self.session = None
+        self.network = None
+        if online is not None:
+            local_player, local_port, remote, _ = online
+            self.session = RollbackSession(self.match, local_player)
+            self.network = NetworkThread(self.session, local_port, remote)
+        # Everyone but player 1 is played by the computer, searching in worker processes so frames never wait
+        self.bots = []
+        if bot is not None and online is None and watch is None:
+            executor = bots.start_workers()
+            self.bots = [bots.Bot(index, bot, seed + index, executor) for index in range(1, num_players)]
+        # Online the local input reaches the match input_delay ticks after it was read
+        self.controls.reset(num_players, self.session.input_delay if self.session is not None else 0)
+        self.timestep.reset()
+        self.ended = False
+        self.previous_positions = None
+        self.alpha = 1.0
+        if self.feed is not None and watch is None:
+            self.feed.start(self.match, level.path if level is not None else None)
+
+    def end_match(self):
+        """ Finish the replay and stop the network and bots, the board can be reset() afterwards """
+        # Leaving for the menu ends the match, and the next reset() would end it again
+        if self.ended:
+            return
+        self.ended = True
+        if self.replay is not None:
+            self.replay.close(self.match)
+            self.replay = None
+        if self.network is not None:
+            self.network.close()
+            self.network = None
+        for bot in self.bots:
+            bot.cancel()
+        self.bots = []
+        count, p50, p95, p99 = LATENCY.report()
+        if count:
+            logger.info("Input to photon over the last %d inputs: p50 %.1f ms, p95 %.1f ms, p99 %.1f ms",
+                        min(count, LATENCY.history.maxlen), p50, p95, p99)
+
+    def reset(self, online=None, level=None, bot=None, watch=None):
+        """ Start a rematch in place, keeping every sprite, texture, particle buffer and the HUD """
+        self.end_match()
+        level_changed = level is not self.level
+        self.start_match(online, level, bot, watch)
+        self.sparks.clear()
+        self.projectiles.clear()
+        self.confetti.reset()
+        if self.player_list is None:
+            return  # setup() hasn't run yet and does the rest
+        if level_changed:
+            self.setup_level()
+        self.attach_match()
+        self.sync_sprites()
+        self.sync_hud()
+
+    @property
+    def game_over(self):
+        return self.match.game_over
+
+    @property
+    def winner(self):
+        return f"Player {self.match.winner + 1}" if self.match.winner is not None else "Nobody"
 
     def setup(self):
         """ Set up the main game here """
@@ -143,447 +289,474 @@ class GameBoard(arcade.View):
         # Initialize sprite lists
         self.player_list = arcade.SpriteList()
         self.platform_list = arcade.SpriteList()
-        # Create the background image
-        self.background = arcade.load_texture("island_map.jpg")
-
-        # Create player 1
-        self.player1 = arcade.AnimatedTimeBasedSprite()
-        self.player1_walk_frames = []
-        self.player1_attack_frames = []
-        self.player1_death_frames = []
-
-        # Creating Player Icons
-        self.player1_icon = arcade.load_texture(path.join(DIR, "captain_icon.png"), flipped_horizontally=True)
-        self.player2_icon = arcade.load_texture(path.join(DIR, "Knightro_icon.png"))
-
-        # Load walking textures for player 1
-        for i in range(NUM_FRAMES_WALK):
-            texture = arcade.load_texture(
-                "Captain_walk.png",  # File path for Captain's walk spritesheet
-                x=i * FRAME_WIDTH, y=0, width=FRAME_WIDTH, height=FRAME_HEIGHT
-            )
-            self.player1_walk_frames.append(arcade.AnimationKeyframe(i, 85, texture))
-
-        # Load attack textures for player 1
-        for i in range(NUM_FRAMES_ATTACK_1):
-            texture = arcade.load_texture(
-                "Captain_attack1.png",  # File path for Captain's attack spritesheet
-                x=i * FRAME_WIDTH, y=0, width=FRAME_WIDTH, height=FRAME_HEIGHT
-            )
-            self.player1_attack_frames.append(arcade.AnimationKeyframe(i, 60, texture))
-
-        # Load death textures for player 1
-        for i in range(NUM_FRAMES_ATTACK_1):  # Adjust NUM_FRAMES_ATTACK_1 to the correct number of death frames
-            texture = arcade.load_texture("Captain_death.png", x=i * FRAME_WIDTH, y=0, width=FRAME_WIDTH,
-                                          height=FRAME_HEIGHT)
-            self.player1_death_frames.append(arcade.AnimationKeyframe(i, 100, texture))
-
-        # Set the scaling factor to make the sprite bigger
-        self.player1.scale = 2.0  # Adjust this value to change the size
-
-        self.player1.frames = self.player1_walk_frames
-        self.player1.texture = self.player1.frames[0].texture
-        self.player1.set_hit_box(self.player1.texture.hit_box_points)
-        self.player1.center_x = 350
-        self.player1.center_y = 200
-        self.player_list.append(self.player1)
-
-        # Create player 2
-        self.player2 = arcade.AnimatedTimeBasedSprite()
-        self.player2_walk_frames = []
-        self.player2_attack_frames = []
-        self.player2_death_frames = []
-
-        # Load walking textures for player 2
-        for i in range(NUM_FRAMES_WALK):
-            texture = arcade.load_texture(
-                "Knightro_walk_flip.png",  # File path for Pirate's walk spritesheet
-                x=i * FRAME_WIDTH, y=0, width=FRAME_WIDTH, height=FRAME_HEIGHT
-            )
-            self.player2_walk_frames.append(arcade.AnimationKeyframe(i, 85, texture))
 
-        # Load attack textures for player 2
-        for i in range(NUM_FRAMES_ATTACK_2):
-            texture = arcade.load_texture(
-                "Knightro_attack.png",  # File path for Pirate's attack spritesheet
-                x=i * FRAME_WIDTH, y=0, width=FRAME_WIDTH, height=FRAME_HEIGHT
-            )
-            self.player2_attack_frames.append(arcade.AnimationKeyframe(i, 60, texture))
-
-        # Load death textures for player 2
-        for i in range(NUM_FRAMES_ATTACK_2):  # Adjust NUM_FRAMES_ATTACK_2 to the correct number of death frames
-            texture = arcade.load_texture("Knightro_deathflipped.png", x=i * FRAME_WIDTH, y=0, width=FRAME_WIDTH,
-                                          height=FRAME_HEIGHT)
-            self.player2_death_frames.append(arcade.AnimationKeyframe(i, 100, texture))
-
-        # Set the scaling factor to make the sprite bigger
-        self.player2.scale = 2.0  # Adjust this value to change the size
-
-        self.player2.frames = self.player2_walk_frames
-        self.player2.texture = self.player2.frames[0].texture
-        self.player2.set_hit_box(self.player2.texture.hit_box_points)
-        self.player2.center_x = 650
-        self.player2.center_y = 200
-        self.player_list.append(self.player2)
-
-        # Create platform
-        platform = arcade.Sprite(":resources:images/tiles/grassMid.png", 1)
-        platform.width = SCREEN_WIDTH
-        platform.center_x = SCREEN_WIDTH // 2
-        platform.center_y = 50
-        self.platform_list.append(platform)
+        # Creating Player Icons, characters take turns when there are more players than characters
+        num_players = len(self.match.fighters)
+        icons = [assets.get_texture(*assets.PLAYER_ICONS[i % len(assets.PLAYER_ICONS)]) for i in range(num_players)]
+        self.hud = Hud(self.heart_texture, icons, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+        # Animation frames are sliced once per process and shared between matches
+        for index in range(num_players):
+            walk_sheet, attack_sheet, death_sheet = assets.PLAYER_SHEETS[index % len(assets.PLAYER_SHEETS)]
+            facing = assets.PLAYER_FACING[index % len(assets.PLAYER_FACING)]
+            walk_frames = {facing: assets.get_frames(*walk_sheet), -facing: assets.get_frames(*walk_sheet, True)}
+            attack_frames = {facing: assets.get_frames(*attack_sheet), -facing: assets.get_frames(*attack_sheet, True)}
+            death_frames = {facing: assets.get_frames(*death_sheet), -facing: assets.get_frames(*death_sheet, True)}
+
+            player = arcade.AnimatedTimeBasedSprite()
+            # Hits are checked against boxes measured at this size, see hitboxes.py
+            player.scale = SPRITE_SCALE
+            player.frames = walk_frames[facing]
+            player.texture = player.frames[0].texture
+
+            self.players.append(player)
+            self.walk_frames.append(walk_frames)
+            self.attack_frames.append(attack_frames)
+            self.death_frames.append(death_frames)
+            self.player_list.append(player)
+
+        self.sync_sprites()
+        self.sync_hud()
+        self.setup_level()
+        assets.pack_atlas(self.window.ctx)
+        self.attach_match()
+        self.gamepads = open_gamepads(self.controls)
+
+    def setup_level(self):
+        """ Background, platforms and camera for the arena or the tile-map level """
+        background = self.level.background if self.level is not None else None
+        self.background = assets.get_texture(background or "island_map.jpg")
+        self.platform_list.clear()
+        if self.level is None:
+            # Create platform
+            platform = arcade.Sprite(texture=assets.get_texture(":resources:images/tiles/grassMid.png"), scale=1)
+            platform.width = SCREEN_WIDTH
+            platform.center_x = SCREEN_WIDTH // 2
+            platform.center_y = 50
+            self.platform_list.append(platform)
+            self.tiles = None
+            self.camera = None
+        else:
+            self.tiles = ChunkLayer(self.level)
+            self.camera = FollowCamera(SCREEN_WIDTH, SCREEN_HEIGHT, self.level.width, self.level.height)
+
+    def attach_match(self):
+        """ Point the profiler, the replay recorder and the camera at the current match """
+        # Time the stages of Match.step() without slowing down unprofiled matches
+        self.profiler.instrument(self.match, "move_fighters", "physics")
+        self.profiler.instrument(self.match, "manage_attacks", "attacks")
+        self.profiler.instrument(self.match, "land_fighters", "collisions")
+        self.profiler.instrument(self.match, "update_projectiles", "projectiles")
+
+        if REPLAY_DIR is not None and self.session is None and self.watch is None:
+            os.makedirs(REPLAY_DIR, exist_ok=True)
+            file_name = f"match-{time.strftime('%Y%m%d-%H%M%S')}-{self.match.seed}.pcr"
+            self.replay = ReplayWriter(os.path.join(REPLAY_DIR, file_name), self.match, self.level)
+        if self.camera is not None:
+            self.camera.follow(self.camera_targets(), snap=True)
+
+    def fighter_positions(self, alpha=1.0):
+        """ Where each fighter is drawn, alpha of the way from before the last tick to after it """
+        fighters = self.match.fighters
+        previous = self.previous_positions
+        if previous is None or alpha >= 1.0:
+            return [(fighter.x, fighter.y) for fighter in fighters]
+        return [(lerp(x, fighter.x, alpha), lerp(y, fighter.y, alpha)) for fighter, (x, y) in zip(fighters, previous)]
+
+    def sync_sprites(self, alpha=1.0):
+        """ Copy fighter state from the simulation onto the sprites """
+        animations = {"walk": self.walk_frames, "attack": self.attack_frames, "death": self.death_frames}
+        positions = self.fighter_positions(alpha)
+        for index, (fighter, player) in enumerate(zip(self.match.fighters, self.players)):
+            # The simulation picks the frame, since that frame's hurtboxes are the ones that count
+            kind, frame = fighter.animation()
+            frames = animations[kind][index][fighter.facing]
+            player.frames = frames
+            player.cur_frame_idx = frame
+            player.texture = frames[frame].texture
+
+            # The body box sits on the bottom edge of the 48x48 frame
+            x, y = positions[index]
+            player.center_x = x
+            player.center_y = y + FRAME_HEIGHT * player.scale / 2
+
+    def camera_targets(self, alpha=1.0):
+        """ Where the camera should look, every fighter still standing (or everyone once it's over) """
+        fighters = self.match.fighters
+        positions = self.fighter_positions(alpha)
+        standing = [index for index, fighter in enumerate(fighters) if not fighter.is_dead] or range(len(fighters))
+        return [(positions[index][0], positions[index][1] + FIGHTER_HEIGHT / 2) for index in standing]
 
     def on_draw(self):
+        profiler = self.profiler
+        with profiler.stage("animation"):
+            # Drawn between the last two ticks, so motion is smooth at any frame rate
+            self.sync_sprites(self.alpha)
+            self.projectiles.sync(self.match.projectiles, self.alpha)
         arcade.start_render()
-        arcade.draw_lrwh_rectangle_textured(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT, self.background)
-        self.player_list.draw()
-        self.platform_list.draw()
-
-        # Draw hearts for player 1
-        for i in range(self.player1_health):
-            arcade.draw_texture_rectangle(110 + i * 45, 440, 55, 45, self.heart_texture)
-
-        # Draw hearts for player 2
-        for i in range(self.player2_health):
-            arcade.draw_texture_rectangle(890 - i * 45, 440, 55, 45, self.heart_texture)
-
-        # Drawing player icons
-        arcade.draw_texture_rectangle(45, 450, 75, 75, self.player1_icon)
-        arcade.draw_texture_rectangle(955, 450, 75, 75, self.player2_icon)
+        with profiler.stage("draw:background"):
+            # The background stays put on screen while the level scrolls over it
+            arcade.draw_lrwh_rectangle_textured(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT, self.background)
+        if self.camera is not None:
+            self.camera.use()
+            with profiler.stage("draw:tiles"):
+                self.tiles.draw(self.camera.view)
+        with profiler.stage("draw:sprites"):
+            self.player_list.draw()
+            self.platform_list.draw()
+        with profiler.stage("draw:particles"):
+            if self.camera is None:
+                self.projectiles.draw(self.window.ctx)
+                self.sparks.draw(self.window.ctx)
+            else:
+                left, right, bottom, top = self.camera.view
+                self.projectiles.draw(self.window.ctx, (left, bottom), (right - left, top - bottom))
+                self.sparks.draw(self.window.ctx, (left, bottom), (right - left, top - bottom))
+
+        # Hearts and icons are retained sprites, see sync_hud
+        if self.camera is not None:
+            arcade.set_viewport(0, SCREEN_WIDTH, 0, SCREEN_HEIGHT)
+        with profiler.stage("draw:hud"):
+            self.hud.draw()
+
+            # If the game is over, draw the confetti
+            if self.game_over:
+                self.confetti.draw(self.window.ctx)
+                self.hud.draw_game_over()
+
+        if self.profiler_overlay is not None:
+            self.profiler_overlay.draw()
+        profiler.end_frame()
 
-        # If the game is over, draw the confetti
-        if self.game_over:
-            for confetti in self.confetti_list:
-                confetti.draw()
+    def on_update(self, delta_time):
+        profiler = self.profiler
+        # All match logic runs in the headless simulation at a fixed 60 ticks a second, however often this is called
+        ticks = self.timestep.advance(delta_time)
+        now = time.perf_counter()
+        if self.watch is not None:
+            with profiler.stage("simulation"):
+                # The broadcast is played back on its own clock and interpolated by the Playback
+                self.watch.update(delta_time)
+            if self.watch.playback.layout_changed:
+                # The host started another match, maybe on another level
+                self.reset(level=self.watch.playback.level, watch=self.watch)
+                return
+            self.show_hits()
+        for index in range(ticks):
+            # A frame that catches up several ticks spreads the input it got over them by when it arrived, and the
+            # last tick takes everything up to now
+            self.tick(now - (ticks - 1 - index) * FIXED_DT)
+        self.alpha = self.timestep.alpha
+        if self.camera is not None:
+            self.camera.follow(self.camera_targets(self.alpha), ticks=delta_time / FIXED_DT)
+        if ticks or self.watch is not None:
+            with profiler.stage("hud"):
+                self.sync_hud()
+
+    def tick(self, until):
+        """ Advance everything tied to the simulation by one tick, with the input that arrived before until """
+        profiler = self.profiler
+        with profiler.stage("particles"):
+            # If the game is over, update confetti
+            if self.game_over:
+                self.confetti.update()
+            self.sparks.update()
+        if self.watch is not None:
+            return
 
-        # Game over print out
+        inputs = self.read_inputs(until)
+        with profiler.stage("bots"):
+            for bot in self.bots:
+                inputs[bot.player] = bot.inputs(self.match)
+        self.previous_positions = [(fighter.x, fighter.y) for fighter in self.match.fighters]
+        applied = True
+        with profiler.stage("simulation"):
+            if self.session is not None:
+                # Online the local player always uses the player 1 keys
+                applied = self.session.advance(inputs[0])
+                self.network.send()
+            else:
+                self.match.step(inputs)
+        self.controls.confirm(self.local_fighters(), applied)
+        if self.feed is not None:
+            with profiler.stage("broadcast"):
+                self.feed.publish()
+        if self.replay is not None:
+            self.replay.record(inputs, self.match)
+            if self.match.frozen:
+                self.replay.close(self.match)
+                self.replay = None
+        self.show_hits()
+
+    def show_hits(self):
+        """ Log and spark the hits the simulation reported for the last tick """
+        for attacker, target in self.match.hits:
+            fighter = self.match.fighters[target]
+            logger.info("Player %d hit! Health: %d", target + 1, fighter.health)
+            emit_hit_sparks(self.sparks, fighter.x, fighter.y + FIGHTER_HEIGHT / 2)
+
+    def sync_hud(self):
+        """ Push health and winner changes to the HUD, which only rebuilds what changed """
+        for index, fighter in enumerate(self.match.fighters):
+            self.hud.set_health(index, fighter.health)
         if self.game_over:
-            arcade.draw_lrtb_rectangle_filled(305, 695, 295, 225, (200, 200, 200, 150))
-
-            # Draw the text over the transparent box
-            arcade.draw_text(f"{self.winner} Wins!",
-                             SCREEN_WIDTH // 2,
-                             SCREEN_HEIGHT // 2,
-                             arcade.color.BLACK,
-                             25,
-                             font_name="Kenney Rocket",
-                             anchor_x="center")
+            self.hud.set_winner(self.winner)
 
-            # Draw the "Return to Main Menu" button
-            arcade.draw_text("Press ESC to Return to Main Menu", SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 40, arcade.color.RED, 20, font_name="Kenney Rocket", anchor_x="center")
-
-
-    def on_update(self, delta_time):
-        # If the game is over, update confetti
-        if self.game_over:
-            for confetti in self.confetti_list:
-                confetti.update()
-
-        # Disable further updates and stop gravity/movement if either player is dead
-        if self.player1_is_dead and not self.player1_death_animation_done:
-            self.player1.change_x = 0
-            self.player1.change_y = 0  # Stop gravity
-            self.player1.update_animation(delta_time)
-            if self.player1.cur_frame_idx == len(self.player1.frames) - 1:
-                self.player1_death_animation_done = True  # Freeze on the last frame
-
-        if self.player2_is_dead and not self.player2_death_animation_done:
-            self.player2.change_x = 0
-            self.player2.change_y = 0  # Stop gravity
-            self.player2.update_animation(delta_time)
-            if self.player2.cur_frame_idx == len(self.player2.frames) - 1:
-                self.player2_death_animation_done = True  # Freeze on the last frame
-
-        # If either player is dead and their animation is done, no further updates
-        if self.player1_death_animation_done or self.player2_death_animation_done:
-            return
+    def read_inputs(self, until):
+        """ This tick's input bits for each player, from the keys and gamepads """
+        return self.controls.tick(until)
 
-        # Apply gravity if players are alive
-        if not self.player1_is_dead:
-            self.player1.change_y -= GRAVITY
-        if not self.player2_is_dead:
-            self.player2.change_y -= GRAVITY
-
-        self.player_list.update()
-
-        # Manage attacks and check for damage
-        self.manage_attacks(delta_time)
-
-        # Handle movement for both players if they are alive and not attacking
-        if not self.player1_is_dead and self.player1.change_x != 0 and not self.is_player1_attacking:
-            self.player1.update_animation(delta_time)
-
-        if not self.player2_is_dead and self.player2.change_x != 0 and not self.is_player2_attacking:
-            self.player2.update_animation(delta_time)
-
-        # Handle platform collisions
-        for player in [self.player1, self.player2]:
-            collisions = arcade.check_for_collision_with_list(player, self.platform_list)
-            if collisions:
-                player.change_y = 0
-                player.bottom = collisions[0].top
-
-        # Limit player1 movement within screen bounds
-        if self.player1.left < 0:
-            self.player1.left = 0
-        if self.player1.right > 1000:
-            self.player1.right = 1000
-
-        # Limit player2 movement within screen bounds
-        if self.player2.left < 0:
-            self.player2.left = 0
-        if self.player2.right > 1000:
-            self.player2.right = 1000
-
-        # Check if a player dies and set the game_over flag
-        if self.player1_health <= 0:
-            self.game_over = True
-            self.winner = "Player 2"
-        elif self.player2_health <= 0:
-            self.game_over = True
-            self.winner = "Player 1"
-
-    def manage_attacks(self, delta_time):
-        """Handle attack logic and damage"""
-
-        # Player 1 attack logic
-        if self.is_player1_attacking and not self.player1_is_dead:
-            self.player1_attack_time += delta_time
-            self.player1.update_animation(delta_time)
-
-            # Check if Player 1 hit Player 2
-            if arcade.check_for_collision(self.player1, self.player2) and not self.player1_has_dealt_damage:
-                self.player2_health -= self.attack_damage
-                self.player2_health = max(0, self.player2_health)
-                self.player1_has_dealt_damage = True  # Mark damage as dealt
-                print(f"Player 2 hit! Health: {self.player2_health}")
-
-                # If Player 2's health is 0, trigger death animation
-                if self.player2_health == 0 and not self.player2_is_dead:
-                    self.player2.frames = self.player2_death_frames
-                    self.player2.cur_frame_idx = 0  # Start the death animation
-                    self.player2_is_dead = True
-
-            # Reset after attack completes
-            if self.player1_attack_time > NUM_FRAMES_ATTACK_1 * 0.1:
-                self.is_player1_attacking = False
-                self.player1_attack_time = 0
-                self.player1.frames = self.player1_walk_frames
-                self.player1_has_dealt_damage = False  # Reset damage flag
-
-        # Player 2 attack logic
-        if self.is_player2_attacking and not self.player2_is_dead:
-            self.player2_attack_time += delta_time
-            self.player2.update_animation(delta_time)
-
-            # Check if Player 2 hit Player 1
-            if arcade.check_for_collision(self.player2, self.player1) and not self.player2_has_dealt_damage:
-                self.player1_health -= self.attack_damage
-                self.player1_health = max(0, self.player1_health)
-                self.player2_has_dealt_damage = True  # Mark damage as dealt
-                print(f"Player 1 hit! Health: {self.player1_health}")
-
-                # If Player 1's health is 0, trigger death animation
-                if self.player1_health == 0 and not self.player1_is_dead:
-                    self.player1.frames = self.player1_death_frames
-                    self.player1.cur_frame_idx = 0  # Start the death animation
-                    self.player1_is_dead = True
-
-            # Reset after attack completes
-            if self.player2_attack_time > NUM_FRAMES_ATTACK_2 * 0.1:
-                self.is_player2_attacking = False
-                self.player2_attack_time = 0
-                self.player2.frames = self.player2_walk_frames
-                self.player2_has_dealt_damage = False  # Reset damage flag
+    def local_fighters(self):
+        """ The fighter each player's bindings drive here, None for the ones bots play """
+        fighters = self.match.fighters
+        if self.session is not None:
+            return [fighters[self.session.local_player]]
+        bot_players = {bot.player for bot in self.bots}
+        return [None if index in bot_players else fighter for index, fighter in enumerate(fighters)]
 
     def on_key_press(self, key, modifiers):
+        self.controls.key_press(key, time.perf_counter())
         # If game is over, allow return to main menu with ESC
         if self.game_over and key == arcade.key.ESCAPE:
             self.switch_to_main_menu()
-
-        if self.player1_is_dead or self.player2_is_dead:
-            return  # Disable input if either player is dead
-
-        # Player 1 movement and attack (WASD + "R")
-        if key == arcade.key.D and not self.is_player1_attacking:
-            self.player1.change_x = 5
-        elif key == arcade.key.A and not self.is_player1_attacking:
-            self.player1.change_x = -5
-        elif key == arcade.key.W and self.player1.change_y == 0:
-            self.player1.change_y = PLAYER_JUMP_SPEED
-        elif key == arcade.key.R and not self.is_player1_attacking:
-            self.is_player1_attacking = True
-            self.player1.frames = self.player1_attack_frames
-            self.player1.cur_frame_idx = 0
-            self.player1.update_animation(0)
-
-        # Player 2 movement and attack (Arrow keys + "/")
-        if key == arcade.key.RIGHT and not self.is_player2_attacking:
-            self.player2.change_x = 5
-        elif key == arcade.key.LEFT and not self.is_player2_attacking:
-            self.player2.change_x = -5
-        elif key == arcade.key.UP and self.player2.change_y == 0:
-            self.player2.change_y = PLAYER_JUMP_SPEED
-        elif key == arcade.key.SLASH and not self.is_player2_attacking:
-            self.is_player2_attacking = True
-            self.player2.frames = self.player2_attack_frames
-            self.player2.cur_frame_idx = 0
-            self.player2.update_animation(0)
+        if key == PROFILER_KEY and self.profiler_overlay is not None:
+            self.profiler_overlay.toggle()
 
     def switch_to_main_menu(self):
         """ Switch to the Main Menu view """
-        main_menu = MainMenu()
-        self.window.show_view(main_menu)
+        self.end_match()
+        VIEWS.show("menu")
 
     def on_key_release(self, key, modifiers):
-        # Player 2 key release
-        if key in [arcade.key.RIGHT, arcade.key.LEFT]:
-            self.player2.change_x = 0
-
-        # Player 1 key release
-        if key in [arcade.key.D, arcade.key.A]:
-            self.player1.change_x = 0
+        self.controls.key_release(key, time.perf_counter())
 
 
 class HowTo(arcade.View):
     def __init__(self):
         super().__init__()
         # Init the images used
-        self.texture = arcade.load_texture(path.join(DIR, "how_to_pic.png"))
-        self.red_esc = arcade.load_texture(path.join(DIR, "esc_red.png"))
-        self.black_esc = arcade.load_texture(path.join(DIR, "esc_black.png"))
+        self.texture = assets.get_texture("how_to_pic.png")
+        self.red_esc = assets.get_texture("esc_red.png")
+        self.black_esc = assets.get_texture("esc_black.png")
         self.cur_foreground = self.black_esc
 
-        self.down_arrow = arcade.load_texture(path.join(DIR, "down_arrow.png"))
+        self.down_arrow = assets.get_texture("down_arrow.png")
 
         self.is_transitioning = False  # Flag to check if already transitioning
-        # Text color
-        self.escape_color = arcade.color.BLACK
-
-    def on_show_view(self):
-        """ Reset all necessary variables and states """
-        pass
-
-    def on_draw(self):
-        arcade.start_render()  # clear prev screen to start drawing
-
-        # Get window dimensions
-        width, height = self.window.get_size()
 
+        # Everything on this screen is static, so it is built once and drawn as a few batches
+        self.sprite_list = arcade.SpriteList()
         # Scale the background to window size
-        scaled_width = SCREEN_WIDTH
-        scaled_height = SCREEN_HEIGHT
-
-        # Drawing the background
-        arcade.draw_texture_rectangle(
-            width // 2,
-            height // 2,
-            scaled_width,
-            scaled_height,
-            self.texture
+        self.sprite_list.append(
+            texture_sprite(self.texture, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2, SCREEN_WIDTH, SCREEN_HEIGHT)
         )
-
         escape_coord_x = 25
         escape_coord_y = 485
-        # Drawing escape button
-        arcade.draw_texture_rectangle(
-            escape_coord_x,
-            escape_coord_y,
-            50,
-            25,  # Desired height for the image on top
-            self.cur_foreground  # The foreground texture
-        )
-
-        arcade.draw_texture_rectangle(
-            207, 347,
-            17, 10,
-            self.down_arrow
-        )
-
-        # Drawing text 'escape' next to button
-        esc_txt_x = escape_coord_x + 25
-        arcade.draw_text("ESCAPE",
-                         esc_txt_x,
-                         479,
-                         self.escape_color,
-                         15,
-                         font_name="Kenney Rocket")
-
-        # Introduction to game
-        arcade.draw_text(
-            "Ahoy!! This is Pirate's Cove. Where the strongest pirate "
-            "is the greatest pirate of them all!\nUse whatever is at your disposal and fight other "
-            "pirates to protect your treasure and pride.",
-            SCREEN_WIDTH // 2,  # Center the x-coordinate based on the screen width
-            400,  # y-coordinate
-            arcade.color.BLACK,  # Text color
-            13,  # Font size
-            width=800,  # Width of the text box
-            multiline=True,  # Enable multiline text
-            align="center",  # Align text to center
-            anchor_x="center",  # Set anchor point for x to the center
-            font_name="Kenney Rocket"
-        )
+        # Escape button, its texture turns red when pressed
+        self.escape_button = texture_sprite(self.cur_foreground, escape_coord_x, escape_coord_y, 50, 25)
+        self.sprite_list.append(self.escape_button)
+        self.sprite_list.append(texture_sprite(self.down_arrow, 207, 347, 17, 10))
+
+        # Filled rectangles and outlines for the Player 1 and Player 2 control boxes
+        self.control_boxes = arcade.ShapeElementList()
+        for center_x in (350, 650):
+            self.control_boxes.append(arcade.create_rectangle_filled(center_x, 250, 200, 100, arcade.color.LIGHT_GRAY))
+            self.control_boxes.append(arcade.create_rectangle_outline(center_x, 250, 200, 100, arcade.color.BLACK, 2))
+
+        # Text 'escape' next to button
+        self.escape_text = CachedText("ESCAPE", escape_coord_x + 25, 479, arcade.color.BLACK, 15,
+                                      font_name="Kenney Rocket")
+        self.texts = [
+            self.escape_text,
+            # Introduction to game
+            CachedText(
+                "Ahoy!! This is Pirate's Cove. Where the strongest pirate "
+                "is the greatest pirate of them all!\nUse whatever is at your disposal and fight other "
+                "pirates to protect your treasure and pride.",
+                SCREEN_WIDTH // 2,  # Center the x-coordinate based on the screen width
+                400,  # y-coordinate
+                arcade.color.BLACK,  # Text color
+                13,  # Font size
+                width=800,  # Width of the text box
+                multiline=True,  # Enable multiline text
+                align="center",  # Align text to center
+                anchor_x="center",  # Set anchor point for x to the center
+                font_name="Kenney Rocket"
+            ),
+            # Player 1 controls
+            CachedText("Player 1\n"
+                       "Left:\t\tA \n"
+                       "Right:\t\tD\n"
+                       "Up:\t\t\tW\n"
+                       "Attack:\t\tR\n"
+                       "Throw:\t\tF",
+                       520, 280,
+                       arcade.color.BLACK,
+                       10, width=500,
+                       multiline=True, anchor_x="center",
+                       font_name="Kenney Rocket"
+                       ),
+            # Player 2 controls
+            CachedText("Player 2\n"
+                       "Left:\t\t< \n"
+                       "Right:\t\t>\n"
+                       "Up:\t\t\t^\n"
+                       "Attack:\t\t/\n"
+                       "Throw:\t\t.",
+                       820, 280,
+                       arcade.color.BLACK,
+                       10, width=500,
+                       multiline=True, anchor_x="center",
+                       font_name="Kenney Rocket"
+                       ),
+        ]
+
+    def reset(self):
+        """ Reset all necessary variables and states """
+        self.cur_foreground = self.black_esc
+        self.escape_button.texture = self.cur_foreground
+        self.escape_button.width, self.escape_button.height = 50, 25  # Setting a texture resets the size
+        self.escape_text.set(color=arcade.color.BLACK)
+        self.is_transitioning = False
 
-        # Draw the filled rectangles for Player 1 and Player 2 control boxes
-        arcade.draw_lrtb_rectangle_filled(250, 450, 300, 200, arcade.color.LIGHT_GRAY)  # Player 1
-        arcade.draw_lrtb_rectangle_filled(550, 750, 300, 200, arcade.color.LIGHT_GRAY)  # Player 2
-
-        # Draw the outlines around the control boxes
-        arcade.draw_lrtb_rectangle_outline(250, 450, 300, 200, arcade.color.BLACK, 2)  # Player 1 outline
-        arcade.draw_lrtb_rectangle_outline(550, 750, 300, 200, arcade.color.BLACK, 2)  # Player 2 outline
-
-        text_p_one_x = 520
-        text_p_one_y = 280
-
-        # Player 1 controls
-        arcade.draw_text("Player 1\n"
-                         "Left:\t\tA \n"
-                         "Right:\t\tD\n"
-                         "Up:\t\t\tW\n"
-                         "Attack:\t\tR",
-                         text_p_one_x, text_p_one_y,
-                         arcade.color.BLACK,
-                         10, width=500,
-                         multiline=True, anchor_x="center",
-                         font_name="Kenney Rocket"
-                         )
-
-        text_p_two_x = 820
-        text_p_two_y = 280
-        # Player 2 controls
-        arcade.draw_text("Player 2\n"
-                         "Left:\t\t< \n"
-                         "Right:\t\t>\n"
-                         "Up:\t\t\t^\n"
-                         "Attack:\t\t/\n",
-                         text_p_two_x, text_p_two_y,
-                         arcade.color.BLACK,
-                         10, width=500,
-                         multiline=True, anchor_x="center",
-                         font_name="Kenney Rocket"
-                         )
-
-        # Player 1 controls
+    def on_draw(self):
+        arcade.start_render()  # clear prev screen to start drawing
+        self.sprite_list.draw()
+        self.control_boxes.draw()
+        for text in self.texts:
+            text.draw()
 
     def on_key_press(self, key, modifiers):
         if key == arcade.key.ESCAPE:  # Go back to main menu
             self.cur_foreground = self.red_esc
-            self.escape_color = arcade.color.RED
+            self.escape_button.texture = self.cur_foreground
+            self.escape_button.width, self.escape_button.height = 50, 25  # Setting a texture resets the size
+            self.escape_text.set(color=arcade.color.RED)
             self.is_transitioning = True  # Set flag to prevent multiple transitions
             arcade.schedule(self.switch_main_menu, DELAY_TIME)
 
     def switch_main_menu(self, delta_time):
         """ Switch to the Main Menu view after a delay """
         arcade.unschedule(self.switch_main_menu)  # Stop further scheduling of this function
-        self.window.show_view(MainMenu())
+        VIEWS.show("menu")
+
+
+def open_gamepads(controls):
+    """ Open every connected gamepad and send its events to controls, numbered in the order arcade lists them """
+    gamepads = []
+    # Headless arcade (no display) leaves joysticks out altogether
+    get_joysticks = getattr(arcade, "get_joysticks", None)
+    if get_joysticks is None:
+        return gamepads
+    for index, joystick in enumerate(get_joysticks()):
+        try:
+            joystick.open()
+        except pyglet.input.DeviceException:
+            logger.warning("Couldn't open gamepad %d (%s)", index, joystick.device.name)
+            continue
+        joystick.push_handlers(GamepadEvents(controls, index, time.perf_counter))
+        gamepads.append(joystick)
+    if gamepads:
+        logger.info("%d gamepad(s) connected", len(gamepads))
+    return gamepads
+
+
+def new_game_board(**options):
+    """ The first GameBoard, later matches reset() it instead """
+    board = GameBoard(**options)
+    board.setup()
+    return board
+
+
+def new_view_manager(window):
+    return ViewManager(window, {"menu": MainMenu, "howto": HowTo, "game": new_game_board})
+
+
+def run(fps):
+    """ arcade.run(), but drawing fps frames a second (0 for as fast as possible) where pyglet would draw 60 """
+    if fps == DEFAULT_FPS:
+        arcade.run()
+    else:
+        pyglet.app.run(1 / fps if fps > 0 else 0)
 
 
 def main():
-    window = arcade.Window(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
-    main_menu = MainMenu()
-    window.show_view(main_menu)
-    arcade.run()
+    global REPLAY_DIR, ONLINE, PROFILER, LEVEL, BOT, BROADCAST, WATCH, BINDINGS, INPUT_BUFFER, LATENCY, VIEWS
+    launch_time = time.perf_counter()
+    parser = argparse.ArgumentParser(description=SCREEN_TITLE)
+    parser.add_argument("--record", metavar="DIR", help="save a replay of every match to this folder")
+    parser.add_argument("--remote", type=parse_address, metavar="HOST:PORT",
+                        help="play online against the peer (or relay) at this address")
+    parser.add_argument("--player", type=int, choices=[0, 1], default=0, help="which player you are online")
+    parser.add_argument("--port", type=int, default=7001, help="local UDP port for online play")
+    parser.add_argument("--seed", type=int, default=1, help="match seed, both peers must use the same one")
+    parser.add_argument("--level", metavar="FILE", help="play on a tile-map level, e.g. levels/island.txt")
+    parser.add_argument("--bot", choices=list(bots.DIFFICULTIES), help="let the computer play player 2")
+    parser.add_argument("--broadcast", type=int, nargs="?", const=RELAY_PORT, metavar="PORT",
+                        help=f"stream every match to spectators through a relay on this port ({RELAY_PORT})")
+    parser.add_argument("--spectate", type=parse_address, metavar="HOST:PORT", help="watch someone's broadcast")
+    parser.add_argument("--delay", type=float, default=DEFAULT_DELAY,
+                        help="seconds a spectator stays behind the broadcast, more smooths out a worse network")
+    parser.add_argument("--fps", type=int, default=DEFAULT_FPS, metavar="N",
+                        help=f"frames drawn per second ({DEFAULT_FPS}), e.g. 144 or 240, or 0 for as many as possible. "
+                             "The game itself always runs at 60 ticks a second")
+    parser.add_argument("--vsync", action="store_true",
+                        help="wait for the display's refresh, with --fps 0 this draws at the monitor's own rate")
+    parser.add_argument("--controls", metavar="FILE",
+                        help="key and gamepad bindings as JSON, \"python controls.py defaults\" prints the defaults")
+    parser.add_argument("--input-buffer", type=int, default=DEFAULT_BUFFER_TICKS, metavar="TICKS",
+                        help=f"ticks a jump or attack pressed too early waits to happen ({DEFAULT_BUFFER_TICKS}), 0 to "
+                             "drop it")
+    parser.add_argument("--profile", action="store_true", help="time every frame, F3 shows the overlay")
+    parser.add_argument("--trace", metavar="FILE", help="profile and save a Chrome trace (chrome://tracing) on exit")
+    parser.add_argument("--verbose", action="store_true", help="log debug messages too")
+    args = parser.parse_args()
+    log.setup(logging.DEBUG if args.verbose else logging.INFO)
+    REPLAY_DIR = args.record
+    if args.profile or args.trace:
+        PROFILER = Profiler(trace=args.trace is not None)
+    LATENCY = LatencyMeter(profiler=PROFILER)
+    INPUT_BUFFER = args.input_buffer
+    try:
+        if args.controls:
+            BINDINGS = load_bindings(args.controls)
+        Bindings(BINDINGS, key_code)  # Checked now rather than when the first match starts
+    except ControlsError as error:
+        parser.error(str(error))
+    if args.level:
+        LEVEL = load_level(args.level)
+    if args.remote is not None:
+        ONLINE = (args.player, args.port, args.remote, args.seed)
+    elif args.bot is not None:
+        BOT = args.bot
+        bots.start_workers()  # Started now so they're ready by the time a match begins
+    relay = None
+    if args.broadcast is not None:
+        BROADCAST = args.broadcast
+        relay = start_relay(args.broadcast)
+    if args.spectate is not None:
+        WATCH = Watcher(args.spectate, args.delay)
+        if not WATCH.wait_for_start():
+            logger.error("No broadcast to watch at %s:%d", *args.spectate)
+            return
+        LEVEL = WATCH.playback.level
+
+    update_rate = 1 / args.fps if args.fps > 0 else UNCAPPED_INTERVAL
+    window = GameWindow(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE, update_rate=update_rate, vsync=args.vsync)
+    # Decode everything in the background while the menu is already showing
+    assets.preload()
+    VIEWS = new_view_manager(window)
+    VIEWS.show("menu", launch_time=launch_time)
+    run(args.fps)
+    bots.stop_workers()
+    if relay is not None:
+        relay.terminate()
+    if WATCH is not None:
+        WATCH.close()
+
+    if args.trace:
+        events = PROFILER.export_trace(args.trace)
+        logger.info("Wrote %d trace events to %s", events, args.trace)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,379 @@
+"""
+Online play over UDP with rollback.
+
+Each peer simulates the whole match itself. Local input is applied a couple
+of frames late (input delay) and sent to the other peers every tick; inputs
+that haven't arrived yet are predicted by repeating that player's last known
+input. When a real input turns out to differ from the prediction, the match
+is restored to the saved state from before that frame and re-simulated up to
+the present, so both peers always end up with the same match.
+
+Try it on one machine with a relay that adds latency and drops packets:
+
+    python netplay.py demo --latency 60 --jitter 15 --loss 0.1
+
+or run the pieces yourself:
+
+    python netplay.py relay --port 7000 --latency 60 --loss 0.05
+    python netplay.py peer --player 0 --port 7001 --remote 127.0.0.1:7000
+    python netplay.py peer --player 1 --port 7002 --remote 127.0.0.1:7000
+"""
+import argparse
+import asyncio
+import queue
+import random
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from simulation import FIXED_DT, Match
+from snapshot import Snapshotter
+
+INPUT_DELAY = 2  # Frames between pressing a key and it taking effect, hides most of the latency
+MAX_ROLLBACK = 12  # Frames we may run ahead of the last confirmed remote input before waiting
+MAX_INPUTS_PER_PACKET = 32  # Unacknowledged inputs are resent in every packet until acked
+
+PACKET_INPUTS = 1
+PACKET = struct.Struct("<BBiiB")  # type, player, ack frame, first frame, input count
+
+
+class RollbackSession:
+    """ Keeps a Match in step with remote players, rolling back when predictions are wrong """
+
+    def __init__(self, match, local_player, input_delay=INPUT_DELAY, max_rollback=MAX_ROLLBACK):
+        self.match = match
+        self.local_player = local_player
+        self.num_players = len(match.fighters)
+        self.input_delay = input_delay
+        self.max_rollback = max_rollback
+        self.frame = 0  # Frames simulated so far
+        # Confirmed input per player, frame -> bits. The first input_delay frames are empty for everyone
+        self.inputs = [{frame: 0 for frame in range(input_delay)} for _ in range(self.num_players)]
+        self.confirmed = [input_delay - 1] * self.num_players  # Last frame with every earlier input known
+        self.forgotten = 0  # Inputs for frames before this have been dropped
+        self.used = {}  # Frame -> inputs the match was stepped with, possibly predicted
+        # Snapshot from just before each frame was simulated. No frame older than max_rollback is ever restored,
+        # so a ring of buffers is reused instead of saving a new state every frame
+        self.snapshotter = Snapshotter(match)
+        self.states = [self.snapshotter.new_buffer() for _ in range(max_rollback + 2)]
+        self.acked = [input_delay - 1] * self.num_players  # Last local frame each remote player has
+        self.inbox = queue.SimpleQueue()  # Filled from the network thread, drained on the game thread
+
+        # Stats for tuning
+        self.rollbacks = 0
+        self.frames_resimulated = 0
+        self.longest_rollback = 0
+        self.worst_rollback_time = 0.0
+        self.stalls = 0
+
+    @property
+    def remote_players(self):
+        return [player for player in range(self.num_players) if player != self.local_player]
+
+    def receive(self, player, ack, first_frame, bits):
+        """ Thread safe, queue a packet's worth of inputs from a remote player """
+        self.inbox.put((player, ack, first_frame, bits))
+
+    def input_for(self, player, frame):
+        """ The confirmed input if we have it, otherwise the last input we know that player held """
+        bits = self.inputs[player].get(frame)
+        if bits is None:
+            bits = self.inputs[player][self.confirmed[player]]
+        return bits
+
+    def process_inbox(self):
+        """ Store newly arrived inputs and roll back if any of them contradict what we simulated """
+        earliest_wrong = None
+        while True:
+            try:
+                player, ack, first_frame, bits = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            self.acked[player] = max(self.acked[player], ack)
+            known = self.inputs[player]
+            for frame, value in enumerate(bits, start=first_frame):
+                if frame <= self.confirmed[player] or frame in known:
+                    continue
+                known[frame] = value
+                used = self.used.get(frame)
+                if used is not None and used[player] != value:
+                    earliest_wrong = frame if earliest_wrong is None else min(earliest_wrong, frame)
+            while self.confirmed[player] + 1 in known:
+                self.confirmed[player] += 1
+
+        if earliest_wrong is not None:
+            self.rollback(earliest_wrong)
+        self.forget_old_frames()
+
+    def rollback(self, frame):
+        """ Restore the state from before frame and re-simulate up to the present """
+        start = time.perf_counter()
+        states = self.states
+        self.snapshotter.load(states[frame % len(states)])
+        for replayed in range(frame, self.frame):
+            inputs = [self.input_for(player, replayed) for player in range(self.num_players)]
+            self.snapshotter.save(states[replayed % len(states)])
+            self.match.step(inputs)
+            self.used[replayed] = inputs
+        elapsed = time.perf_counter() - start
+        self.rollbacks += 1
+        self.frames_resimulated += self.frame - frame
+        self.longest_rollback = max(self.longest_rollback, self.frame - frame)
+        self.worst_rollback_time = max(self.worst_rollback_time, elapsed)
+
+    def forget_old_frames(self):
+        # Nothing at or before the oldest confirmed frame can be rolled back to again
+        oldest = min(self.confirmed)
+        for frame in [frame for frame in self.used if frame <= oldest]:
+            del self.used[frame]
+        # Inputs are read back by rollbacks, as each player's latest confirmed input and for resending local input
+        # a remote player hasn't acknowledged, so anything older than all three can go
+        local = self.confirmed[self.local_player]
+        horizon = min([oldest - self.max_rollback] + [max(self.acked[player] + 1, local - MAX_INPUTS_PER_PACKET + 1)
+                                                      for player in self.remote_players])
+        for frame in range(self.forgotten, horizon):
+            for known in self.inputs:
+                known.pop(frame, None)
+        self.forgotten = max(self.forgotten, horizon)
+
+    def advance(self, local_bits):
+        """ Take this tick's local input and simulate one frame. Returns False when waiting on a peer """
+        self.process_inbox()
+        # Don't run further ahead of the slowest peer than we are willing to roll back
+        if self.frame - min(self.confirmed) > self.max_rollback:
+            self.stalls += 1
+            return False
+
+        local_frame = self.frame + self.input_delay
+        self.inputs[self.local_player][local_frame] = local_bits
+        self.confirmed[self.local_player] = local_frame
+
+        inputs = [self.input_for(player, self.frame) for player in range(self.num_players)]
+        self.snapshotter.save(self.states[self.frame % len(self.states)])
+        self.match.step(inputs)
+        self.used[self.frame] = inputs
+        self.frame += 1
+        return True
+
+    def outgoing_packet(self, remote_player):
+        """ Every local input the remote player hasn't acknowledged yet, plus our ack of theirs """
+        first = max(self.acked[remote_player] + 1, self.confirmed[self.local_player] - MAX_INPUTS_PER_PACKET + 1)
+        last = self.confirmed[self.local_player]
+        local = self.inputs[self.local_player]
+        bits = bytes(local[frame] for frame in range(first, last + 1))
+        return PACKET.pack(PACKET_INPUTS, self.local_player, self.confirmed[remote_player], first, len(bits)) + bits
+
+    def synced_through(self):
+        """ Last frame that every player's real input is known for and has been simulated """
+        return min(min(self.confirmed), self.frame - 1)
+
+
+def parse_packet(data):
+    kind, player, ack, first_frame, count = PACKET.unpack_from(data)
+    if kind != PACKET_INPUTS or len(data) != PACKET.size + count:
+        return None
+    return player, ack, first_frame, data[PACKET.size:]
+
+
+class UdpPeer(asyncio.DatagramProtocol):
+    """ Moves input packets between a RollbackSession and the remote peers (or a relay) """
+
+    def __init__(self, session, remotes):
+        self.session = session
+        self.remotes = remotes  # remote player -> (host, port)
+        self.transport = None
+        self.bad_packets = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        packet = parse_packet(data) if len(data) >= PACKET.size else None
+        if packet is None or packet[0] == self.session.local_player:
+            self.bad_packets += 1
+            return
+        self.session.receive(*packet)
+
+    def send_packets(self, packets):
+        for player, packet in packets:
+            self.transport.sendto(packet, self.remotes[player])
+
+
+def build_packets(session):
+    return [(player, session.outgoing_packet(player)) for player in session.remote_players]
+
+
+class NetworkThread:
+    """ Runs the UDP transport on its own asyncio loop so the render loop never blocks on the network """
+
+    def __init__(self, session, local_port, remote):
+        self.session = session
+        self.loop = asyncio.new_event_loop()
+        self.peer = UdpPeer(session, {player: remote for player in session.remote_players})
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(local_port,), daemon=True, name="netplay")
+        self.thread.start()
+        self.ready.wait()
+
+    def run(self, local_port):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(
+            self.loop.create_datagram_endpoint(lambda: self.peer, local_addr=("0.0.0.0", local_port))
+        )
+        self.ready.set()
+        self.loop.run_forever()
+
+    def send(self):
+        # Packets are built here, on the game thread, because that is where the session changes
+        self.loop.call_soon_threadsafe(self.peer.send_packets, build_packets(self.session))
+
+    def close(self):
+        if self.peer.transport is not None:
+            self.loop.call_soon_threadsafe(self.peer.transport.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class LossyRelay(asyncio.DatagramProtocol):
+    """ Forwards packets between the peers that talk to it, adding latency, jitter and loss """
+
+    def __init__(self, latency=0.05, jitter=0.0, loss=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.peers = []  # Addresses in the order they first sent something
+        self.transport = None
+        self.forwarded = 0
+        self.dropped = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if addr not in self.peers:
+            self.peers.append(addr)
+        for peer in self.peers:
+            if peer == addr:
+                continue
+            if self.rng.random() < self.loss:
+                self.dropped += 1
+                continue
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            asyncio.get_running_loop().call_later(delay, self.transport.sendto, data, peer)
+            self.forwarded += 1
+
+
+def random_bot(seed):
+    """ Scripted input that holds a random choice for a few frames, like a person mashing keys """
+    rng = random.Random(seed)
+    bits = 0
+    frame = 0
+    while True:
+        if frame % 6 == 0:
+            bits = rng.randrange(32)
+        yield bits
+        frame += 1
+
+
+async def run_headless_peer(player, local_port, remote, frames, seed, num_players=2):
+    """ Play a match against the remote peer with a random bot, then report the state hash at the end """
+    match = Match(seed, num_players)
+    session = RollbackSession(match, player)
+    loop = asyncio.get_running_loop()
+    peer = UdpPeer(session, {other: remote for other in session.remote_players})
+    transport, _ = await loop.create_datagram_endpoint(lambda: peer, local_addr=("127.0.0.1", local_port))
+    bot = random_bot(seed * 100 + player)
+    bits = next(bot)
+    next_tick = loop.time()
+    worst_tick = 0.0
+    while session.synced_through() < frames - 1:
+        start = time.perf_counter()
+        if session.frame < frames:
+            if session.advance(bits):
+                bits = next(bot)
+        else:
+            session.process_inbox()  # Finished, just waiting for the last remote inputs
+        peer.send_packets(build_packets(session))
+        worst_tick = max(worst_tick, time.perf_counter() - start)
+        next_tick += FIXED_DT
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+    # Keep sending for a moment so the other peer gets our last inputs too
+    for _ in range(30):
+        peer.send_packets(build_packets(session))
+        await asyncio.sleep(FIXED_DT)
+    transport.close()
+    print(f"player {player}: frame {session.frame} hash {match.state_hash().hex()} "
+          f"rollbacks {session.rollbacks} (longest {session.longest_rollback} frames, "
+          f"worst {session.worst_rollback_time * 1000:.2f} ms) stalls {session.stalls} "
+          f"worst tick {worst_tick * 1000:.2f} ms", flush=True)
+    return match.state_hash()
+
+
+async def run_relay(port, latency, jitter, loss, duration=None):
+    loop = asyncio.get_running_loop()
+    relay = LossyRelay(latency, jitter, loss)
+    transport, _ = await loop.create_datagram_endpoint(lambda: relay, local_addr=("127.0.0.1", port))
+    try:
+        if duration is None:
+            await asyncio.Event().wait()
+        else:
+            await asyncio.sleep(duration)
+    finally:
+        transport.close()
+        print(f"relay: forwarded {relay.forwarded} dropped {relay.dropped}", flush=True)
+
+
+def parse_address(text):
+    host, port = text.rsplit(":", 1)
+    return host, int(port)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Rollback netplay tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    peer = commands.add_parser("peer", help="play a headless match against another peer")
+    peer.add_argument("--player", type=int, required=True)
+    peer.add_argument("--port", type=int, required=True)
+    peer.add_argument("--remote", type=parse_address, required=True)
+    peer.add_argument("--frames", type=int, default=1200)
+    peer.add_argument("--seed", type=int, default=1)
+
+    for name in ("relay", "demo"):
+        command = commands.add_parser(name, help="forward packets with simulated latency and loss"
+                                      if name == "relay" else "run a relay and two peers and compare results")
+        command.add_argument("--port", type=int, default=7000)
+        command.add_argument("--latency", type=float, default=60, help="one way, in ms")
+        command.add_argument("--jitter", type=float, default=10, help="ms")
+        command.add_argument("--loss", type=float, default=0.05, help="fraction of packets dropped")
+    args = parser.parse_args(argv)
+
+    if args.command == "peer":
+        asyncio.run(run_headless_peer(args.player, args.port, args.remote, args.frames, args.seed))
+    elif args.command == "relay":
+        asyncio.run(run_relay(args.port, args.latency / 1000, args.jitter / 1000, args.loss))
+    else:
+        relay = subprocess.Popen([sys.executable, __file__, "relay", "--port", str(args.port),
+                                  "--latency", str(args.latency), "--jitter", str(args.jitter),
+                                  "--loss", str(args.loss)])
+        time.sleep(0.5)
+        remote = f"127.0.0.1:{args.port}"
+        peers = [subprocess.Popen([sys.executable, __file__, "peer", "--player", str(player),
+                                   "--port", str(args.port + 1 + player), "--remote", remote],
+                                  stdout=subprocess.PIPE, text=True)
+                 for player in range(2)]
+        outputs = [process.communicate()[0] for process in peers]
+        relay.terminate()
+        for output in outputs:
+            print(output, end="")
+        hashes = {line.split(" hash ")[1].split()[0] for line in outputs if " hash " in line}
+        print("peers agree" if len(hashes) == 1 else "PEERS DISAGREE")
+        return 0 if len(hashes) == 1 else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,200 @@
+"""
+Particle effects stored in NumPy arrays.
+
+Positions, sizes and colors live in one interleaved structured array that is
+uploaded to the GPU as-is and drawn as instanced quads, so a whole system is
+one buffer write and one draw call no matter how many particles it holds.
+Updates are vectorized over the arrays, so nothing here loops per particle.
+Projectiles are drawn the same way, copied over from the simulation's pool.
+"""
+import arcade
+import numpy as np
+from array import array
+from arcade.gl import BufferDescription
+
+from projectiles import KINDS, PROJECTILE_CAPACITY
+
+CONFETTI_COLORS = [arcade.color.RED, arcade.color.BLUE, arcade.color.YELLOW, arcade.color.GREEN,
+                   arcade.color.PURPLE]
+SPARK_COLORS = [arcade.color.WHITE, arcade.color.YELLOW, arcade.color.ORANGE]
+PROJECTILE_COLORS = {"bottle": arcade.color.DARK_GREEN, "cannonball": arcade.color.BLACK,
+                     "barrel": arcade.color.BROWN}
+
+# Per-particle data the GPU needs, interleaved in the order of the vertex attributes below
+INSTANCE_DTYPE = np.dtype([("pos", np.float32, 2), ("size", np.float32, 2), ("color", np.uint8, 4)])
+
+VERTEX_SHADER = """
+#version 330
+uniform vec2 screen_size;
+uniform vec2 offset;
+in vec2 in_vert;
+in vec2 in_pos;
+in vec2 in_size;
+in vec4 in_color;
+out vec4 color;
+void main() {
+    vec2 world = in_pos + in_vert * in_size - offset;
+    gl_Position = vec4(world / screen_size * 2.0 - 1.0, 0.0, 1.0);
+    color = in_color;
+}
+"""
+
+FRAGMENT_SHADER = """
+#version 330
+in vec4 color;
+out vec4 fragColor;
+void main() {
+    fragColor = color;
+}
+"""
+
+
+def _rgba(colors):
+    return np.array([tuple(color) + (255,) * (4 - len(color)) for color in colors], dtype=np.uint8)
+
+
+class ParticleSystem:
+    """ A fixed-capacity batch of rectangular particles """
+
+    def __init__(self, capacity, gravity=0.0, seed=None):
+        self.capacity = capacity
+        self.gravity = gravity  # Subtracted from the y velocity every update
+        self.rng = np.random.default_rng(seed)
+        self.count = 0  # Live particles are always packed into [0, count)
+        self.instances = np.zeros(capacity, dtype=INSTANCE_DTYPE)
+        self.velocities = np.zeros((capacity, 2), dtype=np.float32)
+        self.life = np.full(capacity, np.inf, dtype=np.float32)  # Updates left, inf lives forever
+
+        # GL objects are made on the first draw so the system can be updated without a window
+        self.program = None
+        self.geometry = None
+        self.instance_buffer = None
+
+    def emit(self, count, x, y, vx, vy, width, height, colors, life=np.inf):
+        """ Spawn up to count particles. Position/velocity/size args are (low, high) ranges or a number """
+        count = min(count, self.capacity - self.count)
+        if count <= 0:
+            return
+        new = slice(self.count, self.count + count)
+        self.instances["pos"][new, 0] = self._sample(x, count)
+        self.instances["pos"][new, 1] = self._sample(y, count)
+        self.velocities[new, 0] = self._sample(vx, count)
+        self.velocities[new, 1] = self._sample(vy, count)
+        self.instances["size"][new, 0] = self._sample(width, count)
+        self.instances["size"][new, 1] = self._sample(height, count)
+        palette = _rgba(colors)
+        self.instances["color"][new] = palette[self.rng.integers(0, len(palette), count)]
+        self.life[new] = life
+        self.count += count
+
+    def _sample(self, value, count):
+        if isinstance(value, tuple):
+            low, high = value
+            return self.rng.uniform(low, high, count)
+        return value
+
+    def update(self):
+        """ Move every live particle one frame and drop the ones that expired """
+        live = slice(0, self.count)
+        self.velocities[live, 1] -= self.gravity
+        self.instances["pos"][live] += self.velocities[live]
+        self.life[live] -= 1
+
+        expired = self.life[live] <= 0
+        if expired.any():
+            # Compact the survivors to the front so the live range stays contiguous
+            keep = ~expired
+            survivors = int(keep.sum())
+            self.instances[:survivors] = self.instances[live][keep]
+            self.velocities[:survivors] = self.velocities[live][keep]
+            self.life[:survivors] = self.life[live][keep]
+            self.count = survivors
+
+    def clear(self):
+        self.count = 0
+
+    def draw(self, ctx, offset=(0, 0), size=None):
+        """ Upload the live particles and draw them all in a single instanced call.
+
+        offset is the world position at the bottom-left of the screen and size the
+        world area the screen shows, the window size unless the camera is zoomed.
+        """
+        if self.count == 0:
+            return
+        if self.program is None:
+            self._build(ctx)
+        self.instance_buffer.write(self.instances[:self.count].tobytes())
+        self.program["screen_size"] = size or ctx.window.get_size()
+        self.program["offset"] = offset
+        self.geometry.render(self.program, instances=self.count)
+
+    def _build(self, ctx):
+        self.program = ctx.program(vertex_shader=VERTEX_SHADER, fragment_shader=FRAGMENT_SHADER)
+        # Unit quad, scaled and moved per instance in the vertex shader
+        quad = ctx.buffer(data=array("f", [-0.5, -0.5, 0.5, -0.5, -0.5, 0.5, 0.5, 0.5]))
+        self.instance_buffer = ctx.buffer(reserve=self.capacity * INSTANCE_DTYPE.itemsize)
+        self.geometry = ctx.geometry(
+            [
+                BufferDescription(quad, "2f", ["in_vert"]),
+                BufferDescription(self.instance_buffer, "2f 2f 4f1", ["in_pos", "in_size", "in_color"],
+                                  normalized=["in_color"], instanced=True),
+            ],
+            mode=ctx.TRIANGLE_STRIP,
+        )
+
+
+class ConfettiSystem(ParticleSystem):
+    """ Confetti that falls forever, jumping back above the screen when it reaches the bottom """
+
+    def __init__(self, count, screen_width, screen_height, seed=None):
+        super().__init__(count, seed=seed)
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.reset()
+
+    def reset(self):
+        """ Put all the confetti back above the top of the screen, reusing the same arrays """
+        self.clear()
+        # Set the position of the confetti randomly at the top of the screen, falling at a random speed
+        self.emit(self.capacity, (0, self.screen_width), (self.screen_height, self.screen_height + 200), 0, (-3, -1),
+                  (5, 10), (5, 15), CONFETTI_COLORS)
+
+    def update(self):
+        super().update()
+        # If confetti goes off-screen, reset to the top
+        positions = self.instances["pos"][:self.count]
+        fallen = np.flatnonzero(positions[:, 1] < 0)
+        if len(fallen):
+            positions[fallen, 0] = self.rng.uniform(0, self.screen_width, len(fallen))
+            positions[fallen, 1] = self.rng.uniform(self.screen_height, self.screen_height + 200, len(fallen))
+            self.velocities[fallen, 1] = self.rng.uniform(-3, -1, len(fallen))
+
+
+def emit_hit_sparks(system, x, y, count=30):
+    """ A short burst of sparks where an attack landed """
+    system.emit(count, (x - 10, x + 10), (y - 10, y + 10), (-4, 4), (1, 6), (2, 4), (2, 4), SPARK_COLORS, life=30)
+
+
+class ProjectileLayer(ParticleSystem):
+    """ Draws a match's projectiles, one colored box per projectile in a single instanced call """
+
+    def __init__(self, capacity=PROJECTILE_CAPACITY):
+        super().__init__(capacity)
+        self.sizes = np.array([(kind.width, kind.height) for kind in KINDS], dtype=np.float32)
+        self.colors = _rgba([PROJECTILE_COLORS[kind.name] for kind in KINDS])
+
+    def sync(self, pool, alpha=1.0):
+        """
+        Copy the live projectiles out of a projectiles.ProjectilePool, one array
+        copy per field. alpha places them between the last tick (1) and the one
+        before (0), which is where they were one change_x/change_y back
+        """
+        count = min(pool.count, self.capacity)
+        kinds = np.frombuffer(pool.kind, dtype=np.int8, count=count)
+        live = self.instances[:count]
+        back = 1.0 - alpha
+        live["pos"][:, 0] = np.frombuffer(pool.x, count=count) - back * np.frombuffer(pool.change_x, count=count)
+        live["pos"][:, 1] = np.frombuffer(pool.y, count=count) - back * np.frombuffer(pool.change_y, count=count)
+        live["size"] = self.sizes[kinds]
+        live["color"] = self.colors[kinds]
+        self.count = count
@@ -0,0 +1,169 @@
+"""
+Opt-in frame profiler.
+
+Code marks its stages with `with profiler.stage("physics"):`. Time spent in
+each stage is summed over the frame and end_frame() adds the totals to a
+rolling window, from which the overlay reads p50/p95/p99. Stages can nest;
+each one is reported on its own. Measurements that aren't once per frame,
+like input latency, are added one at a time with sample() and reported
+alongside. With tracing on every stage is also kept as
+a Chrome trace event, so a run can be opened in chrome://tracing or Perfetto.
+
+Code that is too hot for even an empty `with` block, like Match.step(), is
+split into methods instead and instrument() wraps them on the one object being
+profiled, so everything else runs the plain methods at full speed.
+
+Nothing is timed unless a Profiler is handed out: NULL_PROFILER has the same
+methods and does nothing, so instrumented code needs no checks of its own.
+"""
+import json
+import time
+from collections import deque
+
+WINDOW = 300  # Frames of history the percentiles are taken over, 5 seconds at 60 FPS
+MAX_TRACE_EVENTS = 1_000_000  # About 100 MB of JSON, tracing stops quietly after this
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """ Nearest-rank percentiles of the samples, 0 for every point when there are none """
+    if not samples:
+        return [0.0 for _ in points]
+    ordered = sorted(samples)
+    return [ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))] for point in points]
+
+
+class Stage:
+    """ Context manager that adds its elapsed time to one stage, reused every frame """
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        profiler = self.profiler
+        profiler.totals[self.name] = profiler.totals.get(self.name, 0) + end - self.start
+        if profiler.trace is not None and len(profiler.trace) < MAX_TRACE_EVENTS:
+            profiler.trace.append((self.name, self.start, end - self.start))
+        return False
+
+
+class Profiler:
+    """ Per-stage frame timings with rolling percentiles and an optional trace """
+
+    def __init__(self, window=WINDOW, trace=False):
+        self.window = window
+        self.stages = {}  # Name -> Stage, so timing a stage allocates nothing
+        self.totals = {}  # Name -> nanoseconds spent in the stage so far this frame
+        self.history = {}  # Name -> milliseconds per frame, the last `window` frames
+        self.samples = {}  # Name -> the last `window` values passed to sample()
+        self.trace = [] if trace else None  # (name, start ns, duration ns)
+        self.origin = time.perf_counter_ns()
+        self.frame_start = self.origin
+        self.frames = 0
+
+    def stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage(self, name)
+        return stage
+
+    def instrument(self, obj, method, name=None):
+        """ Time every call of obj.method as a stage by shadowing the method on that one instance """
+        original = getattr(obj, method)
+        stage = self.stage(name or method)
+
+        def timed(*args, **kwargs):
+            with stage:
+                return original(*args, **kwargs)
+        setattr(obj, method, timed)
+
+    def sample(self, name, milliseconds):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+        samples.append(milliseconds)
+
+    def end_frame(self):
+        """ Close the current frame, recording every stage (0 for the ones that didn't run) and the frame time """
+        now = time.perf_counter_ns()
+        self.totals["frame"] = now - self.frame_start
+        self.frame_start = now
+        for name, total in self.totals.items():
+            history = self.history.get(name)
+            if history is None:
+                history = self.history[name] = deque(maxlen=self.window)
+            history.append(total / 1e6)
+        for name in self.history:
+            if name not in self.totals:
+                self.history[name].append(0.0)
+        self.totals = {}
+        self.frames += 1
+
+    def report(self):
+        """ (stage, last ms, p50, p95, p99) for every stage seen, the whole frame first """
+        rows = []
+        for name, history in self.history.items():
+            rows.append((name, history[-1], *percentiles(history)))
+        rows.sort(key=lambda row: row[0] != "frame")
+        for name, samples in self.samples.items():
+            rows.append((name, samples[-1], *percentiles(samples)))
+        return rows
+
+    def export_trace(self, file_name):
+        """ Write the trace in Chrome's JSON trace event format, times in microseconds """
+        if self.trace is None:
+            return 0
+        events = [{"name": name, "ph": "X", "ts": (start - self.origin) / 1000, "dur": duration / 1000,
+                   "pid": 0, "tid": 0}
+                  for name, start, duration in self.trace]
+        with open(file_name, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        return len(events)
+
+
+class NullStage:
+    """ Does nothing, for when profiling is off """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullProfiler:
+    """ Stands in for a Profiler when profiling is off """
+    trace = None
+    frames = 0
+
+    def __init__(self):
+        self.null_stage = NullStage()
+
+    def stage(self, name):
+        return self.null_stage
+
+    def instrument(self, obj, method, name=None):
+        pass
+
+    def sample(self, name, milliseconds):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def report(self):
+        return []
+
+    def export_trace(self, file_name):
+        return 0
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,127 @@
+"""
+Projectiles and level hazards: thrown bottles, cannonballs and falling barrels.
+
+Every projectile in a match lives in one fixed-capacity ProjectilePool. Each
+field is a typed array with one slot per projectile, and the live ones are
+always packed into the first `count` slots, so spawning writes the next slot
+and despawning moves the last live projectile into the gap. Neither allocates
+anything, and the renderer can hand the position arrays straight to NumPy
+(they support the buffer protocol) to draw every projectile in one call.
+
+Hazards are emitters a level places: a cannon fires along its row every so
+many ticks, and a barrel drop lets a barrel fall from a random spot across
+its span. Like the rest of the simulation nothing here imports arcade;
+Match.update_projectiles() moves the pool and checks it against fighters and
+platforms.
+"""
+import math
+from array import array
+
+PROJECTILE_CAPACITY = 512  # Per match, spawns beyond this are dropped and counted
+
+
+class Kind:
+    """ How one sort of projectile flies and what it does to whoever it hits """
+    __slots__ = ("name", "width", "height", "speed", "lift", "gravity", "life", "damage", "hitstun", "knockback")
+
+    def __init__(self, name, width, height, speed, lift, gravity, life, damage=1, hitstun=12, knockback=3):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.speed = speed  # Horizontal speed it is launched at, in the direction it's fired
+        self.lift = lift  # Vertical speed it is launched at
+        self.gravity = gravity  # Subtracted from the vertical speed every tick
+        self.life = life  # Ticks before it disappears on its own
+        self.damage = damage
+        self.hitstun = hitstun
+        self.knockback = knockback
+
+
+BOTTLE = 0
+CANNONBALL = 1
+BARREL = 2
+KINDS = (
+    Kind("bottle", 12, 12, speed=8, lift=6, gravity=0.4, life=120),
+    Kind("cannonball", 16, 16, speed=10, lift=0, gravity=0, life=240, damage=2, knockback=6),
+    Kind("barrel", 30, 34, speed=0, lift=0, gravity=0.3, life=300, damage=2, hitstun=20),
+)
+KIND_NAMES = {kind.name: index for index, kind in enumerate(KINDS)}
+
+# Hazard emitters: (kind, left, right, y, direction, period, phase). Each spawns one projectile on the ticks where
+# tick % period == phase, at a random x between left and right (or exactly there when they are equal)
+CANNON_PERIOD = 180
+BARREL_PERIOD = 240
+
+
+def schedule_hazards(hazards):
+    """ (cycle, {tick % cycle: emitters due}) so a tick finds what fires with one lookup instead of a scan """
+    cycle = 1
+    for hazard in hazards:
+        cycle = math.lcm(cycle, hazard[5])
+    schedule = {}
+    for hazard in hazards:
+        period, phase = hazard[5], hazard[6]
+        for tick in range(phase % period, cycle, period):
+            schedule.setdefault(tick, []).append(hazard)
+    return cycle, schedule
+
+
+class ProjectilePool:
+    """ Structure-of-arrays storage for every projectile in a match, live ones packed at the front """
+
+    def __init__(self, capacity=PROJECTILE_CAPACITY):
+        self.capacity = capacity
+        self.count = 0
+        self.kind = array("b", bytes(capacity))
+        self.owner = array("b", bytes(capacity))  # Index of the fighter that threw it, -1 for hazards
+        self.x = array("d", bytes(8 * capacity))  # Center of its box
+        self.y = array("d", bytes(8 * capacity))
+        self.change_x = array("d", bytes(8 * capacity))
+        self.change_y = array("d", bytes(8 * capacity))
+        self.ticks = array("i", bytes(4 * capacity))  # Ticks left to live
+        self.columns = (self.kind, self.owner, self.x, self.y, self.change_x, self.change_y, self.ticks)
+        self.dropped = 0  # Spawns refused because the pool was full
+
+    def spawn(self, kind, owner, x, y, direction):
+        """ Launch a projectile of KINDS[kind] facing direction (1 or -1), returns its slot or -1 if full """
+        index = self.count
+        if index == self.capacity:
+            self.dropped += 1
+            return -1
+        stats = KINDS[kind]
+        self.kind[index] = kind
+        self.owner[index] = owner
+        self.x[index] = x
+        self.y[index] = y
+        self.change_x[index] = stats.speed * direction
+        self.change_y[index] = stats.lift
+        self.ticks[index] = stats.life
+        self.count = index + 1
+        return index
+
+    def despawn(self, index):
+        """ Remove a projectile by moving the last live one into its slot """
+        last = self.count - 1
+        if index != last:
+            self.kind[index] = self.kind[last]
+            self.owner[index] = self.owner[last]
+            self.x[index] = self.x[last]
+            self.y[index] = self.y[last]
+            self.change_x[index] = self.change_x[last]
+            self.change_y[index] = self.change_y[last]
+            self.ticks[index] = self.ticks[last]
+        self.count = last
+
+    def clear(self):
+        self.count = 0
+
+    def get_state(self):
+        """ The live projectiles as one tuple per field """
+        count = self.count
+        return tuple(tuple(column[:count]) for column in self.columns)
+
+    def set_state(self, state):
+        count = len(state[0])
+        for column, values in zip(self.columns, state):
+            column[:count] = array(column.typecode, values)
+        self.count = count
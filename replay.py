@@ -0,0 +1,240 @@
+"""
+Replay files: every input of a match, enough to re-simulate it exactly.
+
+A replay starts with a fixed header (magic, format version, player count,
+RNG seed, snapshot interval, level name length) and the level's file name,
+empty for the arena, followed by chunks of tag, length and payload:
+
+    I  first frame, then one byte of input bits per player per frame
+    S  frame, then a zlib compressed snapshot of the match (snapshot.py)
+       so a reader can seek without re-simulating from the start
+    E  frame count, then the final state hash
+
+Frames count calls to Match.step(), including the ones after the match froze.
+The level is loaded again from its file name when the replay is played, so a
+level file edited since would make the replay diverge.
+
+    python replay.py verify replays/*.pcr
+    python replay.py check                 record and verify an arena and a level match
+"""
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+from levels import LevelError, load_level
+from simulation import Match
+from snapshot import Snapshotter
+
+MAGIC = b"PCRP"
+VERSION = 6  # Bumped whenever the simulation rules or the file layout change, older replays would play out differently
+HEADER = struct.Struct("<4sHBQHH")  # magic, version, players, seed, snapshot interval, level name length
+CHUNK = struct.Struct("<cI")  # tag, payload length
+FRAME = struct.Struct("<I")
+
+SNAPSHOT_INTERVAL = 600  # Frames between snapshots, 10 seconds of play
+INPUT_CHUNK_FRAMES = 256  # Frames of input buffered before a chunk is written
+WRITE_BUFFER = 64 * 1024
+
+
+class ReplayError(Exception):
+    """ The file isn't a replay this version can read, or re-simulating it gave a different result """
+
+
+def pack_inputs(inputs):
+    """ One byte of input bits per player """
+    return bytes(inputs)
+
+
+def unpack_inputs(data, num_players):
+    return list(data[:num_players])
+
+
+class ReplayWriter:
+    """ Streams a match's inputs to a file as it is played """
+
+    def __init__(self, file_name, match, level=None, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.file = open(file_name, "wb", buffering=WRITE_BUFFER)
+        self.num_players = len(match.fighters)
+        self.snapshot_interval = snapshot_interval
+        self.frame = 0
+        self.pending = bytearray()  # Packed inputs not written yet
+        self.pending_start = 0
+        self.snapshotter = Snapshotter(match)
+        self.snapshot = self.snapshotter.new_buffer()
+        level_name = level.path.encode() if level is not None else b""
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.num_players, match.seed, snapshot_interval, len(level_name)))
+        self.file.write(level_name)
+
+    def record(self, inputs, match):
+        """ Call once per Match.step(), after stepping, with the inputs that were passed to it """
+        self.pending += pack_inputs(inputs)
+        self.frame += 1
+        if self.frame % self.snapshot_interval == 0:
+            self.flush_inputs()
+            self.write_chunk(b"S", FRAME.pack(self.frame) +
+                             zlib.compress(self.snapshotter.save(self.snapshot), 1))
+        elif self.frame - self.pending_start >= INPUT_CHUNK_FRAMES:
+            self.flush_inputs()
+
+    def flush_inputs(self):
+        if self.pending:
+            self.write_chunk(b"I", FRAME.pack(self.pending_start) + self.pending)
+        self.pending = bytearray()
+        self.pending_start = self.frame
+
+    def write_chunk(self, tag, payload):
+        self.file.write(CHUNK.pack(tag, len(payload)))
+        self.file.write(payload)
+
+    def close(self, match):
+        """ Finish the file with the final state hash so a replay run can be checked """
+        if self.file.closed:
+            return
+        self.flush_inputs()
+        self.write_chunk(b"E", FRAME.pack(self.frame) + match.state_hash())
+        self.file.close()
+
+
+class Replay:
+    """ A replay file read into memory """
+
+    def __init__(self, file_name):
+        with open(file_name, "rb") as file:
+            data = file.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ReplayError(f"{file_name} is not a replay")
+        version, = struct.unpack_from("<H", data, len(MAGIC))
+        if version != VERSION:
+            raise ReplayError(f"{file_name} is replay version {version}, this build reads version {VERSION}")
+        _, _, self.num_players, self.seed, self.snapshot_interval, name_length = HEADER.unpack_from(data)
+        level_name = data[HEADER.size:HEADER.size + name_length].decode()
+        try:
+            self.level = load_level(level_name) if level_name else None  # None for the arena
+        except (LevelError, OSError) as error:
+            raise ReplayError(f"{file_name} was played on level {level_name}, which can't be loaded: {error}")
+
+        self.file_name = file_name
+        self.inputs = []  # Input bits per player, per frame
+        self.snapshots = {}  # Frame -> snapshot
+        self.final_frame = None
+        self.final_hash = None
+
+        stride = self.num_players
+        offset = HEADER.size + name_length
+        while offset < len(data):
+            tag, length = CHUNK.unpack_from(data, offset)
+            offset += CHUNK.size
+            frame, = FRAME.unpack_from(data, offset)
+            payload = data[offset + FRAME.size:offset + length]
+            offset += length
+            if tag == b"I":
+                for start in range(0, len(payload), stride):
+                    self.inputs.append(unpack_inputs(payload[start:start + stride], self.num_players))
+            elif tag == b"S":
+                self.snapshots[frame] = zlib.decompress(payload)
+            elif tag == b"E":
+                self.final_frame = frame
+                self.final_hash = payload
+        if self.final_hash is None:
+            raise ReplayError(f"{self.file_name} was not closed, the match may have crashed")
+
+    def new_match(self):
+        if self.level is not None:
+            return self.level.new_match(self.seed, self.num_players)
+        return Match(self.seed, self.num_players)
+
+    def seek(self, frame):
+        """ The match as it was after the given number of frames, starting from the nearest snapshot """
+        match = self.new_match()
+        start = max((snapshot for snapshot in self.snapshots if snapshot <= frame), default=0)
+        if start:
+            Snapshotter(match).load(self.snapshots[start])
+        for inputs in self.inputs[start:frame]:
+            match.step(inputs)
+        return match
+
+    def verify(self):
+        """ Re-simulate the whole match, checking every snapshot and the final hash along the way """
+        match = self.new_match()
+        snapshotter = Snapshotter(match)
+        buffer = snapshotter.new_buffer()
+        for frame, inputs in enumerate(self.inputs, start=1):
+            match.step(inputs)
+            snapshot = self.snapshots.get(frame)
+            if snapshot is not None and snapshotter.save(buffer) != snapshot:
+                raise ReplayError(f"{self.file_name} diverged before frame {frame}")
+        if match.state_hash() != self.final_hash:
+            raise ReplayError(f"{self.file_name} ended in a different state than it was recorded with")
+        return match
+
+
+def record_random_match(file_name, seed, num_players=2, max_frames=60 * 120, level=None):
+    """ Write a replay of a match played with random inputs, for trying out the runner """
+    match = level.new_match(seed, num_players) if level is not None else Match(seed, num_players)
+    writer = ReplayWriter(file_name, match, level)
+    rng = random.Random(seed + 1)
+    inputs = [0] * num_players
+    while not match.frozen and writer.frame < max_frames:
+        if writer.frame % 6 == 0:
+            inputs = [rng.randrange(32) for _ in range(num_players)]
+        match.step(inputs)
+        writer.record(inputs, match)
+    writer.close(match)
+    return match
+
+
+def check(level_name="levels/island.txt"):
+    """ Record a random match on the arena and one on a level, then verify both and seek into them """
+    failures = 0
+    with tempfile.TemporaryDirectory() as folder:
+        for name, level in (("arena", None), (level_name, load_level(level_name))):
+            file_name = os.path.join(folder, "check.pcr")
+            recorded = record_random_match(file_name, 7, level=level)
+            try:
+                replay = Replay(file_name)
+                replay.verify()
+                if replay.seek(len(replay.inputs)).state_hash() != recorded.state_hash():
+                    raise ReplayError("seeking from the last snapshot gave a different match")
+                print(f"{name}: {len(replay.inputs)} frames verified")
+            except ReplayError as error:
+                failures += 1
+                print(f"{name}: FAIL {error}")
+    return failures
+
+
+def main(args):
+    if args[:1] == ["check"]:
+        failures = check()
+        print("Replays play back the same matches" if not failures else f"{failures} replays failed")
+        return 1 if failures else 0
+    if len(args) < 2 or args[0] not in ("verify", "record"):
+        print("usage: python replay.py verify FILE... | python replay.py record FILE [SEED] | python replay.py check")
+        return 2
+    if args[0] == "record":
+        match = record_random_match(args[1], int(args[2]) if len(args) > 2 else 0)
+        print(f"Recorded {match.tick} ticks to {args[1]}")
+        return 0
+
+    failures = 0
+    frames = 0
+    start = time.perf_counter()
+    for file_name in args[1:]:
+        try:
+            replay = Replay(file_name)
+            replay.verify()
+            frames += len(replay.inputs)
+        except (ReplayError, OSError) as error:
+            failures += 1
+            print(f"FAIL {error}")
+    elapsed = time.perf_counter() - start
+    print(f"{len(args) - 1 - failures}/{len(args) - 1} replays verified, "
+          f"{frames} frames in {elapsed:.2f}s ({frames / max(elapsed, 1e-9):.0f} frames/s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,554 @@
+"""
+Dedicated match server: many authoritative matches per process, no window.
+
+Clients send JOIN and are queued until there are enough of them for a match.
+From then on they only send their held input bits; the server steps every
+match it hosts once per FIXED_DT and sends each player the fighters' state a
+few times a second. Nothing is rendered and arcade is never imported.
+
+Each worker process is one shard with its own asyncio loop, matchmaking queue
+and UDP port (base port + worker index), so a host uses as many cores as it
+has workers. Every host tick is timed against a budget. While a shard is over
+budget it stops starting matches, and if it stays over budget it ends its
+newest match (telling the players why) instead of letting every match slow
+down. A shard that still falls behind drops ticks rather than trying to catch
+up.
+
+Matches are on the single-screen arena, or all on one tile-map level with
+--level. MATCHED doesn't say which, so clients have to be started on the
+same level as the server.
+
+    python server.py serve --workers 4
+    python server.py serve --workers 4 --level levels/island.txt
+    python server.py load --clients 400 --workers 4 --duration 30
+    python server.py check    feed input packets to a shard and check every input bit reaches its match
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import socket
+import struct
+import sys
+import time
+from collections import deque
+
+from levels import load_level
+from netplay import random_bot
+from profiler import percentiles
+from simulation import FIXED_DT, INPUT_ATTACK, INPUT_JUMP, INPUT_LEFT, INPUT_RIGHT, INPUT_THROW, Match
+
+SERVER_PORT = 7100
+PLAYERS_PER_MATCH = 2
+TICK_BUDGET = 0.8 * FIXED_DT  # A host tick may use this much of its frame, the rest is for the network
+LOAD_SMOOTHING = 0.05  # Weight of the newest tick in the running average of tick times
+SHED_AFTER = 30  # Host ticks with the average over budget before a match is ended to make room
+MAX_LAG = 0.25  # Seconds behind schedule before ticks are dropped instead of caught up
+MAX_QUEUE = 512  # Waiting clients before JOINs are refused
+CLIENT_TIMEOUT = 5.0  # Seconds without a packet before a player counts as gone
+STATE_INTERVAL = 3  # Ticks between state packets, 20 a second
+METRICS_INTERVAL = 5.0  # Seconds between metrics reports
+METRICS_WINDOW = 600  # Host ticks kept for the latency percentiles
+RECEIVE_BUFFER = 4 * 1024 * 1024  # Room for a few ticks of input from every client while a tick runs
+INPUT_MASK = INPUT_LEFT | INPUT_RIGHT | INPUT_JUMP | INPUT_ATTACK | INPUT_THROW  # Bits a client may send
+
+# Packet types, client to server
+JOIN = 1
+INPUT = 2
+LEAVE = 3
+STATS = 4
+# Server to client
+MATCHED = 10
+STATE = 11
+END = 12
+BUSY = 13
+
+END_FINISHED = 0
+END_SHED = 1
+END_ABANDONED = 2
+
+TYPE = struct.Struct("<B")
+INPUT_PACKET = struct.Struct("<BIB")  # type, match id, input bits
+MATCHED_PACKET = struct.Struct("<BIBBQ")  # type, match id, player, players, seed
+STATE_PACKET = struct.Struct("<BII")  # type, match id, tick, then one FIGHTER_STATE per fighter
+FIGHTER_STATE = struct.Struct("<hhbB")  # x, y, health, flags
+END_PACKET = struct.Struct("<BIbB8s")  # type, match id, winner (-1 for a draw), reason, state hash
+
+FLAG_ATTACKING = 1
+FLAG_DEAD = 2
+
+
+class HostedMatch:
+    """ One match on a shard and the players connected to it """
+
+    def __init__(self, match_id, seed, addresses, now, level=None):
+        self.match_id = match_id
+        self.match = level.new_match(seed, len(addresses)) if level is not None else Match(seed, len(addresses))
+        self.addresses = addresses
+        self.inputs = [0] * len(addresses)  # Latest held bits from each player
+        self.last_seen = [now] * len(addresses)
+        self.cost = 0.0  # Seconds spent stepping this match
+
+    def state_packet(self):
+        packet = bytearray(STATE_PACKET.pack(STATE, self.match_id, self.match.tick))
+        for fighter in self.match.fighters:
+            flags = (FLAG_ATTACKING if fighter.is_attacking else 0) | (FLAG_DEAD if fighter.is_dead else 0)
+            packet += FIGHTER_STATE.pack(round(fighter.x), round(fighter.y), fighter.health, flags)
+        return packet
+
+    def end_packet(self, reason):
+        winner = -1 if self.match.winner is None else self.match.winner
+        return END_PACKET.pack(END, self.match_id, winner, reason, self.match.state_hash())
+
+
+class MatchShard(asyncio.DatagramProtocol):
+    """ Hosts matches for the clients that talk to one UDP port """
+
+    def __init__(self, shard, players_per_match=PLAYERS_PER_MATCH, tick_budget=TICK_BUDGET, level=None):
+        self.shard = shard
+        self.players_per_match = players_per_match
+        self.level = level  # Every match is on this level, or the arena if None
+        self.tick_budget = tick_budget
+        self.transport = None
+        self.matches = {}  # Match id -> HostedMatch, in the order they started
+        self.clients = {}  # Address -> (match id, player)
+        self.queue = deque()  # Addresses waiting for a match
+        self.next_match_id = shard << 24  # Ids stay unique across shards
+        self.load = 0.0  # Running average of host tick time, single slow ticks don't count as overload
+        self.over_budget = 0  # Host ticks in a row with the average over budget
+
+        # Metrics
+        self.tick_times = deque(maxlen=METRICS_WINDOW)
+        self.started = 0
+        self.finished = 0
+        self.shed = 0
+        self.abandoned = 0
+        self.refused = 0
+        self.dropped_ticks = 0
+        self.ticks = 0
+        self.packets_in = 0
+        self.packets_out = 0
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def send(self, packet, address):
+        self.transport.sendto(packet, address)
+        self.packets_out += 1
+
+    def datagram_received(self, data, addr):
+        self.packets_in += 1
+        if not data:
+            return
+        kind = data[0]
+        if kind == INPUT and len(data) == INPUT_PACKET.size:
+            _, match_id, bits = INPUT_PACKET.unpack(data)
+            seat = self.clients.get(addr)
+            if seat is not None and seat[0] == match_id:
+                hosted = self.matches[match_id]
+                hosted.inputs[seat[1]] = bits & INPUT_MASK
+                hosted.last_seen[seat[1]] = time.perf_counter()
+        elif kind == JOIN:
+            self.join(addr)
+        elif kind == LEAVE:
+            self.leave(addr)
+        elif kind == STATS:
+            self.send(TYPE.pack(STATS) + json.dumps(self.metrics()).encode(), addr)
+
+    def join(self, address):
+        seat = self.clients.get(address)
+        if seat is not None:
+            # Already playing, the MATCHED packet was probably lost
+            hosted = self.matches[seat[0]]
+            self.send(MATCHED_PACKET.pack(MATCHED, seat[0], seat[1], len(hosted.addresses), hosted.match.seed),
+                      address)
+        elif address in self.queue:
+            return
+        elif len(self.queue) >= MAX_QUEUE:
+            self.refused += 1
+            self.send(TYPE.pack(BUSY), address)
+        else:
+            self.queue.append(address)
+
+    def leave(self, address):
+        seat = self.clients.pop(address, None)
+        if seat is not None:
+            hosted = self.matches[seat[0]]
+            hosted.inputs[seat[1]] = 0
+            hosted.last_seen[seat[1]] = 0.0
+        elif address in self.queue:
+            self.queue.remove(address)
+
+    @property
+    def admitting(self):
+        """ New matches only start while the shard keeps within its budget """
+        return self.load <= self.tick_budget
+
+    def matchmake(self, now):
+        while self.admitting and len(self.queue) >= self.players_per_match:
+            addresses = [self.queue.popleft() for _ in range(self.players_per_match)]
+            match_id = self.next_match_id
+            self.next_match_id += 1
+            hosted = HostedMatch(match_id, match_id, addresses, now, self.level)
+            self.matches[match_id] = hosted
+            self.started += 1
+            for player, address in enumerate(addresses):
+                self.clients[address] = (match_id, player)
+                self.send(MATCHED_PACKET.pack(MATCHED, match_id, player, len(addresses), hosted.match.seed), address)
+
+    def end_match(self, hosted, reason):
+        packet = hosted.end_packet(reason)
+        for address in hosted.addresses:
+            if self.clients.get(address, (None,))[0] == hosted.match_id:
+                del self.clients[address]
+                self.send(packet, address)
+        del self.matches[hosted.match_id]
+
+    def tick(self):
+        """ Step every match once and send out state, returns how long it took """
+        start = time.perf_counter()
+        self.matchmake(start)
+        send_state = self.ticks % STATE_INTERVAL == 0
+        for hosted in list(self.matches.values()):
+            match_start = time.perf_counter()
+            if all(start - seen > CLIENT_TIMEOUT for seen in hosted.last_seen):
+                self.abandoned += 1
+                self.end_match(hosted, END_ABANDONED)
+                continue
+            hosted.match.step(hosted.inputs)
+            if hosted.match.frozen:
+                self.finished += 1
+                self.end_match(hosted, END_FINISHED)
+                continue
+            if send_state:
+                packet = hosted.state_packet()
+                for address in hosted.addresses:
+                    self.send(packet, address)
+            hosted.cost += time.perf_counter() - match_start
+        self.ticks += 1
+
+        elapsed = time.perf_counter() - start
+        self.tick_times.append(elapsed)
+        self.load += (elapsed - self.load) * LOAD_SMOOTHING
+        if self.load > self.tick_budget:
+            self.over_budget += 1
+            if self.over_budget >= SHED_AFTER and self.matches:
+                # Still over after a while, give up the newest match so the others keep full speed
+                newest = next(reversed(self.matches.values()))
+                self.shed += 1
+                self.end_match(newest, END_SHED)
+                self.over_budget = 0
+        else:
+            self.over_budget = 0
+        return elapsed
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            self.tick()
+            next_tick += FIXED_DT
+            now = loop.time()
+            if now - next_tick > MAX_LAG:
+                # Too far behind to catch up, skip ahead and let matches run slow for a moment
+                skipped = int((now - next_tick) / FIXED_DT)
+                self.dropped_ticks += skipped
+                next_tick += skipped * FIXED_DT
+            await asyncio.sleep(max(0.0, next_tick - now))
+
+    def metrics(self):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        p50, p95, p99 = percentiles(self.tick_times)
+        return {
+            "shard": self.shard,
+            "matches": len(self.matches),
+            "queued": len(self.queue),
+            "players": len(self.clients),
+            "started": self.started,
+            "finished": self.finished,
+            "shed": self.shed,
+            "abandoned": self.abandoned,
+            "refused": self.refused,
+            "dropped_ticks": self.dropped_ticks,
+            "tick_p50_ms": p50 * 1000,
+            "tick_p95_ms": p95 * 1000,
+            "tick_p99_ms": p99 * 1000,
+            "cpu": cpu / max(wall, 1e-9),  # Fraction of a core this shard used
+            "packets_in": self.packets_in,
+            "packets_out": self.packets_out,
+        }
+
+
+async def run_shard(shard, host, port, players_per_match, level_name=None, reports=None):
+    loop = asyncio.get_running_loop()
+    server = MatchShard(shard, players_per_match, level=load_level(level_name) if level_name else None)
+    transport, _ = await loop.create_datagram_endpoint(lambda: server, local_addr=(host, port))
+    transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+    ticker = asyncio.ensure_future(server.run())
+    try:
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            if reports is None:
+                print(format_metrics([server.metrics()]), flush=True)
+            else:
+                reports.put(server.metrics())
+            # Restart the CPU window so the report shows current load, not the average since launch
+            server.cpu_start = time.process_time()
+            server.wall_start = time.perf_counter()
+    finally:
+        ticker.cancel()
+        transport.close()
+
+
+def shard_process(shard, host, port, players_per_match, level_name, reports):
+    try:
+        asyncio.run(run_shard(shard, host, port, players_per_match, level_name, reports))
+    except KeyboardInterrupt:
+        pass
+
+
+def format_metrics(reports):
+    """ One line summing up every shard, latencies are the worst shard's """
+    matches = sum(report["matches"] for report in reports)
+    cpu = sum(report["cpu"] for report in reports)
+    worst = max(reports, key=lambda report: report["tick_p99_ms"])
+    capacity = matches / cpu * (TICK_BUDGET / FIXED_DT) if cpu > 0 else 0
+    return (f"{len(reports)} shards: {matches} matches ({matches / len(reports):.0f}/shard), "
+            f"{sum(report['queued'] for report in reports)} queued, "
+            f"tick p50/p95/p99 {worst['tick_p50_ms']:.2f}/{worst['tick_p95_ms']:.2f}/{worst['tick_p99_ms']:.2f} ms, "
+            f"cpu {cpu:.2f} cores (~{capacity:.0f} matches at budget), "
+            f"shed {sum(report['shed'] for report in reports)}, "
+            f"refused {sum(report['refused'] for report in reports)}, "
+            f"dropped ticks {sum(report['dropped_ticks'] for report in reports)}")
+
+
+def serve(host, port, workers, players_per_match, level_name=None):
+    if workers == 1:
+        asyncio.run(run_shard(0, host, port, players_per_match, level_name))
+        return
+    reports = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=shard_process, daemon=True,
+                                         args=(shard, host, port + shard, players_per_match, level_name, reports))
+                 for shard in range(workers)]
+    for process in processes:
+        process.start()
+    print(f"Serving {workers} shards on ports {port}-{port + workers - 1}", flush=True)
+    latest = {}
+    try:
+        while True:
+            report = reports.get()
+            latest[report["shard"]] = report
+            if len(latest) == workers:
+                print(format_metrics(list(latest.values())), flush=True)
+                latest.clear()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+class LoadClient(asyncio.DatagramProtocol):
+    """ A scripted player: joins, mashes random input until the match ends, then joins again """
+
+    def __init__(self, server, seed, stats):
+        self.server = server
+        self.bot = random_bot(seed)
+        self.stats = stats
+        self.transport = None
+        self.match_id = None
+        self.joined_at = 0.0
+        self.last_heard = 0.0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.join()
+
+    def join(self):
+        self.match_id = None
+        self.joined_at = time.perf_counter()
+        self.transport.sendto(TYPE.pack(JOIN), self.server)
+
+    def datagram_received(self, data, addr):
+        kind = data[0]
+        self.last_heard = time.perf_counter()
+        if kind == MATCHED and self.match_id is None:
+            self.match_id = MATCHED_PACKET.unpack(data)[1]
+            self.stats["matched"] += 1
+            self.stats["wait"].append(time.perf_counter() - self.joined_at)
+        elif kind == STATE:
+            self.stats["states"] += 1
+        elif kind == END:
+            reason = END_PACKET.unpack(data)[3]
+            self.stats[("finished", "shed", "abandoned")[reason]] += 1
+            self.join()
+        elif kind == BUSY:
+            self.stats["busy"] += 1
+            self.match_id = None
+
+    def send_input(self):
+        """ Called ten times a second, random_bot changes its choice every 6 frames anyway """
+        now = time.perf_counter()
+        if self.match_id is None:
+            if now - self.joined_at > 1.0:
+                self.join()  # Lost JOIN, or refused, try again
+            return
+        if now - self.last_heard > 2.0:
+            self.join()  # Missed the END, the match is long gone
+            return
+        bits = next(self.bot)
+        for _ in range(5):
+            next(self.bot)
+        self.transport.sendto(INPUT_PACKET.pack(INPUT, self.match_id, bits), self.server)
+
+    def leave(self):
+        self.transport.sendto(TYPE.pack(LEAVE), self.server)
+        self.transport.close()
+
+
+async def query_stats(server):
+    loop = asyncio.get_running_loop()
+    reply = loop.create_future()
+
+    class Query(asyncio.DatagramProtocol):
+        def datagram_received(self, data, addr):
+            if data[0] == STATS and not reply.done():
+                reply.set_result(json.loads(data[1:]))
+
+    transport, _ = await loop.create_datagram_endpoint(Query, remote_addr=server)
+    try:
+        transport.sendto(TYPE.pack(STATS))
+        return await asyncio.wait_for(reply, 5.0)
+    finally:
+        transport.close()
+
+
+async def run_load(host, port, workers, clients, duration, ramp):
+    """ Connect scripted clients to every shard, spread evenly, and report what the server managed """
+    loop = asyncio.get_running_loop()
+    stats = {"matched": 0, "states": 0, "finished": 0, "shed": 0, "abandoned": 0, "busy": 0, "wait": []}
+    players = []
+
+    async def play():
+        while True:
+            for client in players:
+                client.send_input()
+            await asyncio.sleep(0.1)
+
+    inputs = asyncio.ensure_future(play())
+    ramp_start = time.perf_counter()
+    while len(players) < clients:
+        # Connect in batches so a busy loop doesn't stretch the ramp out
+        target = clients if ramp <= 0 else min(clients, int(clients * (time.perf_counter() - ramp_start) / ramp) + 1)
+        for index in range(len(players), target):
+            server = (host, port + index % workers)
+            _, client = await loop.create_datagram_endpoint(lambda: LoadClient(server, index, stats),
+                                                            remote_addr=server)
+            players.append(client)
+        await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    states_start = stats["states"]
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - start
+    inputs.cancel()
+
+    reports = []
+    for shard in range(workers):
+        try:
+            reports.append(await query_stats((host, port + shard)))
+        except asyncio.TimeoutError:
+            print(f"Shard {shard} did not answer, it may be too overloaded to reply")
+    for client in players:
+        client.leave()
+    wait_p50, wait_p99 = percentiles(stats["wait"], (50, 99))
+    print(f"{clients} clients for {elapsed:.0f}s: {stats['matched']} matches joined "
+          f"(wait p50 {wait_p50 * 1000:.0f} ms, p99 {wait_p99 * 1000:.0f} ms), "
+          f"{(stats['states'] - states_start) / elapsed:.0f} state packets/s, "
+          f"{stats['finished']} finished, {stats['shed']} shed, {stats['abandoned']} abandoned, {stats['busy']} refused")
+    if reports:
+        print(format_metrics(reports))
+
+
+class NullTransport:
+    """ Stands in for the UDP socket when a shard is driven directly """
+
+    def sendto(self, data, address):
+        pass
+
+
+def check(ticks=120, level=None):
+    """
+    Seat two clients on a shard without a network, send each input bit in
+    turn through datagram_received() and step the match. Every bit must reach
+    the fighters, and a throw must put a projectile owned by the thrower in the
+    pool. Returns the number of failures
+    """
+    shard = MatchShard(0, level=level)
+    shard.connection_made(NullTransport())
+    addresses = [("127.0.0.1", 9000), ("127.0.0.1", 9001)]
+    for address in addresses:
+        shard.datagram_received(TYPE.pack(JOIN), address)
+    shard.tick()
+    if len(shard.matches) != 1:
+        print("Two clients joining didn't start a match")
+        return 1
+    match_id, hosted = next(iter(shard.matches.items()))
+    failures = 0
+    if level is not None and hosted.match.width != level.width:
+        print(f"The hosted match isn't on {level.name}")
+        failures += 1
+    for bit in (INPUT_LEFT, INPUT_RIGHT, INPUT_JUMP, INPUT_ATTACK, INPUT_THROW):
+        shard.datagram_received(INPUT_PACKET.pack(INPUT, match_id, bit), addresses[0])
+        if hosted.inputs[0] != bit:
+            print(f"Input bit {bit} arrived as {hosted.inputs[0]}")
+            failures += 1
+        shard.tick()
+        shard.datagram_received(INPUT_PACKET.pack(INPUT, match_id, 0), addresses[0])
+        for _ in range(ticks):
+            shard.tick()
+    hosted.match.projectiles.clear()
+    shard.datagram_received(INPUT_PACKET.pack(INPUT, match_id, INPUT_THROW), addresses[0])
+    pool = hosted.match.projectiles
+    for _ in range(ticks):
+        shard.tick()
+        if any(pool.owner[index] == 0 for index in range(pool.count)):
+            break
+    else:
+        print("Player 1 held throw but never threw anything")
+        failures += 1
+    return failures
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Headless match server and load generator")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("check", help="check input packets reach a hosted match, throws included")
+    for name in ("serve", "load"):
+        command = commands.add_parser(name, help="host matches" if name == "serve" else "connect scripted clients")
+        command.add_argument("--host", default="127.0.0.1")
+        command.add_argument("--port", type=int, default=SERVER_PORT, help="first shard's port")
+        command.add_argument("--workers", type=int, default=1, help="shards, one process and port each")
+    commands.choices["serve"].add_argument("--players", type=int, default=PLAYERS_PER_MATCH)
+    commands.choices["serve"].add_argument("--level", metavar="FILE", help="host every match on this tile-map level")
+    commands.choices["load"].add_argument("--clients", type=int, default=200)
+    commands.choices["load"].add_argument("--duration", type=float, default=20, help="seconds")
+    commands.choices["load"].add_argument("--ramp", type=float, default=2, help="seconds to connect everyone")
+    args = parser.parse_args(argv)
+
+    if args.command == "check":
+        failures = check() + check(level=load_level("levels/island.txt"))
+        print("Every input bit reaches hosted matches" if not failures else f"{failures} server checks failed")
+        return 1 if failures else 0
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers, args.players, args.level)
+    else:
+        asyncio.run(run_load(args.host, args.port, args.workers, args.clients, args.duration, args.ramp))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,695 @@
+"""
+Headless match simulation.
+
+Everything that decides who wins a fight lives here: gravity, movement,
+platform collisions, screen bounds, attack timing and health. Nothing in this
+module imports arcade, so a match can be stepped on a server or in CI without
+a window. GameBoard feeds it inputs and draws whatever state it ends up in.
+
+Each fighter is in one state at a time (idle, walk, jump, attack, hitstun or
+dead) and only changes state through the TRANSITIONS table. A fighter standing
+idle with no input is skipped entirely, and attacks are only checked for hits
+on the frames their move lists hitboxes for, against the hurtboxes of the
+frame each target is showing. Boxes are measured from the spritesheets by
+hitboxes.py. Moves are data: add a Move to a Character and an input bit to
+INPUT_MOVES. A move can also release a projectile, which flies on its own
+alongside the level's hazards, see projectiles.py.
+"""
+import hashlib
+import random
+from array import array
+from itertools import repeat
+from operator import add, sub
+
+import hitboxes
+from projectiles import BOTTLE, KINDS, ProjectilePool, schedule_hazards
+from spatial import SpatialHash
+
+# Arena size (matches the window size in main.py)
+ARENA_WIDTH = 1000
+ARENA_HEIGHT = 500
+
+FIXED_DT = 1 / 60  # Length of one simulation tick in seconds
+GRAVITY = 0.5  # Gravity constant
+PLAYER_JUMP_SPEED = 10  # Jumping speed
+PLAYER_MOVE_SPEED = 5  # Horizontal speed while a move key is held
+STARTING_HEALTH = 5
+ATTACK_DAMAGE = 1  # Damage dealt per hit
+
+NUM_FRAMES_WALK = 6  # Number of frames for walking animations
+NUM_FRAMES_ATTACK_1 = 6  # Number of frames for player 1 attack animation
+NUM_FRAMES_ATTACK_2 = 6  # Number of frames for player 2 attack animation
+NUM_FRAMES_DEATH = 6  # Number of frames for death animations
+WALK_FRAME_TIME = 0.085  # Seconds per walk frame
+DEATH_FRAME_TIME = 0.1  # Seconds per death frame
+DEATH_TICKS = round((NUM_FRAMES_DEATH - 1) * DEATH_FRAME_TIME / FIXED_DT)  # Ticks until the last death frame shows
+ATTACK_FRAME_TICKS = 6  # Ticks per attack frame, a 6 frame swing lasts 0.6 seconds
+HITSTUN_TICKS = 12  # Ticks a fighter can't act after being hit
+KNOCKBACK_SPEED = 3  # Horizontal speed a hit pushes the target away at, for as long as the hitstun lasts
+
+# Body box of a fighter, measured from the walk spritesheets at 2x scale
+FIGHTER_WIDTH = 40
+FIGHTER_HEIGHT = 76
+
+# The ground platform (grassMid.png stretched across the screen, centered at y=50)
+PLATFORM_LEFT = 0
+PLATFORM_RIGHT = ARENA_WIDTH
+PLATFORM_TOP = 114
+PLATFORM_BOTTOM = -14
+GROUND = (PLATFORM_LEFT, PLATFORM_BOTTOM, PLATFORM_RIGHT, PLATFORM_TOP)  # (left, bottom, right, top)
+
+SPAWN_Y = 152  # Bottom of the body box when a fighter spawns
+FALL_LIMIT = -200  # Fighters that fall this far below the bottom of the world are out
+SPAWN_SPACING = 300  # Distance between neighbouring spawn points, squeezed to fit larger matches
+MIN_PLAYERS = 2
+MAX_PLAYERS = 64
+# Smaller matches, or ticks with few live swings, check attacks pairwise. See benchmarks/bench_collisions.py
+BROAD_PHASE_MIN_FIGHTERS = 32
+BROAD_PHASE_MIN_SWINGS = 8
+
+# Input bits, one byte per player per tick
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4
+INPUT_ATTACK = 8
+INPUT_THROW = 16
+
+# Fighter states
+IDLE = 0  # Standing still on the ground, costs nothing per tick
+WALK = 1
+JUMP = 2  # In the air, whether from jumping or walking off an edge
+ATTACK = 3
+HITSTUN = 4
+DEAD = 5
+STATE_NAMES = ("idle", "walk", "jump", "attack", "hitstun", "dead")
+
+# Event -> next state, one row per state in state order. Events a state doesn't list are ignored
+TRANSITIONS = (
+    {"move": WALK, "jump": JUMP, "fall": JUMP, "attack": ATTACK, "hit": HITSTUN, "die": DEAD},  # Idle
+    {"stop": IDLE, "jump": JUMP, "fall": JUMP, "attack": ATTACK, "hit": HITSTUN, "die": DEAD},  # Walk
+    {"land": IDLE, "attack": ATTACK, "hit": HITSTUN, "die": DEAD},  # Jump
+    {"finish": IDLE, "hit": HITSTUN, "die": DEAD},  # Attack
+    {"finish": IDLE, "hit": HITSTUN, "die": DEAD},  # Hitstun
+    {},  # Dead
+)
+STEERABLE = (IDLE, WALK, JUMP)  # States where the move keys set the horizontal speed
+
+
+def spawn_positions(num_players):
+    """ (center x, bottom y) for each player, centered on the arena. Two players spawn at 350 and 650 """
+    spacing = SPAWN_SPACING
+    if num_players > 1:
+        spacing = min(SPAWN_SPACING, (ARENA_WIDTH - FIGHTER_WIDTH) / (num_players - 1))
+    middle = (num_players - 1) / 2
+    return [(ARENA_WIDTH / 2 + (i - middle) * spacing, SPAWN_Y) for i in range(num_players)]
+
+
+def frame_boxes(boxes):
+    """ (bounds, *boxes) for one frame's boxes, the bounds being the box around all of them. None if there are none """
+    if not boxes:
+        return None
+    boxes = [tuple(box) for box in boxes]
+    bounds = (min(box[0] for box in boxes), min(box[1] for box in boxes),
+              max(box[2] for box in boxes), max(box[3] for box in boxes))
+    return (bounds, *boxes)
+
+
+class Move:
+    """ One attack as data: how long it lasts, and which frames can hit and where """
+    __slots__ = ("name", "num_frames", "frame_ticks", "duration", "hitboxes", "windows", "damage", "hitstun",
+                 "knockback", "projectile", "release")
+
+    def __init__(self, name, num_frames, hitboxes, frame_ticks=ATTACK_FRAME_TICKS, damage=ATTACK_DAMAGE,
+                 hitstun=HITSTUN_TICKS, knockback=KNOCKBACK_SPEED, projectile=None, release_frame=0):
+        self.name = name
+        self.num_frames = num_frames
+        self.frame_ticks = frame_ticks
+        self.duration = num_frames * frame_ticks  # Ticks until the attacker can act again
+        # Animation frame -> [(left, bottom, right, top)] relative to the fighter's feet, facing right.
+        # Frames without boxes are wind-up or recovery and can't hit
+        self.hitboxes = hitboxes
+        self.windows = [frame_boxes(hitboxes.get(tick // frame_ticks)) for tick in range(self.duration)]  # Per tick
+        self.damage = damage
+        self.hitstun = hitstun
+        self.knockback = knockback
+        self.projectile = projectile  # Kind thrown, an index in projectiles.KINDS, or None
+        self.release = release_frame * frame_ticks if projectile is not None else -1  # Tick it leaves the hand
+
+
+class Character:
+    """ Hurtboxes for every frame of a character's walk and attack animations, and the moves it can make """
+    __slots__ = ("name", "walk_frames", "attack_frames", "moves")
+
+    def __init__(self, name, walk_hurtboxes, attack_hurtboxes, moves):
+        self.name = name
+        self.walk_frames = [frame_boxes(boxes) for boxes in walk_hurtboxes]  # (bounds, *boxes) per frame
+        self.attack_frames = [frame_boxes(boxes) for boxes in attack_hurtboxes]
+        self.moves = moves
+
+
+# Used when hitboxes.json can't be read: the body box is the hurtbox and the sword reaches a little past it
+BODY_BOX = (-FIGHTER_WIDTH // 2, 0, FIGHTER_WIDTH // 2, FIGHTER_HEIGHT)
+SLASH = Move("slash", NUM_FRAMES_ATTACK_1, {
+    2: [(0, 20, 30, 70)],
+    3: [(0, 10, 40, 70)],
+    4: [(0, 10, 36, 60)],
+})
+# Every character throws a bottle with the first few frames of its attack animation
+THROW = Move("throw", 4, {}, projectile=BOTTLE, release_frame=2)
+DEFAULT_CHARACTER = Character("default", [[BODY_BOX]] * NUM_FRAMES_WALK, [[BODY_BOX]] * NUM_FRAMES_ATTACK_1,
+                              [SLASH, THROW])
+# Frames of each character's attack animation where the blade is out far enough to hit
+SLASH_FRAMES = {"captain": (3, 4, 5), "knightro": (1, 2, 4)}
+# (input bit, index in a character's moves), the first pressed one starts
+INPUT_MOVES = [(INPUT_ATTACK, 0), (INPUT_THROW, 1)]
+
+
+def load_characters():
+    """ Characters in player order with the boxes measured by hitboxes.py, or a stand-in without them """
+    characters = []
+    for entry in hitboxes.load():
+        attack = entry["attack"]
+        active = SLASH_FRAMES.get(entry["name"], range(len(attack)))
+        slash = Move("slash", len(attack), {frame: attack[frame]["hit"] for frame in active if attack[frame]["hit"]})
+        characters.append(Character(entry["name"], [frame["hurt"] for frame in entry["walk"]],
+                                    [frame["hurt"] for frame in attack], [slash, THROW]))
+    return characters or [DEFAULT_CHARACTER]
+
+
+CHARACTERS = load_characters()
+
+
+def _extent(frames):
+    return max((max(-frame[0][0], frame[0][2]) for frame in frames if frame is not None), default=0)
+
+
+KIND_GRAVITY = [kind.gravity for kind in KINDS]
+KIND_HALF_SIZES = [(kind.width / 2, kind.height / 2) for kind in KINDS]
+BULK_MIN_PROJECTILES = 16  # Below this many, moving projectiles one by one beats slicing the arrays
+
+# Furthest a fighter's hurtboxes stick out sideways from its x
+BODY_REACH = max(_extent(character.walk_frames + character.attack_frames) for character in CHARACTERS)
+# Furthest apart two fighters can stand and still hit each other, anyone further away is skipped without box tests
+REACH = max(_extent(move.windows) for character in CHARACTERS for move in character.moves) + BODY_REACH
+# Same for a projectile's center and a fighter's x
+PROJECTILE_REACH = max(kind.width / 2 for kind in KINDS) + BODY_REACH
+
+
+def overlaps(a, b):
+    """ Axis-aligned test between two (left, bottom, right, top) boxes """
+    return a[0] < b[2] and a[2] > b[0] and a[1] < b[3] and a[3] > b[1]
+
+
+class MatchRandom(random.Random):
+    """ random.Random that counts the calls able to change its state, so snapshots can skip an unchanged one """
+    changes = 0
+
+    def seed(self, *args, **kwargs):
+        self.changes += 1
+        super().seed(*args, **kwargs)
+
+    def setstate(self, state):
+        self.changes += 1
+        super().setstate(state)
+
+    def random(self):
+        self.changes += 1
+        return super().random()
+
+    def getrandbits(self, k):
+        self.changes += 1
+        return super().getrandbits(k)
+
+
+def build_platform_hash(platforms):
+    platform_hash = SpatialHash()
+    for index, platform in enumerate(platforms):
+        platform_hash.insert(index, *platform)
+    return platform_hash
+
+
+class Fighter:
+    """ State of one fighter """
+
+    # Fixed slots keep fighters small and attribute access fast when a match hosts dozens of them
+    __slots__ = ("x", "y", "change_x", "change_y", "health", "character", "facing", "state", "state_ticks", "move",
+                 "hitstun", "has_dealt_damage", "death_animation_done", "walk_time", "prev_input")
+
+    def __init__(self, x, y, facing=1, character=0):
+        self.x = x  # Center of the body box
+        self.y = y  # Bottom of the body box
+        self.change_x = 0
+        self.change_y = 0
+        self.health = STARTING_HEALTH
+        self.character = character  # Index in CHARACTERS
+        self.facing = facing  # 1 for right, -1 for left
+        self.state = IDLE
+        self.state_ticks = 0  # Ticks spent in the current state
+        self.move = 0  # Index in the character's moves of the attack being made
+        self.hitstun = 0  # Ticks the current hitstun lasts
+        self.has_dealt_damage = False
+        self.death_animation_done = False
+        self.walk_time = 0  # Drives the walk animation, only advances while moving
+        self.prev_input = 0  # Used to turn held jump/attack bits into presses
+
+    @property
+    def is_dead(self):
+        return self.state == DEAD
+
+    @property
+    def is_attacking(self):
+        return self.state == ATTACK
+
+    @property
+    def left(self):
+        return self.x - FIGHTER_WIDTH / 2
+
+    @property
+    def right(self):
+        return self.x + FIGHTER_WIDTH / 2
+
+    @property
+    def top(self):
+        return self.y + FIGHTER_HEIGHT
+
+    def box(self):
+        """ (left, bottom, right, top) of the body """
+        return self.x - FIGHTER_WIDTH / 2, self.y, self.x + FIGHTER_WIDTH / 2, self.y + FIGHTER_HEIGHT
+
+    def animation(self):
+        """ ("walk", "attack" or "death", frame) the fighter is showing """
+        if self.state == DEAD:
+            return "death", min(int(self.state_ticks * FIXED_DT / DEATH_FRAME_TIME), NUM_FRAMES_DEATH - 1)
+        if self.state == ATTACK:
+            move = CHARACTERS[self.character].moves[self.move]
+            return "attack", min(self.state_ticks // move.frame_ticks, move.num_frames - 1)
+        return "walk", int(self.walk_time / WALK_FRAME_TIME) % NUM_FRAMES_WALK
+
+    def place(self, boxes):
+        """ Boxes relative to the fighter's feet and facing right, moved to where it stands and the way it faces """
+        x = self.x
+        y = self.y
+        if self.facing > 0:
+            return [(x + left, y + bottom, x + right, y + top) for left, bottom, right, top in boxes]
+        return [(x - right, y + bottom, x - left, y + top) for left, bottom, right, top in boxes]
+
+    def hitboxes(self):
+        """ [bounds, *boxes] of the attack this tick in world space, or None outside the move's active frames """
+        window = CHARACTERS[self.character].moves[self.move].windows[self.state_ticks]
+        return None if window is None else self.place(window)
+
+    def hurtboxes(self):
+        """ [bounds, *boxes] of the body in world space, for the frame the fighter is showing """
+        kind, frame = self.animation()
+        character = CHARACTERS[self.character]
+        frames = character.attack_frames if kind == "attack" else character.walk_frames
+        return self.place(frames[frame])
+
+    def handle(self, event):
+        """ Change state as TRANSITIONS says, returns False if the current state ignores the event """
+        state = TRANSITIONS[self.state].get(event)
+        if state is None:
+            return False
+        self.state = state
+        self.state_ticks = 0
+        return True
+
+
+class Match:
+    """ A free-for-all match between 2 to 64 fighters, stepped at a fixed timestep """
+
+    def __init__(self, seed=0, num_players=2, platforms=None, width=ARENA_WIDTH, spawns=None, platform_hash=None,
+                 hazards=()):
+        if not MIN_PLAYERS <= num_players <= MAX_PLAYERS:
+            raise ValueError(f"A match needs {MIN_PLAYERS} to {MAX_PLAYERS} players, got {num_players}")
+        self.seed = seed
+        self.rng = MatchRandom(seed)  # All match randomness must come from here
+        self.tick = 0
+        self.width = width  # Fighters are kept between x=0 and this
+        spawns = spawns if spawns is not None else spawn_positions(num_players)
+        # Everyone starts out facing the middle of the arena
+        self.fighters = [Fighter(x, y, 1 if x <= width / 2 else -1, index % len(CHARACTERS))
+                         for index, (x, y) in enumerate(spawns[:num_players])]
+        self.platforms = list(platforms) if platforms is not None else [GROUND]  # (left, bottom, right, top) boxes
+
+        # Broad phase: platforms never move, so matches on the same level can share one prebuilt hash.
+        # Fighters are re-bucketed as they move
+        self.platform_hash = platform_hash if platform_hash is not None else build_platform_hash(self.platforms)
+        self.fighter_hash = SpatialHash()
+        for index, fighter in enumerate(self.fighters):
+            self.fighter_hash.insert(index, *fighter.box())
+        self.game_over = False
+        self.winner = None  # Index of the winning fighter, None for a draw
+        self.hits = []  # (attacker, target) pairs from the last step
+        self.active = []  # Fighters that moved in the last step, everyone else was idle or dead
+        self.swings = []  # Attackers in an active frame of their move that haven't hit anyone yet
+        self.hazards = tuple(hazards)  # (kind, left, right, y, direction, period, phase) emitters, see projectiles.py
+        self.hazard_cycle, self.hazard_schedule = schedule_hazards(self.hazards)
+        self.projectiles = ProjectilePool()
+        self.snapshotter = None  # Made on the first state_hash()
+
+    @property
+    def frozen(self):
+        """ Nothing moves once the match is decided and every death animation has finished """
+        return self.game_over and all(fighter.death_animation_done or fighter.state != DEAD
+                                      for fighter in self.fighters)
+
+    def get_state(self):
+        """ Everything needed to resume the match, as plain nested tuples """
+        fighters = tuple(tuple(getattr(fighter, name) for name in Fighter.__slots__) for fighter in self.fighters)
+        return self.tick, self.game_over, self.winner, self.rng.getstate(), fighters, self.projectiles.get_state()
+
+    def set_state(self, state):
+        """ Resume from a get_state() result, the match must have the same number of fighters """
+        self.tick, self.game_over, self.winner, rng_state, fighters, projectiles = state
+        self.rng.setstate(rng_state)
+        for fighter, values in zip(self.fighters, fighters):
+            for name, value in zip(Fighter.__slots__, values):
+                setattr(fighter, name, value)
+        self.projectiles.set_state(projectiles)
+
+    def state_hash(self):
+        """ Short digest of the full state, equal across runs and machines for equal states """
+        if self.snapshotter is None:
+            from snapshot import Snapshotter  # snapshot.py is built on this module
+            self.snapshotter = Snapshotter(self)
+        return hashlib.blake2b(self.snapshotter.save(), digest_size=8).digest()
+
+    def step(self, inputs):
+        """ Advance the match by one tick. inputs holds one bitmask per fighter """
+        self.hits = []
+        if self.frozen:
+            return
+        self.tick += 1
+        self.move_fighters(inputs)
+
+        # If the match is decided and every death animation is done, no further updates
+        if self.frozen:
+            return
+
+        self.manage_attacks()
+        if self.hazards:
+            due = self.hazard_schedule.get(self.tick % self.hazard_cycle)
+            if due:
+                self.fire_hazards(due)
+        if self.projectiles.count:
+            self.update_projectiles()
+        self.land_fighters()
+
+        # The match is over once at most one fighter is left standing
+        alive = [index for index, fighter in enumerate(self.fighters) if fighter.health > 0]
+        if len(alive) <= 1:
+            self.game_over = True
+            self.winner = alive[0] if alive else None
+
+    def move_fighters(self, inputs):
+        """ Run the state timers, apply input, gravity and velocity to every fighter that isn't idle """
+        active = []
+        swings = []
+        game_over = self.game_over
+        for index, (fighter, bits) in enumerate(zip(self.fighters, inputs)):
+            if game_over:
+                bits = 0  # Input is ignored once the match is decided
+            state = fighter.state
+            if state == IDLE and not bits:
+                fighter.prev_input = 0
+                continue
+            if state == DEAD:
+                # Hold still while the death animation plays, then freeze on the last frame
+                if not fighter.death_animation_done:
+                    fighter.state_ticks += 1
+                    if fighter.state_ticks >= DEATH_TICKS:
+                        fighter.death_animation_done = True
+                fighter.prev_input = bits
+                continue
+
+            fighter.state_ticks += 1
+            if state == ATTACK:
+                if fighter.state_ticks >= CHARACTERS[fighter.character].moves[fighter.move].duration:
+                    fighter.handle("finish")
+            elif state == HITSTUN:
+                if fighter.state_ticks >= fighter.hitstun:
+                    fighter.handle("finish")
+                    fighter.change_x = 0
+            self.apply_input(fighter, bits)
+            fighter.prev_input = bits
+            if fighter.state == ATTACK:
+                move = CHARACTERS[fighter.character].moves[fighter.move]
+                if not fighter.has_dealt_damage and move.windows[fighter.state_ticks] is not None:
+                    swings.append(index)
+                if fighter.state_ticks == move.release:
+                    self.projectiles.spawn(move.projectile, index, fighter.x + fighter.facing * FIGHTER_WIDTH / 2,
+                                           fighter.y + FIGHTER_HEIGHT * 2 / 3, fighter.facing)
+
+            fighter.change_y -= GRAVITY
+            fighter.x += fighter.change_x
+            fighter.y += fighter.change_y
+            active.append(index)
+        self.active = active
+        self.swings = swings
+
+    def land_fighters(self):
+        """ Stand fighters on the platforms they fell into and keep them inside the arena """
+        half_width = FIGHTER_WIDTH / 2
+        right_edge = self.width - half_width
+        platforms = self.platforms
+        fighters = self.fighters
+        for index in self.active:
+            fighter = fighters[index]
+            state = fighter.state
+            if state == DEAD:  # Knocked out by an attack this tick
+                continue
+            if fighter.change_x != 0 and (state == WALK or state == JUMP):
+                fighter.walk_time += FIXED_DT
+
+            # Handle platform collisions, landing on the highest platform touched
+            landed = self.platform_hash.query(fighter.x - half_width, fighter.y,
+                                              fighter.x + half_width, fighter.y + FIGHTER_HEIGHT)
+            if landed:
+                fighter.change_y = 0
+                fighter.y = max([platforms[index][3] for index in landed]) if len(landed) > 1 else platforms[landed[0]][3]
+                if state == JUMP:
+                    fighter.handle("land")
+                if fighter.state == IDLE and fighter.change_x != 0:
+                    fighter.handle("move")
+                elif fighter.state == WALK and fighter.change_x == 0:
+                    fighter.handle("stop")
+            elif state == IDLE or state == WALK:
+                fighter.handle("fall")
+
+            # Limit movement within the arena, and knock out anyone who fell through a gap
+            if fighter.x < half_width:
+                fighter.x = half_width
+            elif fighter.x > right_edge:
+                fighter.x = right_edge
+            if fighter.y < FALL_LIMIT:
+                fighter.health = 0
+                self.knock_out(fighter)
+
+    def apply_input(self, fighter, bits):
+        """ Turn one tick of input bits into velocity and state changes """
+        pressed = bits & ~fighter.prev_input
+
+        if fighter.state in STEERABLE:
+            direction = 0
+            if bits & INPUT_RIGHT:
+                direction += 1
+            if bits & INPUT_LEFT:
+                direction -= 1
+            fighter.change_x = direction * PLAYER_MOVE_SPEED
+            if direction:
+                fighter.facing = direction
+                if fighter.state == IDLE:
+                    fighter.handle("move")
+
+        if pressed & INPUT_JUMP and fighter.handle("jump"):
+            fighter.change_y = PLAYER_JUMP_SPEED
+        if pressed:
+            for bit, move in INPUT_MOVES:
+                if pressed & bit and fighter.handle("attack"):
+                    fighter.move = move
+                    fighter.has_dealt_damage = False
+                    break
+
+    def manage_attacks(self):
+        """ Check the swings that are in an active frame for hits """
+        swings = self.swings
+        if not swings:
+            return
+        fighters = self.fighters
+
+        # Re-bucketing every fighter only pays off when many swings need checking in a big match
+        use_broad_phase = len(fighters) >= BROAD_PHASE_MIN_FIGHTERS and len(swings) >= BROAD_PHASE_MIN_SWINGS
+        if use_broad_phase:
+            self.sync_fighter_hash()
+
+        # Find every hit first, so two fighters who swing into each other on the same tick both land theirs
+        hits = []
+        for index in swings:
+            attacker = fighters[index]
+            if use_broad_phase:
+                attack = attacker.hitboxes()
+                targets = sorted(self.fighter_hash.query(*attack[0]))
+            else:
+                near, far = attacker.x - REACH, attacker.x + REACH
+                targets = [i for i, target in enumerate(fighters) if near < target.x < far]
+                if len(targets) < 2:
+                    continue  # Nobody but the attacker in reach, don't bother placing its boxes
+                attack = attacker.hitboxes()
+            for target_index in targets:
+                target = fighters[target_index]
+                if target_index == index or target.state == DEAD:
+                    continue
+                # The box around each set first, then the boxes themselves
+                body = target.hurtboxes()
+                if overlaps(attack[0], body[0]) and any(overlaps(hit, hurt) for hit in attack[1:] for hurt in body[1:]):
+                    hits.append((index, target_index))
+
+        # A swing damages everyone it overlaps on the first tick it connects, then is spent
+        for attacker_index, target_index in hits:
+            fighters[attacker_index].has_dealt_damage = True
+            self.damage(attacker_index, target_index)
+
+    def sync_fighter_hash(self):
+        """ Move every fighter's hurtboxes in the broad phase to where they are now """
+        move = self.fighter_hash.move
+        for index, fighter in enumerate(self.fighters):
+            move(index, *fighter.hurtboxes()[0])
+
+    def fire_hazards(self, due):
+        """ Launch a projectile from every hazard emitter in due """
+        for kind, left, right, y, direction, period, phase in due:
+            x = left if left == right else self.rng.uniform(left, right)
+            self.projectiles.spawn(kind, -1, x, y, direction)
+
+    def update_projectiles(self):
+        """ Move every projectile, and break it on the first fighter or platform it touches """
+        pool = self.projectiles
+        count = pool.count
+        kinds = pool.kind
+        change_x = pool.change_x
+        change_y = pool.change_y
+        xs = pool.x
+        ys = pool.y
+        ticks = pool.ticks
+        if count >= BULK_MIN_PROJECTILES:
+            # Fly them all at once, with the same float operations one at a time would do
+            change_y[:count] = array("d", map(sub, change_y[:count], map(KIND_GRAVITY.__getitem__, kinds[:count])))
+            xs[:count] = array("d", map(add, xs[:count], change_x[:count]))
+            ys[:count] = array("d", map(add, ys[:count], change_y[:count]))
+            ticks[:count] = array("i", map(sub, ticks[:count], repeat(1, count)))
+        else:
+            for index in range(count):
+                change_y[index] -= KIND_GRAVITY[kinds[index]]
+                xs[index] += change_x[index]
+                ys[index] += change_y[index]
+                ticks[index] -= 1
+
+        # Each fighter only box-tests the projectiles within reach of it, the first fighter hit takes it
+        owners = pool.owner
+        struck = {}  # Projectile slot -> fighter it hit
+        for target_index, target in enumerate(self.fighters):
+            if target.state == DEAD:
+                continue
+            near, far = target.x - PROJECTILE_REACH, target.x + PROJECTILE_REACH
+            body = None
+            for index in [index for index, x in enumerate(xs[:count]) if near < x < far]:
+                if index in struck or owners[index] == target_index or ticks[index] <= 0:
+                    continue
+                half_width, half_height = KIND_HALF_SIZES[kinds[index]]
+                x = xs[index]
+                y = ys[index]
+                box = (x - half_width, y - half_height, x + half_width, y + half_height)
+                if body is None:
+                    body = target.hurtboxes()
+                if overlaps(box, body[0]) and any(overlaps(box, hurt) for hurt in body[1:]):
+                    struck[index] = target_index
+
+        width = self.width
+        cells = self.platform_hash.cells
+        cell_size = self.platform_hash.cell_size
+        platforms = self.platform_hash.boxes
+        query = self.platform_hash.query
+        # Walk down from the end so a despawn only ever moves an already handled projectile into the gap
+        for index in range(count - 1, -1, -1):
+            x = xs[index]
+            y = ys[index]
+            if ticks[index] <= 0 or not 0 <= x <= width or y < FALL_LIMIT:
+                pool.despawn(index)
+                continue
+            target_index = struck.get(index)
+            if target_index is not None:
+                stats = KINDS[kinds[index]]
+                direction = change_x[index] or self.fighters[target_index].x - x
+                self.hurt(owners[index], target_index, stats.damage, stats.hitstun,
+                          stats.knockback if direction > 0 else -stats.knockback)
+                pool.despawn(index)
+                continue
+
+            # Projectiles are smaller than a grid cell, so most sit inside one and only need its bucket checked
+            half_width, half_height = KIND_HALF_SIZES[kinds[index]]
+            left = x - half_width
+            bottom = y - half_height
+            right = x + half_width
+            top = y + half_height
+            column = left // cell_size
+            row = bottom // cell_size
+            if column == right // cell_size and row == top // cell_size:
+                for item in cells.get((int(column), int(row)), ()):
+                    other_left, other_bottom, other_right, other_top = platforms[item]
+                    if left < other_right and other_left < right and bottom < other_top and other_bottom < top:
+                        pool.despawn(index)
+                        break
+            elif query(left, bottom, right, top):
+                pool.despawn(index)
+
+    def damage(self, attacker_index, target_index):
+        attacker = self.fighters[attacker_index]
+        move = CHARACTERS[attacker.character].moves[attacker.move]
+        self.hurt(attacker_index, target_index, move.damage, move.hitstun, move.knockback * attacker.facing)
+
+    def hurt(self, attacker_index, target_index, damage, hitstun, knockback):
+        """ Take health off a target and knock it back, the attacker is -1 for hazards """
+        target = self.fighters[target_index]
+        target.health = max(0, target.health - damage)
+        self.hits.append((attacker_index, target_index))
+
+        # If the target's health is 0, trigger the death animation, otherwise knock it back
+        if target.health == 0:
+            self.knock_out(target)
+        elif target.handle("hit"):
+            target.hitstun = hitstun
+            target.change_x = knockback
+
+    def knock_out(self, fighter):
+        if fighter.handle("die"):
+            fighter.change_x = 0
+            fighter.change_y = 0
+
+
+def run_match(seed=0, max_ticks=60 * 120, num_players=2):
+    """ Play one match with random inputs and return it, used for headless runs """
+    match = Match(seed, num_players)
+    rng = random.Random(seed + 1)
+    inputs = [0] * len(match.fighters)
+    while not match.frozen and match.tick < max_ticks:
+        # Hold each random input for a handful of ticks like a person would
+        if match.tick % 6 == 0:
+            inputs = [rng.randrange(32) for _ in match.fighters]
+        match.step(inputs)
+    return match
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    players = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    start = time.perf_counter()
+    count = 200
+    ticks = 0
+    for i in range(count):
+        ticks += run_match(i, num_players=players).tick
+    elapsed = time.perf_counter() - start
+    print(f"{count} {players} player matches, {ticks} ticks in {elapsed:.2f}s "
+          f"({count / elapsed:.0f} matches/s, {ticks / elapsed:.0f} ticks/s)")
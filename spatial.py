@@ -0,0 +1,97 @@
+"""
+Uniform-grid spatial hash for axis-aligned boxes.
+
+Boxes are bucketed into square cells. Moving a box only touches the grid when
+it crosses into a different set of cells, and a query only looks at the
+buckets its own box covers, so collision checks scale with how crowded an
+area is rather than with how many things exist in the match.
+"""
+
+DEFAULT_CELL_SIZE = 128
+BRUTE_FORCE_LIMIT = 8  # Below this many items a straight scan beats walking the grid
+
+
+class SpatialHash:
+    """ Maps item ids to boxes (left, bottom, right, top) and finds the ones near a box """
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}  # (cell x, cell y) -> set of item ids
+        self.boxes = {}  # item id -> (left, bottom, right, top)
+        self.ranges = {}  # item id -> (first cell x, first cell y, last cell x, last cell y)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __contains__(self, item):
+        return item in self.boxes
+
+    def cell_range(self, left, bottom, right, top):
+        size = self.cell_size
+        return int(left // size), int(bottom // size), int(right // size), int(top // size)
+
+    def insert(self, item, left, bottom, right, top):
+        cells = self.cell_range(left, bottom, right, top)
+        self.boxes[item] = (left, bottom, right, top)
+        self.ranges[item] = cells
+        self._add_to_cells(item, cells)
+
+    def move(self, item, left, bottom, right, top):
+        """ Update an item's box, re-bucketing only if it now covers different cells """
+        self.boxes[item] = (left, bottom, right, top)
+        size = self.cell_size
+        cells = (int(left // size), int(bottom // size), int(right // size), int(top // size))
+        old_cells = self.ranges[item]
+        if cells != old_cells:
+            self._remove_from_cells(item, old_cells)
+            self._add_to_cells(item, cells)
+            self.ranges[item] = cells
+
+    def remove(self, item):
+        self._remove_from_cells(item, self.ranges.pop(item))
+        del self.boxes[item]
+
+    def clear(self):
+        self.cells.clear()
+        self.boxes.clear()
+        self.ranges.clear()
+
+    def candidates(self, left, bottom, right, top):
+        """ Ids of every item sharing a cell with the box, a superset of the ones that overlap it """
+        x0, y0, x1, y1 = self.cell_range(left, bottom, right, top)
+        cells = self.cells
+        if x0 == x1 and y0 == y1:
+            return cells.get((x0, y0), ())
+        found = set()
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    found.update(bucket)
+        return found
+
+    def query(self, left, bottom, right, top):
+        """ Ids of the items whose boxes overlap the given box """
+        boxes = self.boxes
+        hits = []
+        items = boxes if len(boxes) <= BRUTE_FORCE_LIMIT else self.candidates(left, bottom, right, top)
+        for item in items:
+            other_left, other_bottom, other_right, other_top = boxes[item]
+            if left < other_right and other_left < right and bottom < other_top and other_bottom < top:
+                hits.append(item)
+        return hits
+
+    def _add_to_cells(self, item, cells):
+        x0, y0, x1, y1 = cells
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                self.cells.setdefault((cx, cy), set()).add(item)
+
+    def _remove_from_cells(self, item, cells):
+        x0, y0, x1, y1 = cells
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = self.cells[(cx, cy)]
+                bucket.discard(item)
+                if not bucket:
+                    del self.cells[(cx, cy)]
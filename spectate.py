@@ -0,0 +1,693 @@
+"""
+Spectator feed: one machine plays, any number of read-only clients watch.
+
+The host sends its match to a relay process on the same machine once per
+tick, as a zlib-compressed delta between consecutive snapshots (snapshot.py)
+and a full keyframe every second, one UDP datagram each. The host does the
+same work per tick however many people are watching. The relay fans the feed
+out to every spectator over TCP on an asyncio loop. A spectator whose socket
+backs up stops being sent deltas and is caught up from the latest keyframe
+once it drains, and one that stays backed up for DROP_AFTER seconds is
+disconnected, so a slow viewer never holds up the others.
+
+Spectators rebuild the match from the feed and show it a fixed delay behind
+the newest tick they have, interpolating fighters between ticks, so network
+jitter doesn't show as stutter.
+
+    python main.py --broadcast                        host a match and start a relay on RELAY_PORT
+    python main.py --spectate HOST:7200 --delay 0.2   watch it
+    python spectate.py relay --port 7200              run a relay on its own
+    python spectate.py load --spectators 1 50 200     check the host's tick time stays flat as viewers join
+"""
+import argparse
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+
+from levels import load_level
+from netplay import random_bot
+from profiler import percentiles
+from simulation import FIXED_DT, Match
+from snapshot import FIGHTER, Snapshotter
+
+RELAY_PORT = 7200  # TCP for spectators, and UDP on the same number for the host's feed
+KEYFRAME_INTERVAL = 60  # Ticks between full snapshots, how long a new or resynced spectator may wait
+DEFAULT_DELAY = 0.2  # Seconds spectators stay behind the newest tick they have
+CATCH_UP = 0.02  # Playback speed change per tick of drift from the delay, spread over many frames
+MAX_SPEED_CHANGE = 0.1  # Playback never runs more than this much faster or slower than real time
+HIGH_WATER = 32 * 1024  # Bytes queued for a spectator before the relay stops sending it deltas
+SEND_BUFFER = 32 * 1024  # Kernel send buffer per spectator, kept small so backpressure shows up quickly
+DROP_AFTER = 2.0  # Seconds a spectator may stay backed up before it is disconnected
+METRICS_INTERVAL = 5.0
+REPORT_INTERVAL = 0.5  # Seconds between metrics a relay in a load test puts on its queue
+SLOW_DROP_TIMEOUT = 60.0  # Seconds a load test keeps the feed going after measuring, for slow spectators to be dropped
+WALL_SLACK_MS = 2.0  # Timer and scheduler noise allowed on top of the wall clock tolerance, p99 swings by that much
+HOST_TICK_BUDGET_MS = FIXED_DT * 1000 / 2  # Wall p99 of the host tick with any audience, half its frame
+COMPRESSION = 1  # zlib level, deltas are small and mostly zeros so the fastest level is nearly as small
+RELAY_NICENESS = 5  # How much lower the relay process runs than the game, so a busy core serves the game first
+AUDIENCE_NICENESS = 10  # The load test's spectators stand in for other machines, they shouldn't slow the host
+
+# Messages, the same on the UDP feed and the TCP stream: MESSAGE then length bytes of body
+START = 1  # body: START_BODY then the level file name, empty for the arena
+KEYFRAME = 2  # body: TICK then a compressed snapshot
+DELTA = 3  # body: TICK then a compressed diff from the previous tick's snapshot
+
+MESSAGE = struct.Struct("<BI")  # type, body length
+START_BODY = struct.Struct("<B")  # players
+TICK = struct.Struct("<I")
+POSITION = struct.Struct("<dd")  # The x and y that start every FIGHTER record
+
+
+def encode(kind, body):
+    return MESSAGE.pack(kind, len(body)) + body
+
+
+def split_messages(buffer):
+    """ Remove and return the whole messages at the front of a stream buffer """
+    messages = []
+    offset = 0
+    while len(buffer) - offset >= MESSAGE.size:
+        kind, length = MESSAGE.unpack_from(buffer, offset)
+        end = offset + MESSAGE.size + length
+        if len(buffer) < end:
+            break
+        messages.append(bytes(buffer[offset:end]))
+        offset = end
+    del buffer[:offset]
+    return messages
+
+
+class SpectatorFeed:
+    """ Publishes the host's match to a relay: a compressed delta every tick and a keyframe every second """
+
+    def __init__(self, relay=("127.0.0.1", RELAY_PORT), keyframe_interval=KEYFRAME_INTERVAL):
+        self.relay = relay
+        self.keyframe_interval = keyframe_interval
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)  # A full socket drops a message rather than stall the game
+        self.snapshotter = None
+        self.previous = None
+        self.current = None
+        self.last_tick = None  # Tick in previous, None until a keyframe has gone out
+        self.sent = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+
+    def start(self, match, level_name=None):
+        """ Announce a new match, spectators rebuild it from the level and player count """
+        self.snapshotter = Snapshotter(match)
+        self.previous = self.snapshotter.new_buffer()
+        self.current = self.snapshotter.new_buffer()
+        self.last_tick = None
+        self.send(START, START_BODY.pack(len(match.fighters)) + (level_name or "").encode())
+
+    def publish(self):
+        """ Send whatever the match's last tick changed, call after every step """
+        match = self.snapshotter.match
+        if match.tick == self.last_tick:
+            return  # Frozen or waiting on a peer, nothing new to show
+        current = self.snapshotter.save(self.current)
+        if self.last_tick is None or match.tick != self.last_tick + 1 or match.tick % self.keyframe_interval == 0:
+            sent = self.send(KEYFRAME, TICK.pack(match.tick) + zlib.compress(current, COMPRESSION))
+        else:
+            delta = self.snapshotter.diff(self.previous, current)
+            sent = self.send(DELTA, TICK.pack(match.tick) + zlib.compress(delta, COMPRESSION))
+        # After a drop the relay can't apply the next delta, so the next tick goes out as a keyframe
+        self.last_tick = match.tick if sent else None
+        self.previous, self.current = current, self.previous
+
+    def send(self, kind, body):
+        message = encode(kind, body)
+        try:
+            self.socket.sendto(message, self.relay)
+        except OSError:  # Full buffer, or no relay listening yet
+            self.dropped += 1
+            return False
+        self.sent += 1
+        self.bytes_sent += len(message)
+        return True
+
+    def close(self):
+        self.socket.close()
+
+
+class Relay:
+    """ The latest keyframe and the deltas since, and every spectator they are sent to """
+
+    def __init__(self, drop_after=DROP_AFTER):
+        self.drop_after = drop_after
+        self.start = None  # START message of the current match
+        self.keyframe = None
+        self.since_keyframe = []  # DELTA messages after it, a joining spectator gets all of them
+        self.tick = None
+        self.spectators = set()
+
+        # Metrics
+        self.peak_spectators = 0
+        self.messages_in = 0
+        self.gaps = 0  # Deltas thrown away because one before them went missing
+        self.resyncs = 0
+        self.dropped = 0
+        self.bytes_out = 0
+
+    def feed(self, message):
+        """ A message from the host: remember what a joining spectator needs, then send it to everyone """
+        self.messages_in += 1
+        kind = message[0]
+        if kind == START:
+            self.start = message
+            self.keyframe = None
+            self.since_keyframe = []
+            self.tick = None
+        elif kind in (KEYFRAME, DELTA):
+            tick, = TICK.unpack_from(message, MESSAGE.size)
+            if kind == KEYFRAME:
+                self.keyframe = message
+                self.since_keyframe = []
+            elif self.keyframe is None or tick != self.tick + 1:
+                self.gaps += 1  # A datagram was lost, wait for the next keyframe
+                return
+            else:
+                self.since_keyframe.append(message)
+            self.tick = tick
+        else:
+            return
+        now = time.monotonic()
+        for spectator in list(self.spectators):
+            spectator.send(message, now)
+
+    def metrics(self):
+        return {"spectators": len(self.spectators), "peak_spectators": self.peak_spectators,
+                "messages_in": self.messages_in, "gaps": self.gaps, "resyncs": self.resyncs,
+                "dropped": self.dropped, "bytes_out": self.bytes_out}
+
+
+class FeedProtocol(asyncio.DatagramProtocol):
+    """ Receives the host's feed """
+
+    def __init__(self, relay):
+        self.relay = relay
+
+    def datagram_received(self, data, addr):
+        if len(data) >= MESSAGE.size:
+            self.relay.feed(data)
+
+
+class SpectatorConnection(asyncio.Protocol):
+    """ One spectator on the relay, only ever written to """
+
+    def __init__(self, relay):
+        self.relay = relay
+        self.transport = None
+        self.synced = False  # Has every message since the current keyframe
+        self.missed = False  # Skipped messages while backed up
+        self.start = None  # START message it was last sent
+        self.backed_up_since = None  # When the transport asked us to stop writing
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport.set_write_buffer_limits(high=HIGH_WATER)
+        relay = self.relay
+        relay.spectators.add(self)
+        relay.peak_spectators = max(relay.peak_spectators, len(relay.spectators))
+        self.sync()
+
+    def connection_lost(self, exc):
+        self.relay.spectators.discard(self)
+
+    def data_received(self, data):
+        pass  # Spectators have nothing to say
+
+    def pause_writing(self):
+        self.backed_up_since = time.monotonic()
+
+    def resume_writing(self):
+        self.backed_up_since = None
+
+    def send(self, message, now):
+        if self.backed_up_since is not None:
+            if now - self.backed_up_since > self.relay.drop_after:
+                self.relay.dropped += 1
+                self.relay.spectators.discard(self)
+                self.transport.abort()
+            self.synced = False  # It misses this one, so it needs the keyframe again once it drains
+            self.missed = True
+            return
+        if not self.synced:
+            if self.missed:
+                self.relay.resyncs += 1
+                self.missed = False
+            self.sync()  # The relay already holds this message, sync() sends it along with the rest
+            return
+        self.transport.write(message)
+        self.relay.bytes_out += len(message)
+
+    def sync(self):
+        """ Send the current match from its latest keyframe """
+        relay = self.relay
+        messages = []
+        if relay.start is not None and relay.start is not self.start:
+            messages.append(relay.start)
+            self.start = relay.start
+        if relay.keyframe is not None:
+            messages.append(relay.keyframe)
+            messages += relay.since_keyframe
+        self.transport.writelines(messages)
+        relay.bytes_out += sum(map(len, messages))
+        self.synced = relay.keyframe is not None
+
+
+async def run_relay(host, port, reports=None, stop=None):
+    """ Serve spectators on TCP port and take the feed on UDP port (localhost only) until stopped """
+    loop = asyncio.get_running_loop()
+    relay = Relay()
+    feed, _ = await loop.create_datagram_endpoint(lambda: FeedProtocol(relay), local_addr=("127.0.0.1", port))
+    server = await loop.create_server(lambda: SpectatorConnection(relay), host, port)
+    try:
+        last_report = time.perf_counter()
+        while stop is None or not stop.is_set():
+            await asyncio.sleep(0.1)
+            if time.perf_counter() - last_report > (METRICS_INTERVAL if reports is None else REPORT_INTERVAL):
+                last_report = time.perf_counter()
+                if reports is None:
+                    print(format_metrics(relay.metrics()), flush=True)
+                else:
+                    reports.put(relay.metrics())
+    finally:
+        if reports is not None:
+            reports.put(relay.metrics())
+        server.close()
+        feed.close()
+
+
+def format_metrics(metrics):
+    return (f"{metrics['spectators']} spectators (peak {metrics['peak_spectators']}), "
+            f"{metrics['messages_in']} messages in, {metrics['bytes_out'] / 1e6:.1f} MB out, "
+            f"{metrics['resyncs']} resyncs, {metrics['dropped']} dropped, {metrics['gaps']} gaps")
+
+
+def lower_priority(niceness):
+    """
+    Let the game's process have the core first, where the OS supports it (not
+    on Windows). On Linux the process only runs when nothing else wants to, so
+    fanning a tick out to hundreds of sockets never lands in the middle of the
+    host's next tick; elsewhere it is just niced
+    """
+    if hasattr(os, "nice"):
+        os.nice(niceness)
+    if hasattr(os, "SCHED_IDLE"):
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+
+
+def relay_process(host, port, reports=None, stop=None):
+    lower_priority(RELAY_NICENESS)
+    try:
+        asyncio.run(run_relay(host, port, reports, stop))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_relay(port=RELAY_PORT, host="0.0.0.0"):
+    """ Run a relay in its own process so fanning out never takes time from the game """
+    process = multiprocessing.Process(target=relay_process, args=(host, port), daemon=True, name="relay")
+    process.start()
+    return process
+
+
+class Playback:
+    """ Rebuilds the host's match from feed messages and shows it delay seconds behind, interpolated """
+
+    def __init__(self, delay=DEFAULT_DELAY):
+        self.delay_ticks = delay / FIXED_DT
+        self.match = None
+        self.snapshotter = None
+        self.level = None
+        self.level_name = None
+        self.matches = 0  # START messages seen
+        self.frames = deque()  # (tick, snapshot) from oldest to newest
+        self.free = []  # Snapshot buffers to reuse
+        self.position = None  # Tick being shown, fractional between two snapshots
+        self.healths = []  # As last shown, a drop is shown as a hit
+        self.layout_changed = False  # A new match started, the view has to pick up match and level again
+
+    def receive(self, message):
+        kind, length = MESSAGE.unpack_from(message)
+        body = memoryview(message)[MESSAGE.size:MESSAGE.size + length]
+        if kind == START:
+            self.start(body[0], bytes(body[START_BODY.size:]).decode())
+            return
+        if self.snapshotter is None:
+            return
+        tick, = TICK.unpack_from(body)
+        frames = self.frames
+        if frames and tick <= frames[-1][0]:
+            return
+        data = zlib.decompress(body[TICK.size:])
+        buffer = self.free.pop() if self.free else self.snapshotter.new_buffer()
+        if kind == KEYFRAME:
+            buffer[:] = data
+        elif kind == DELTA and frames and frames[-1][0] == tick - 1:
+            buffer[:] = frames[-1][1]
+            self.snapshotter.patch(buffer, data)
+        else:
+            self.free.append(buffer)  # Missed the tick before, wait for the next keyframe
+            return
+        frames.append((tick, buffer))
+        # Keep only what the delay needs, in case nothing is being shown
+        while len(frames) > self.delay_ticks + 2 * KEYFRAME_INTERVAL:
+            self.free.append(frames.popleft()[1])
+
+    def start(self, num_players, level_name):
+        if level_name != self.level_name or self.match is None:
+            self.level = load_level(level_name) if level_name else None
+            self.level_name = level_name
+        self.match = self.level.new_match(0, num_players) if self.level else Match(0, num_players)
+        self.snapshotter = Snapshotter(self.match)
+        self.frames.clear()
+        self.free = []
+        self.position = None
+        self.healths = [fighter.health for fighter in self.match.fighters]
+        self.matches += 1
+        self.layout_changed = True
+
+    def latest(self):
+        """ (tick, snapshot) of the newest tick received, or None """
+        return self.frames[-1] if self.frames else None
+
+    def advance(self, delta_time):
+        """ Move playback on by delta_time and load what should be showing into match. False until there is any """
+        frames = self.frames
+        if not frames:
+            return False
+        oldest = frames[0][0]
+        newest = frames[-1][0]
+        target = newest - self.delay_ticks
+        if self.position is None or abs(target - self.position) > self.delay_ticks + KEYFRAME_INTERVAL:
+            self.position = target  # Just joined, or so far off that catching up would take too long
+        else:
+            # Drift back towards the delay by playing slightly fast or slow instead of jumping
+            speed = 1 + max(-MAX_SPEED_CHANGE, min(MAX_SPEED_CHANGE, (target - self.position) * CATCH_UP))
+            self.position += delta_time / FIXED_DT * speed
+        self.position = max(oldest, min(newest, self.position))
+
+        while len(frames) > 1 and frames[1][0] <= self.position:
+            self.free.append(frames.popleft()[1])
+        tick, buffer = frames[0]
+        self.snapshotter.load(buffer)
+        if len(frames) > 1:
+            next_tick, next_buffer = frames[1]
+            alpha = (self.position - tick) / (next_tick - tick)
+            offset = self.snapshotter.fighters_offset
+            for fighter in self.match.fighters:
+                x, y = POSITION.unpack_from(next_buffer, offset)
+                fighter.x += (x - fighter.x) * alpha
+                fighter.y += (y - fighter.y) * alpha
+                offset += FIGHTER.size
+
+        # The match is never stepped here, so hits are worked out from health going down
+        hits = []
+        for index, fighter in enumerate(self.match.fighters):
+            if fighter.health < self.healths[index]:
+                hits.append((-1, index))
+            self.healths[index] = fighter.health
+        self.match.hits = hits
+        return True
+
+
+class SpectatorClient(asyncio.Protocol):
+    """ Splits the relay's stream into messages and hands each to a callback """
+
+    def __init__(self, on_message, on_lost=None):
+        self.on_message = on_message
+        self.on_lost = on_lost
+        self.buffer = bytearray()
+        self.transport = None
+        self.bytes_received = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.bytes_received += len(data)
+        self.buffer += data
+        for message in split_messages(self.buffer):
+            self.on_message(message)
+
+    def connection_lost(self, exc):
+        if self.on_lost is not None:
+            self.on_lost()
+
+
+class Watcher:
+    """ Spectator mode for the game: receives the feed on its own thread, the game thread plays it back """
+
+    def __init__(self, address, delay=DEFAULT_DELAY):
+        self.playback = Playback(delay)
+        self.inbox = queue.SimpleQueue()
+        self.connected = threading.Event()
+        self.lost = False
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, args=(address,), daemon=True, name="spectate")
+        self.thread.start()
+
+    def run(self, address):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.loop.create_connection(
+                lambda: SpectatorClient(self.inbox.put, self.on_lost), *address))
+        except OSError:
+            self.lost = True
+            self.connected.set()
+            return
+        self.connected.set()
+        self.loop.run_forever()
+
+    def on_lost(self):
+        self.lost = True
+
+    def wait_for_start(self, timeout=5.0):
+        """ Block until the first match is announced, True if it was """
+        self.connected.wait(timeout)
+        deadline = time.monotonic() + timeout
+        while self.playback.match is None and not self.lost and time.monotonic() < deadline:
+            try:
+                self.playback.receive(self.inbox.get(timeout=0.05))
+            except queue.Empty:
+                pass
+        return self.playback.match is not None
+
+    def update(self, delta_time):
+        """ Take in what arrived and advance playback, returns whether there is anything to show """
+        while True:
+            try:
+                self.playback.receive(self.inbox.get_nowait())
+            except queue.Empty:
+                break
+        return self.playback.advance(delta_time)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+async def run_audience(host, port, spectators, slow, finish, results):
+    """
+    Spectators for the load test: all but one only count bytes, one decodes
+    every message with a Playback, and slow ones connect but never read
+    """
+    loop = asyncio.get_running_loop()
+    playback = Playback(0)
+    decoder = SpectatorClient(playback.receive)
+    readers = []
+    stalled = []
+
+    await loop.create_connection(lambda: decoder, host, port)
+    for _ in range(spectators - 1):
+        _, reader = await loop.create_connection(lambda: SpectatorClient(lambda message: None), host, port)
+        readers.append(reader)
+    for _ in range(slow):
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect((host, port))
+        transport, reader = await loop.create_connection(lambda: SpectatorClient(lambda message: None), sock=sock)
+        transport.pause_reading()
+        stalled.append(transport)
+    results.put("connected")
+
+    while not finish.is_set():
+        await asyncio.sleep(0.05)
+    latest = playback.latest()
+    results.put({
+        "matches": playback.matches,
+        "tick": latest[0] if latest else None,
+        "digest": hashlib.blake2b(latest[1], digest_size=8).digest() if latest else None,
+        "bytes": decoder.bytes_received + sum(reader.bytes_received for reader in readers),
+    })
+    for transport in stalled:
+        transport.abort()
+
+
+def audience_process(host, port, spectators, slow, finish, results):
+    lower_priority(AUDIENCE_NICENESS)
+    asyncio.run(run_audience(host, port, spectators, slow, finish, results))
+
+
+def load_test(spectators, slow, seconds, level_name, port):
+    """
+    Host a bot match with a relay and an audience for seconds, and measure the
+    host's tick (step and publish) with wall and CPU clocks. Wall time also
+    counts whatever else ran on the core meanwhile, the relay included when it
+    shares the core. Slow spectators are only dropped once their buffers have
+    filled and DROP_AFTER has passed, so afterwards the feed keeps going,
+    unmeasured, until the relay has dropped them all or SLOW_DROP_TIMEOUT runs
+    out. Returns a report dict
+    """
+    stop = multiprocessing.Event()
+    finish = multiprocessing.Event()
+    reports = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    relay = multiprocessing.Process(target=relay_process, args=("127.0.0.1", port, reports, stop), daemon=True)
+    relay.start()
+    time.sleep(0.5)
+    audience = multiprocessing.Process(target=audience_process, daemon=True,
+                                       args=("127.0.0.1", port, spectators, slow, finish, results))
+    audience.start()
+    results.get(timeout=30)  # Everyone is connected
+
+    level = load_level(level_name) if level_name else None
+    feed = SpectatorFeed(("127.0.0.1", port))
+    digests = {}  # (match number, tick) -> digest of the snapshot that was sent
+    matches = 0
+    wall_times = []
+    cpu_times = []
+    match = None
+    bots = None
+    relay_metrics = {"dropped": 0}
+    started = next_tick = time.perf_counter()
+    measure_until = started + seconds
+    give_up = measure_until + SLOW_DROP_TIMEOUT
+    while True:
+        now = time.perf_counter()
+        if now >= measure_until:
+            while True:
+                try:
+                    relay_metrics = reports.get_nowait()
+                except queue.Empty:
+                    break
+            if relay_metrics["dropped"] >= slow or now >= give_up:
+                break
+        if match is None or match.frozen:
+            match = level.new_match(matches, 2) if level else Match(matches, 2)
+            bots = [random_bot(matches * 10 + player) for player in range(2)]
+            feed.start(match, level.path if level else None)
+            matches += 1
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        match.step([next(bot) for bot in bots])
+        feed.publish()
+        if start_wall < measure_until:
+            cpu_times.append(time.thread_time() - start_cpu)
+            wall_times.append(time.perf_counter() - start_wall)
+        if feed.last_tick == match.tick:
+            digests[matches, match.tick] = hashlib.blake2b(feed.previous, digest_size=8).digest()
+        next_tick += FIXED_DT
+        time.sleep(max(0.0, next_tick - time.perf_counter()))
+
+    hosted = time.perf_counter() - started
+    finish.set()
+    heard = results.get(timeout=30)
+    stop.set()
+    audience.join(5)
+    relay.join(5)
+    while True:
+        try:
+            relay_metrics = reports.get(timeout=1)
+        except queue.Empty:
+            break
+    feed.close()
+    wall_p50, wall_p99 = percentiles(wall_times, (50, 99))
+    cpu_p50, cpu_p99 = percentiles(cpu_times, (50, 99))
+    return {
+        "spectators": spectators,
+        "wall_p50_ms": wall_p50 * 1000, "wall_p99_ms": wall_p99 * 1000,
+        "cpu_p50_ms": cpu_p50 * 1000, "cpu_p99_ms": cpu_p99 * 1000,
+        "feed_kb_per_s": feed.bytes_sent / hosted / 1024,
+        "feed_dropped": feed.dropped,
+        "relay": relay_metrics,
+        "received_mb": heard["bytes"] / 1e6,
+        "in_sync": heard["tick"] is not None and digests.get((heard["matches"], heard["tick"])) == heard["digest"],
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Spectator relay and its load test")
+    commands = parser.add_subparsers(dest="command", required=True)
+    relay = commands.add_parser("relay", help="fan a host's feed out to spectators")
+    relay.add_argument("--host", default="0.0.0.0", help="interface spectators connect on")
+    relay.add_argument("--port", type=int, default=RELAY_PORT)
+    load = commands.add_parser("load", help="measure the host's tick time with growing audiences")
+    load.add_argument("--spectators", type=int, nargs="+", default=[1, 50, 200])
+    load.add_argument("--slow", type=int, default=5, help="extra spectators that never read, they should be dropped")
+    load.add_argument("--seconds", type=float, default=15)
+    load.add_argument("--level", default="levels/island.txt", help="level file, empty for the arena")
+    load.add_argument("--port", type=int, default=RELAY_PORT)
+    load.add_argument("--tolerance", type=float, default=0.25,
+                      help="how much more host CPU per tick the biggest audience may cost than the smallest")
+    load.add_argument("--wall-tolerance", type=float, default=0.5,
+                      help="how much longer the host's p99 wall clock tick may get with the biggest audience")
+    args = parser.parse_args(argv)
+
+    if args.command == "relay":
+        print(f"Relaying on port {args.port}", flush=True)
+        relay_process(args.host, args.port)
+        return 0
+
+    reports = []
+    for spectators in args.spectators:
+        report = load_test(spectators, args.slow, args.seconds, args.level, args.port)
+        reports.append(report)
+        relay_metrics = report["relay"]
+        print(f"{spectators} spectators: host tick p50/p99 {report['wall_p50_ms']:.2f}/{report['wall_p99_ms']:.2f} ms "
+              f"(cpu {report['cpu_p50_ms']:.2f}/{report['cpu_p99_ms']:.2f} ms), "
+              f"feed {report['feed_kb_per_s']:.1f} KB/s, {report['received_mb']:.1f} MB delivered, "
+              f"{relay_metrics['dropped']}/{args.slow} slow dropped, {relay_metrics['resyncs']} resyncs, "
+              f"{'in sync' if report['in_sync'] else 'OUT OF SYNC'}", flush=True)
+
+    failures = []
+    smallest = min(reports, key=lambda report: report["spectators"])
+    largest = max(reports, key=lambda report: report["spectators"])
+    # Half a tenth of a millisecond of slack keeps timer noise on tiny ticks from failing the run
+    if largest["cpu_p50_ms"] > smallest["cpu_p50_ms"] * (1 + args.tolerance) + 0.05:
+        failures.append(f"host tick cost {largest['cpu_p50_ms']:.2f} ms with {largest['spectators']} spectators, "
+                        f"{smallest['cpu_p50_ms']:.2f} ms with {smallest['spectators']}")
+    if largest["wall_p99_ms"] > smallest["wall_p99_ms"] * (1 + args.wall_tolerance) + WALL_SLACK_MS:
+        failures.append(f"host tick p99 took {largest['wall_p99_ms']:.2f} ms with {largest['spectators']} spectators, "
+                        f"{smallest['wall_p99_ms']:.2f} ms with {smallest['spectators']}")
+    for report in reports:
+        if report["wall_p99_ms"] > HOST_TICK_BUDGET_MS:
+            failures.append(f"host tick p99 of {report['wall_p99_ms']:.2f} ms with {report['spectators']} watching is "
+                            f"over its {HOST_TICK_BUDGET_MS:.1f} ms budget")
+        if not report["in_sync"]:
+            failures.append(f"the decoding spectator fell out of sync with {report['spectators']} watching")
+        if report["relay"]["dropped"] < args.slow:
+            failures.append(f"only {report['relay']['dropped']} of {args.slow} slow spectators were dropped "
+                            f"with {report['spectators']} watching")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
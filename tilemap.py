@@ -0,0 +1,107 @@
+"""
+Drawing tile-map levels: chunked static tiles and a camera that follows the fighters.
+
+Tiles never move, so each chunk of a level gets its own static SpriteList and
+is uploaded to the GPU once. Each frame only the chunks overlapping the
+camera's view are drawn, so a level ten screens wide costs about the same to
+draw as one screen of it. Collision doesn't need chunking here: the
+simulation already finds platforms through its spatial hash, so only
+platforms near a fighter are ever tested.
+"""
+import arcade
+
+import assets
+from hud import texture_sprite
+from levels import CHUNK_TILES
+
+CAMERA_MARGIN = 150  # World units kept clear around the outermost fighters
+CAMERA_MAX_ZOOM = 2.0  # Furthest the camera zooms out to keep everyone in view
+CAMERA_SMOOTHING = 0.1  # Fraction of the way to the target the camera moves each simulation tick
+
+
+class ChunkLayer:
+    """ A level's tiles in one static SpriteList per chunk """
+
+    def __init__(self, level):
+        self.chunk_size = CHUNK_TILES * level.tile_size
+        self.chunks = {}  # (chunk x, chunk y) -> SpriteList
+        self.drawn = 0  # Chunks drawn last frame
+        size = level.tile_size
+        textures = {char: assets.get_tile(level.tileset, column, row, level.tileset_tile_size)
+                    for char, (column, row) in level.tile_kinds.items()}
+        for key, tiles in level.chunks().items():
+            sprite_list = arcade.SpriteList(is_static=True, capacity=len(tiles))
+            for column, row, char in tiles:
+                sprite_list.append(texture_sprite(textures[char], (column + 0.5) * size, (row + 0.5) * size,
+                                                  size, size))
+            self.chunks[key] = sprite_list
+
+    def visible(self, left, right, bottom, top):
+        """ Keys of the chunks that overlap the given world rectangle """
+        size = self.chunk_size
+        chunks = self.chunks
+        for cx in range(int(left // size), int(right // size) + 1):
+            for cy in range(int(bottom // size), int(top // size) + 1):
+                if (cx, cy) in chunks:
+                    yield cx, cy
+
+    def draw(self, view):
+        self.drawn = 0
+        for key in self.visible(*view):
+            self.chunks[key].draw()
+            self.drawn += 1
+
+
+class FollowCamera:
+    """ Keeps every point it is given on screen, panning smoothly and zooming out when they spread apart """
+
+    def __init__(self, screen_width, screen_height, world_width, world_height,
+                 margin=CAMERA_MARGIN, max_zoom=CAMERA_MAX_ZOOM, smoothing=CAMERA_SMOOTHING):
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.world_width = world_width
+        self.world_height = world_height
+        self.margin = margin
+        # Never zoom out so far that the view is wider than the level
+        self.max_zoom = max(1.0, min(max_zoom, world_width / screen_width))
+        self.smoothing = smoothing
+        self.center_x = screen_width / 2
+        self.center_y = screen_height / 2
+        self.zoom = 1.0  # World units per screen pixel
+
+    def follow(self, points, snap=False, ticks=1.0):
+        """ Move toward framing the points for ticks worth of time (fractions too), or jump straight there with snap """
+        if not points:
+            return
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+        left, right = min(xs) - self.margin, max(xs) + self.margin
+        bottom, top = min(ys) - self.margin, max(ys) + self.margin
+        zoom = min(self.max_zoom, max(1.0, (right - left) / self.screen_width, (top - bottom) / self.screen_height))
+        center_x = (left + right) / 2
+        center_y = (bottom + top) / 2
+
+        # Compounded per tick, so the camera eases in at the same speed whatever the frame rate
+        amount = 1.0 if snap else 1 - (1 - self.smoothing) ** ticks
+        self.zoom += (zoom - self.zoom) * amount
+        self.center_x += (center_x - self.center_x) * amount
+        self.center_y += (center_y - self.center_y) * amount
+        self.clamp()
+
+    def clamp(self):
+        """ Keep the view inside the level sideways and above its bottom edge """
+        half_width = self.screen_width * self.zoom / 2
+        half_height = self.screen_height * self.zoom / 2
+        self.center_x = min(max(self.center_x, half_width), self.world_width - half_width)
+        self.center_y = max(self.center_y, half_height)
+
+    @property
+    def view(self):
+        """ (left, right, bottom, top) of the world area on screen """
+        half_width = self.screen_width * self.zoom / 2
+        half_height = self.screen_height * self.zoom / 2
+        return (self.center_x - half_width, self.center_x + half_width,
+                self.center_y - half_height, self.center_y + half_height)
+
+    def use(self):
+        arcade.set_viewport(*self.view)
@@ -0,0 +1,179 @@
+"""
+Fixed-rate logic under a free-running display.
+
+The simulation always advances in FIXED_DT ticks, but the window can draw at
+whatever rate the monitor (or --fps) asks for. A FixedTimestep adds up the
+real time between frames and hands back how many whole ticks are due; what is
+left over is `alpha`, how far the display is between the last two ticks, and
+the renderer draws everything that far along. Physics never sees the frame
+rate: the same tick inputs play out tick for tick the same at 60, 144 or 240
+Hz, and a key pressed at a given moment reaches the tick it was pressed in, a
+tick early or up to one frame late, so higher rates only make input snappier.
+
+After a long stall (a window drag, a breakpoint) at most max_ticks are run in
+one frame and the rest of the backlog is dropped, so the game slows down for a
+moment instead of freezing while it catches up.
+
+    python timestep.py check    press the same keys at several display rates and compare what the simulation got
+"""
+import random
+import sys
+
+from simulation import FIXED_DT
+
+MAX_TICKS_PER_FRAME = 5  # Ticks one frame may run to catch up, the rest of a longer stall is skipped
+DISPLAY_RATES = (60, 75, 144, 240, 0)  # Frames per second check() plays at, 0 for uncapped
+
+
+class FixedTimestep:
+    """ Turns frame times into whole simulation ticks, and the remainder into an interpolation fraction """
+
+    def __init__(self, tick_time=FIXED_DT, max_ticks=MAX_TICKS_PER_FRAME):
+        self.tick_time = tick_time
+        self.max_ticks = max_ticks
+        self.accumulator = 0.0  # Real time not yet simulated, less than one tick after advance()
+        self.skipped = 0  # Ticks dropped after stalls
+
+    def reset(self):
+        self.accumulator = 0.0
+
+    def advance(self, delta_time):
+        """ Add a frame's worth of real time, returns how many ticks to run now """
+        self.accumulator += delta_time
+        ticks = int(self.accumulator / self.tick_time)
+        if ticks > self.max_ticks:
+            self.skipped += ticks - self.max_ticks
+            self.accumulator -= (ticks - self.max_ticks) * self.tick_time
+            ticks = self.max_ticks
+        self.accumulator -= ticks * self.tick_time
+        return ticks
+
+    @property
+    def alpha(self):
+        """ How far between the previous tick and the latest one the display is, 0 to 1 """
+        return min(self.accumulator / self.tick_time, 1.0)
+
+
+def lerp(start, end, alpha):
+    return start + (end - start) * alpha
+
+
+def frame_times(rate, seconds, rng):
+    """ Jittery frame lengths adding up to seconds, as a display at rate (0 for uncapped) would deliver them """
+    elapsed = 0.0
+    while elapsed < seconds:
+        length = 1 / rate if rate else rng.uniform(0.001, 0.004)
+        length *= rng.uniform(0.8, 1.2)
+        elapsed += length
+        yield length
+
+
+def key_script(seconds, rng):
+    """ Sorted (time, key, down) events: every key of both default players pressed and released at random times """
+    from controls import DEFAULT_BINDINGS
+
+    events = []
+    for player in DEFAULT_BINDINGS:
+        for keys in player["keys"].values():
+            time = rng.uniform(0, 0.5)
+            while time < seconds - 1:
+                # Holds and gaps of at least 6 ticks, so no two edges of one key share a tick at any rate
+                release = time + rng.uniform(0.1, 0.6)
+                events += [(time, keys[0], True), (release, keys[0], False)]
+                time = release + rng.uniform(0.1, 0.8)
+    return sorted(events)
+
+
+def edges(bits_per_tick):
+    """ (player, bit) -> ticks on which that bit changed """
+    changes = {}
+    previous = [0] * len(bits_per_tick[0])
+    for tick, bits in enumerate(bits_per_tick):
+        for player, (old, new) in enumerate(zip(previous, bits)):
+            for bit in (1, 2, 4, 8, 16):
+                if (old ^ new) & bit:
+                    changes.setdefault((player, bit), []).append(tick)
+        previous = bits
+    return changes
+
+
+def check(seconds=10, seed=0):
+    """
+    Hold and tap keys at the same wall-clock times at several display rates.
+    Each frame sees the key events that arrived since the last one and runs
+    its ticks as GameBoard.on_update() does, through an InputState. Every key
+    change has to reach the simulation exactly once, no earlier than one tick
+    before and no later than one frame after the tick it physically fell in,
+    and the match has to run the same number of ticks. Returns the number of
+    rates that failed
+    """
+    from controls import DEFAULT_BINDINGS, Bindings, InputState, name_codes
+
+    script = key_script(seconds, random.Random(seed))
+    ticks = int(seconds / FIXED_DT)
+    # What a display with no frames at all would give: every event in the tick its time falls in
+    ideal = InputState(Bindings(DEFAULT_BINDINGS, name_codes))
+    for time, key, down in script:
+        ideal.event(("key", key), down, time)
+    reference = []
+    for tick in range(ticks):
+        reference.append(ideal.tick((tick + 1) * FIXED_DT))
+        ideal.confirm([None, None])
+    expected = edges(reference)
+
+    failures = 0
+    for rate in DISPLAY_RATES:
+        rng = random.Random(rate)
+        controls = InputState(Bindings(DEFAULT_BINDINGS, name_codes))
+        timestep = FixedTimestep()
+        given = []
+        now = 0.0
+        pending = 0  # Next script event the window hasn't delivered
+        frames = 0
+        longest = 0.0
+        alphas = []
+        for delta_time in frame_times(rate, seconds, rng):
+            frames += 1
+            longest = max(longest, delta_time)
+            now += delta_time
+            # Events are stamped when the window dispatches them, at the start of the frame that sees them
+            while pending < len(script) and script[pending][0] <= now:
+                _, key, down = script[pending]
+                controls.event(("key", key), down, now)
+                pending += 1
+            due = timestep.advance(delta_time)
+            for index in range(due):
+                inputs = controls.tick(now - (due - 1 - index) * FIXED_DT)
+                # Nobody to take presses, so each is offered once and the bits depend only on the keys
+                controls.confirm([None, None])
+                given.append(inputs)
+            alphas.append(timestep.alpha)
+        got = edges(given[:ticks])
+        late = 1 + int(longest / FIXED_DT)  # Ticks an edge may lag by: one frame of waiting, rounded up
+        worst = 0
+        lost = 0
+        for key, wanted in expected.items():
+            seen = got.get(key, [])
+            if len(seen) != len(wanted):
+                lost += 1
+                continue
+            for ideal_tick, tick in zip(wanted, seen):
+                if not -1 <= tick - ideal_tick <= late:
+                    lost += 1
+                worst = max(worst, tick - ideal_tick)
+        lost += len(set(got) - set(expected))
+        name = f"{rate} Hz" if rate else "uncapped"
+        print(f"{name:>9}: {frames:>6} frames, {len(given)} ticks (expected about {ticks}), "
+              f"mean alpha {sum(alphas) / len(alphas):.2f}, key changes at most {worst} ticks late "
+              f"(allowed {late}), {f'{lost} keys misplaced' if lost else 'every key change delivered once'}")
+        if lost or abs(len(given) - ticks) > 2:
+            failures += 1
+    return failures
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["check"]:
+        failures = check()
+        print("Every display rate gets the same input" if not failures else f"{failures} display rates differed")
+        sys.exit(1 if failures else 0)
+    print(__doc__)
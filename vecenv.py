@@ -0,0 +1,573 @@
+"""
+Vectorized batch simulation for training and evaluating bots.
+
+BatchMatch runs thousands of independent matches at once. All of their state
+lives in NumPy arrays with one row per match and one column per fighter, and
+each tick is a fixed sequence of array operations over the whole batch.
+
+It models a subset of Match.step(): walking, jumping, attacks, hitstun,
+landing on platforms and falling out, with the same numbers. There are no
+thrown projectiles and no level hazards (cannons, barrels), so the actions
+leave throwing out and VecEnv refuses levels that have hazards. Within that
+subset a bot trained here plays the game the window runs; "python vecenv.py
+check" steps both side by side, with inputs that never throw, and compares
+them.
+
+VecEnv puts a gym-style reset()/step() API on top: discrete actions in,
+observations, rewards and done flags out, with finished matches restarting on
+their own. SubprocVecEnv splits a batch over worker processes so one machine
+can use every core.
+
+    python vecenv.py [matches] [workers]    steps per second, in process and across workers
+    python vecenv.py check                  compare against Match.step() tick by tick, without throws
+"""
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from simulation import (
+    ARENA_HEIGHT, ARENA_WIDTH, ATTACK, CHARACTERS, DEAD, DEATH_TICKS, FALL_LIMIT, FIGHTER_HEIGHT, FIGHTER_WIDTH,
+    FIXED_DT, GRAVITY, GROUND, HITSTUN, IDLE, INPUT_ATTACK, INPUT_JUMP, INPUT_LEFT, INPUT_MOVES, INPUT_RIGHT,
+    INPUT_THROW, JUMP, MAX_PLAYERS, MIN_PLAYERS, NUM_FRAMES_WALK, PLAYER_JUMP_SPEED, PLAYER_MOVE_SPEED, REACH,
+    STARTING_HEALTH, STATE_NAMES, WALK, WALK_FRAME_TIME, Match, spawn_positions,
+)
+
+# Discrete actions and the input bits each one holds down
+ACTIONS = [
+    0,
+    INPUT_LEFT,
+    INPUT_RIGHT,
+    INPUT_JUMP,
+    INPUT_LEFT | INPUT_JUMP,
+    INPUT_RIGHT | INPUT_JUMP,
+    INPUT_ATTACK,
+    INPUT_LEFT | INPUT_ATTACK,
+    INPUT_RIGHT | INPUT_ATTACK,
+]
+ACTION_BITS = np.array(ACTIONS, dtype=np.uint8)
+
+# Per fighter observation: position, velocity, health, facing, state one-hot and progress through the state.
+# Each player sees itself first, then everyone else in player order with positions relative to its own
+FIGHTER_FEATURES = 7 + len(STATE_NAMES)
+STATE_PROGRESS_TICKS = 60  # State progress reads 1.0 after this many ticks
+
+HIT_REWARD = 0.1  # For each hit landed, and minus this for each one taken
+WIN_REWARD = 1.0  # To the winner, and minus this to everyone else, when a match ends
+MAX_EPISODE_TICKS = 60 * 120  # Matches still going after this long are cut off and restarted
+NO_BOX = (1e9, 1e9, -1e9, -1e9)  # Pads box tables out to a fixed size, overlaps nothing
+
+
+def _no_boxes(*shape):
+    return np.tile(np.array(NO_BOX, dtype=np.float64), shape + (1,))
+
+
+def _box_table(frames, size):
+    """ (frames, size, 4) array of the (bounds, *boxes) entries' boxes, padded with NO_BOX """
+    table = _no_boxes(len(frames), size)
+    for index, frame in enumerate(frames):
+        if frame is not None:
+            table[index, :len(frame) - 1] = frame[1:]
+    return table
+
+
+class Tables:
+    """ Move and box data of every character as arrays that can be indexed by whole batches of fighters """
+
+    def __init__(self, characters=CHARACTERS):
+        moves = max(len(character.moves) for character in characters)
+        duration = max(move.duration for character in characters for move in character.moves)
+        hit_size = max(len(window) - 1 for character in characters for move in character.moves
+                       for window in move.windows if window is not None)
+        hurt_size = max(len(frame) - 1 for character in characters
+                        for frame in character.walk_frames + character.attack_frames if frame is not None)
+        attack_frames = max(len(character.attack_frames) for character in characters)
+
+        shape = (len(characters), moves)
+        self.duration = np.ones(shape, dtype=np.int32)
+        self.frame_ticks = np.ones(shape, dtype=np.int32)
+        self.num_frames = np.ones(shape, dtype=np.int32)
+        self.damage = np.zeros(shape, dtype=np.int32)
+        self.hitstun = np.zeros(shape, dtype=np.int32)
+        self.knockback = np.zeros(shape, dtype=np.float64)
+        self.hitboxes = _no_boxes(len(characters), moves, duration, hit_size)
+        self.walk_hurtboxes = _no_boxes(len(characters), NUM_FRAMES_WALK, hurt_size)
+        self.attack_hurtboxes = _no_boxes(len(characters), attack_frames, hurt_size)
+
+        for c, character in enumerate(characters):
+            for m, move in enumerate(character.moves):
+                self.duration[c, m] = move.duration
+                self.frame_ticks[c, m] = move.frame_ticks
+                self.num_frames[c, m] = move.num_frames
+                self.damage[c, m] = move.damage
+                self.hitstun[c, m] = move.hitstun
+                self.knockback[c, m] = move.knockback
+                self.hitboxes[c, m, :move.duration] = _box_table(move.windows, hit_size)
+            self.walk_hurtboxes[c, :len(character.walk_frames)] = _box_table(character.walk_frames, hurt_size)
+            self.attack_hurtboxes[c, :len(character.attack_frames)] = _box_table(character.attack_frames, hurt_size)
+        self.active = self.hitboxes[..., 0, 0] < NO_BOX[0]  # [character, move, tick] has at least one hitbox
+        self.max_duration = duration
+
+
+def _place(boxes, x, y, facing):
+    """ Relative boxes (..., boxes, 4) moved to each fighter's position and turned the way it faces """
+    x = x[..., None]
+    y = y[..., None]
+    right_way = (facing > 0)[..., None]
+    left = np.where(right_way, x + boxes[..., 0], x - boxes[..., 2])
+    right = np.where(right_way, x + boxes[..., 2], x - boxes[..., 0])
+    return left, y + boxes[..., 1], right, y + boxes[..., 3]
+
+
+class BatchMatch:
+    """ Many independent matches on the same platforms, stepped together one tick at a time """
+
+    def __init__(self, num_matches, num_players=2, platforms=None, width=ARENA_WIDTH, spawns=None, tables=None):
+        if not MIN_PLAYERS <= num_players <= MAX_PLAYERS:
+            raise ValueError(f"A match needs {MIN_PLAYERS} to {MAX_PLAYERS} players, got {num_players}")
+        self.num_matches = num_matches
+        self.num_players = num_players
+        self.width = width
+        self.platforms = np.array(platforms if platforms is not None else [GROUND], dtype=np.float64)
+        self.tables = tables or Tables()
+        spawns = spawns if spawns is not None else spawn_positions(num_players)
+        self.spawn_x = np.array([x for x, _ in spawns[:num_players]], dtype=np.float64)
+        self.spawn_y = np.array([y for _, y in spawns[:num_players]], dtype=np.float64)
+        self.spawn_facing = np.where(self.spawn_x <= width / 2, 1, -1).astype(np.int8)
+        self.others = ~np.eye(num_players, dtype=bool)  # Nobody hits themselves
+
+        shape = (num_matches, num_players)
+        self.x = np.zeros(shape)
+        self.y = np.zeros(shape)
+        self.change_x = np.zeros(shape)
+        self.change_y = np.zeros(shape)
+        self.health = np.zeros(shape, dtype=np.int32)
+        self.character = np.tile(np.arange(num_players, dtype=np.int32) % len(CHARACTERS), (num_matches, 1))
+        self.facing = np.zeros(shape, dtype=np.int8)
+        self.state = np.zeros(shape, dtype=np.int8)
+        self.state_ticks = np.zeros(shape, dtype=np.int32)
+        self.move = np.zeros(shape, dtype=np.int32)
+        self.hitstun = np.zeros(shape, dtype=np.int32)
+        self.has_dealt_damage = np.zeros(shape, dtype=bool)
+        self.death_animation_done = np.zeros(shape, dtype=bool)
+        self.walk_time = np.zeros(shape)
+        self.prev_input = np.zeros(shape, dtype=np.uint8)
+        self.tick = np.zeros(num_matches, dtype=np.int64)
+        self.game_over = np.zeros(num_matches, dtype=bool)
+        self.winner = np.full(num_matches, -1, dtype=np.int32)  # -1 for a draw or a match still going
+        self.hits = np.zeros((num_matches, num_players, num_players), dtype=bool)  # [match, attacker, target]
+        self.reset()
+
+    def reset(self, mask=None):
+        """ Start the chosen matches (all of them by default) over from their spawn points """
+        rows = slice(None) if mask is None else mask
+        self.x[rows] = self.spawn_x
+        self.y[rows] = self.spawn_y
+        self.change_x[rows] = 0
+        self.change_y[rows] = 0
+        self.health[rows] = STARTING_HEALTH
+        self.facing[rows] = self.spawn_facing
+        self.state[rows] = IDLE
+        self.state_ticks[rows] = 0
+        self.move[rows] = 0
+        self.hitstun[rows] = 0
+        self.has_dealt_damage[rows] = False
+        self.death_animation_done[rows] = False
+        self.walk_time[rows] = 0
+        self.prev_input[rows] = 0
+        self.tick[rows] = 0
+        self.game_over[rows] = False
+        self.winner[rows] = -1
+        self.hits[rows] = False
+
+    @property
+    def frozen(self):
+        """ Matches that are decided with every death animation finished, see Match.frozen """
+        return self.game_over & np.all(self.death_animation_done | (self.state != DEAD), axis=1)
+
+    def step(self, bits):
+        """ Advance every match one tick. bits is a (matches, players) array of input bitmasks """
+        self.hits[:] = False
+        live = ~self.frozen
+        self.tick[live] += 1
+        bits = np.where(self.game_over[:, None], 0, np.asarray(bits, dtype=np.uint8)).astype(np.uint8)
+        moving = self.move_fighters(bits, live[:, None])
+
+        # Matches whose last death animation just finished stop here, like Match.step()
+        live &= ~self.frozen
+        moving &= live[:, None]
+        self.manage_attacks(moving)
+        self.land_fighters(moving)
+
+        alive = self.health > 0
+        count = alive.sum(axis=1)
+        over = live & (count <= 1)
+        self.game_over |= over
+        self.winner[over] = np.where(count[over] == 1, alive[over].argmax(axis=1), -1)
+
+    def enter(self, mask, state):
+        self.state[mask] = state
+        self.state_ticks[mask] = 0
+
+    def move_fighters(self, bits, live):
+        """ State timers, input, gravity and velocity. Returns the fighters that moved, see Match.move_fighters """
+        tables = self.tables
+        state = self.state
+        dead = live & (state == DEAD)
+        moving = live & ~dead & ~((state == IDLE) & (bits == 0))
+
+        dying = dead & ~self.death_animation_done
+        self.state_ticks[dying] += 1
+        self.death_animation_done |= dying & (self.state_ticks >= DEATH_TICKS)
+
+        self.state_ticks[moving] += 1
+        duration = tables.duration[self.character, self.move]
+        self.enter(moving & (state == ATTACK) & (self.state_ticks >= duration), IDLE)
+        recovered = moving & (state == HITSTUN) & (self.state_ticks >= self.hitstun)
+        self.enter(recovered, IDLE)
+        self.change_x[recovered] = 0
+
+        # Input, see Match.apply_input
+        pressed = bits & ~self.prev_input
+        steer = moving & ((state == IDLE) | (state == WALK) | (state == JUMP))
+        direction = (bits & INPUT_RIGHT != 0).astype(np.int8) - (bits & INPUT_LEFT != 0).astype(np.int8)
+        self.change_x[steer] = direction[steer] * PLAYER_MOVE_SPEED
+        turn = steer & (direction != 0)
+        self.facing[turn] = direction[turn]
+        self.enter(turn & (state == IDLE), WALK)
+        jump = moving & (pressed & INPUT_JUMP != 0) & ((state == IDLE) | (state == WALK))
+        self.enter(jump, JUMP)
+        self.change_y[jump] = PLAYER_JUMP_SPEED
+        can_attack = moving & ((state == IDLE) | (state == WALK) | (state == JUMP))
+        for bit, move in INPUT_MOVES:
+            start = can_attack & (pressed & bit != 0)
+            self.enter(start, ATTACK)
+            self.move[start] = move
+            self.has_dealt_damage[start] = False
+            can_attack &= ~start
+        self.prev_input = np.where(live, bits, self.prev_input).astype(np.uint8)
+
+        self.change_y[moving] -= GRAVITY
+        self.x[moving] += self.change_x[moving]
+        self.y[moving] += self.change_y[moving]
+        return moving
+
+    def hurtboxes(self, rows):
+        """ (left, bottom, right, top) arrays of the hurtboxes each fighter in the given matches is showing """
+        tables = self.tables
+        character = self.character[rows]
+        move = self.move[rows]
+        walk_frame = (self.walk_time[rows] / WALK_FRAME_TIME).astype(np.int32) % NUM_FRAMES_WALK
+        attack_frame = np.minimum(self.state_ticks[rows] // tables.frame_ticks[character, move],
+                                  tables.num_frames[character, move] - 1)
+        attack_frame = np.minimum(attack_frame, tables.attack_hurtboxes.shape[1] - 1)
+        boxes = np.where((self.state[rows] == ATTACK)[..., None, None],
+                         tables.attack_hurtboxes[character, attack_frame],
+                         tables.walk_hurtboxes[character, walk_frame])
+        return _place(boxes, self.x[rows], self.y[rows], self.facing[rows])
+
+    def manage_attacks(self, moving):
+        """ Every swing in an active frame against every other fighter's hurtboxes, see Match.manage_attacks """
+        tables = self.tables
+        ticks = np.minimum(self.state_ticks, tables.max_duration - 1)
+        swinging = (moving & (self.state == ATTACK) & ~self.has_dealt_damage
+                    & tables.active[self.character, self.move, ticks])
+        # Only matches where a swing has someone else within reach are worth testing boxes in
+        near = np.abs(self.x[:, :, None] - self.x[:, None, :]) < REACH
+        rows = np.flatnonzero((swinging[:, :, None] & near & self.others).any(axis=(1, 2)))
+        if not rows.size:
+            return
+
+        # [match, attacker, target, hitbox, hurtbox]
+        character = self.character[rows]
+        move = self.move[rows]
+        windows = tables.hitboxes[character, move, ticks[rows]]
+        hit_left, hit_bottom, hit_right, hit_top = (
+            side[:, :, None, :, None] for side in _place(windows, self.x[rows], self.y[rows], self.facing[rows]))
+        hurt_left, hurt_bottom, hurt_right, hurt_top = (side[:, None, :, None, :] for side in self.hurtboxes(rows))
+        overlap = ((hit_left < hurt_right) & (hit_right > hurt_left) & (hit_bottom < hurt_top)
+                   & (hit_top > hurt_bottom)).any(axis=(3, 4))
+        hits = overlap & swinging[rows][:, :, None] & (self.state[rows] != DEAD)[:, None, :] & self.others
+        landed = hits.any(axis=(1, 2))
+        if not landed.any():
+            return
+        rows = rows[landed]
+        hits = hits[landed]
+        character = character[landed]
+        move = move[landed]
+        self.hits[rows] = hits
+
+        # Every hit found is applied, in attacker order, so two fighters swinging into each other both land theirs
+        self.has_dealt_damage[rows] |= hits.any(axis=2)
+        damage = tables.damage[character, move]
+        health = np.maximum(0, self.health[rows] - (hits * damage[:, :, None]).sum(axis=1))
+        self.health[rows] = health
+        struck = hits.any(axis=1)
+        knocked_out = np.zeros_like(swinging)
+        knocked_out[rows] = struck & (health == 0)
+        self.knock_out(knocked_out)
+
+        # The last attacker to hit a surviving target decides its hitstun and knockback
+        stunned = struck & (health > 0)
+        last = self.num_players - 1 - hits[:, ::-1, :].argmax(axis=1)
+        matches = np.arange(len(rows))[:, None]
+        attacker_character = character[matches, last]
+        attacker_move = move[matches, last]
+        knockback = tables.knockback[attacker_character, attacker_move] * self.facing[rows][matches, last]
+        self.hitstun[rows] = np.where(stunned, tables.hitstun[attacker_character, attacker_move], self.hitstun[rows])
+        self.change_x[rows] = np.where(stunned, knockback, self.change_x[rows])
+        entered = np.zeros_like(swinging)
+        entered[rows] = stunned
+        self.enter(entered, HITSTUN)
+
+    def land_fighters(self, moving):
+        """ Platforms, arena edges and falling out, see Match.land_fighters """
+        state = self.state.copy()
+        active = moving & (state != DEAD)
+        walking = active & (self.change_x != 0) & ((state == WALK) | (state == JUMP))
+        self.walk_time[walking] += FIXED_DT
+
+        half_width = FIGHTER_WIDTH / 2
+        platforms = self.platforms
+        x = self.x[..., None]
+        y = self.y[..., None]
+        touching = ((x - half_width < platforms[:, 2]) & (platforms[:, 0] < x + half_width)
+                    & (y < platforms[:, 3]) & (platforms[:, 1] < y + FIGHTER_HEIGHT))
+        landed = active & touching.any(axis=2)
+        tops = np.where(touching, platforms[:, 3], -np.inf).max(axis=2)
+        self.change_y[landed] = 0
+        self.y[landed] = tops[landed]
+        self.enter(landed & (state == JUMP), IDLE)
+        after = self.state.copy()
+        self.enter(landed & (after == IDLE) & (self.change_x != 0), WALK)
+        self.enter(landed & (after == WALK) & (self.change_x == 0), IDLE)
+        self.enter(active & ~landed & ((state == IDLE) | (state == WALK)), JUMP)
+
+        self.x[active] = np.clip(self.x[active], half_width, self.width - half_width)
+        fell = active & (self.y < FALL_LIMIT)
+        self.health[fell] = 0
+        self.knock_out(fell)
+
+    def knock_out(self, mask):
+        mask = mask & (self.state != DEAD)
+        self.enter(mask, DEAD)
+        self.change_x[mask] = 0
+        self.change_y[mask] = 0
+
+    def observe(self):
+        """ (matches, players, observation size) float32 array, each player's view of its own match """
+        features = np.empty((self.num_matches, self.num_players, FIGHTER_FEATURES), dtype=np.float32)
+        features[..., 0] = self.x / self.width * 2 - 1
+        features[..., 1] = self.y / ARENA_HEIGHT
+        features[..., 2] = self.change_x / PLAYER_MOVE_SPEED
+        features[..., 3] = self.change_y / PLAYER_JUMP_SPEED
+        features[..., 4] = self.health / STARTING_HEALTH
+        features[..., 5] = self.facing
+        features[..., 6] = np.minimum(self.state_ticks / STATE_PROGRESS_TICKS, 1.0)
+        features[..., 7:] = self.state[..., None] == np.arange(len(STATE_NAMES))
+
+        # Player p sees itself, then the others in order, with their positions relative to its own
+        order = np.array([[p] + [q for q in range(self.num_players) if q != p] for p in range(self.num_players)])
+        views = features[:, order]  # (matches, viewer, fighter, features)
+        views[:, :, 1:, :2] -= views[:, :, :1, :2]
+        return views.reshape(self.num_matches, self.num_players, -1)
+
+
+def observation_size(num_players):
+    return FIGHTER_FEATURES * num_players
+
+
+class VecEnv:
+    """
+    Gym-style batch of matches. step() takes one action index (see ACTIONS) per player per match and returns
+    observations, rewards, done flags and info. Finished matches restart on their own; the observation a match
+    ended on is kept in info["terminal_observation"]
+    """
+
+    def __init__(self, num_envs, num_players=2, action_repeat=1, max_ticks=MAX_EPISODE_TICKS, level=None):
+        if level is None:
+            self.batch = BatchMatch(num_envs, num_players)
+        elif level.hazards:
+            raise ValueError(f"{level.name} has hazards, which the batch simulation doesn't model")
+        else:
+            self.batch = BatchMatch(num_envs, num_players, level.platforms, level.width,
+                                    level.spawn_positions(num_players))
+        self.num_envs = num_envs
+        self.num_players = num_players
+        self.action_repeat = action_repeat  # Ticks each action is held for
+        self.max_ticks = max_ticks
+        self.observation_shape = (num_players, observation_size(num_players))
+        self.num_actions = len(ACTIONS)
+
+    def reset(self):
+        self.batch.reset()
+        return self.batch.observe()
+
+    def step(self, actions):
+        batch = self.batch
+        bits = ACTION_BITS[np.asarray(actions)]
+        rewards = np.zeros((self.num_envs, self.num_players), dtype=np.float32)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        winners = np.full(self.num_envs, -1, dtype=np.int32)
+        for _ in range(self.action_repeat):
+            batch.step(np.where(dones[:, None], 0, bits))
+            landed = batch.hits.sum(axis=2)
+            taken = batch.hits.sum(axis=1)
+            rewards += np.where(dones[:, None], 0, (landed - taken) * HIT_REWARD)
+            ended = ~dones & batch.game_over
+            winners[ended] = batch.winner[ended]
+            dones |= ended
+        truncated = ~dones & (batch.tick >= self.max_ticks)
+
+        # A win is worth WIN_REWARD, everyone else in the match loses that much. Draws and cut-off matches give nothing
+        decided = dones & (winners >= 0)
+        won = np.arange(self.num_players) == winners[:, None]
+        rewards += np.where(decided[:, None], np.where(won, WIN_REWARD, -WIN_REWARD), 0).astype(np.float32)
+
+        observations = batch.observe()
+        finished = dones | truncated
+        info = {"winner": winners, "truncated": truncated}
+        if finished.any():
+            info["terminal_observation"] = observations[finished]
+            batch.reset(finished)
+            observations[finished] = batch.observe()[finished]
+        return observations, rewards, finished, info
+
+    def close(self):
+        pass
+
+
+def _worker(connection, num_envs, kwargs):
+    env = VecEnv(num_envs, **kwargs)
+    try:
+        while True:
+            command, data = connection.recv()
+            if command == "step":
+                connection.send(env.step(data))
+            elif command == "reset":
+                connection.send(env.reset())
+            else:
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        connection.close()
+
+
+class SubprocVecEnv:
+    """ A VecEnv split across worker processes, one slice of the batch each, stepped in parallel """
+
+    def __init__(self, num_envs, workers=None, **kwargs):
+        workers = max(1, min(workers or os.cpu_count() or 1, num_envs))
+        sizes = [num_envs // workers + (1 if index < num_envs % workers else 0) for index in range(workers)]
+        self.splits = np.cumsum(sizes)[:-1]
+        self.connections = []
+        self.processes = []
+        for size in sizes:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker, args=(child, size, kwargs), daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        probe = VecEnv(1, **kwargs)
+        self.num_envs = num_envs
+        self.num_players = probe.num_players
+        self.observation_shape = probe.observation_shape
+        self.num_actions = probe.num_actions
+
+    def reset(self):
+        for connection in self.connections:
+            connection.send(("reset", None))
+        return np.concatenate([connection.recv() for connection in self.connections])
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def step_async(self, actions):
+        """ Send every worker its slice of the actions without waiting, so the caller can work meanwhile """
+        for connection, chunk in zip(self.connections, np.split(np.asarray(actions), self.splits)):
+            connection.send(("step", chunk))
+
+    def step_wait(self):
+        results = [connection.recv() for connection in self.connections]
+        observations = np.concatenate([result[0] for result in results])
+        rewards = np.concatenate([result[1] for result in results])
+        dones = np.concatenate([result[2] for result in results])
+        info = {"winner": np.concatenate([result[3]["winner"] for result in results]),
+                "truncated": np.concatenate([result[3]["truncated"] for result in results])}
+        terminal = [result[3]["terminal_observation"] for result in results if "terminal_observation" in result[3]]
+        if terminal:
+            info["terminal_observation"] = np.concatenate(terminal)
+        return observations, rewards, dones, info
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+
+
+def check(num_matches=32, ticks=3000, num_players=2):
+    """
+    Step a BatchMatch and one Match per row on the arena with the same random
+    inputs, returns the first mismatch or None. Throwing is masked out of the
+    inputs because the batch has no projectiles, so this covers only the
+    subset BatchMatch models
+    """
+    batch = BatchMatch(num_matches, num_players)
+    matches = [Match(seed, num_players) for seed in range(num_matches)]
+    rngs = [random.Random(seed) for seed in range(num_matches)]
+    bits = np.zeros((num_matches, num_players), dtype=np.uint8)
+    for tick in range(ticks):
+        if tick % 6 == 0:
+            bits = np.array([[rng.randrange(32) & ~INPUT_THROW for _ in range(num_players)] for rng in rngs],
+                            dtype=np.uint8)
+        batch.step(bits)
+        for row, match in enumerate(matches):
+            match.step([int(value) for value in bits[row]])
+            for p, fighter in enumerate(match.fighters):
+                expected = (fighter.x, fighter.y, fighter.health, fighter.state, fighter.state_ticks)
+                got = (batch.x[row, p], batch.y[row, p], batch.health[row, p], batch.state[row, p],
+                       batch.state_ticks[row, p])
+                if expected != got:
+                    return f"tick {tick + 1} match {row} fighter {p}: expected {expected}, got {got}"
+            if match.game_over != batch.game_over[row] or (match.winner if match.winner is not None else -1) \
+                    != batch.winner[row]:
+                return f"tick {tick + 1} match {row}: game over {match.game_over}/{match.winner}, got " \
+                       f"{batch.game_over[row]}/{batch.winner[row]}"
+    return None
+
+
+def benchmark(env, steps, seed=0):
+    rng = np.random.default_rng(seed)
+    env.reset()
+    start = time.perf_counter()
+    for _ in range(steps):
+        env.step(rng.integers(len(ACTIONS), size=(env.num_envs, env.num_players)))
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["check"]:
+        mismatch = check()
+        print(mismatch or "BatchMatch agrees with Match, throws left out")
+        sys.exit(1 if mismatch else 0)
+
+    matches = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    steps = 200
+    elapsed = benchmark(VecEnv(matches), steps)
+    print(f"1 process: {matches} matches x {steps} steps in {elapsed:.2f}s ({matches * steps / elapsed:,.0f} match steps/s)")
+    env = SubprocVecEnv(matches * workers, workers)
+    elapsed = benchmark(env, steps)
+    env.close()
+    print(f"{workers} workers: {matches * workers} matches x {steps} steps in {elapsed:.2f}s "
+          f"({matches * workers * steps / elapsed:,.0f} match steps/s)")
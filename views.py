@@ -0,0 +1,36 @@
+"""
+One instance of each screen for the whole run.
+
+Views are built the first time they are shown and reset in place every time
+after that, so going back to the menu and starting a rematch reuses the
+sprites, textures and particle buffers already made instead of allocating
+new ones, and memory stays flat however many matches are played.
+
+    views = ViewManager(window, {"menu": MainMenu, "game": new_game_board})
+    views.show("game", level=level)    # GameBoard(level=level) the first time, board.reset(level=level) after
+"""
+
+
+class ViewManager:
+    """ Builds each named view on first use and resets it on every later show """
+
+    def __init__(self, window, factories):
+        self.window = window
+        self.factories = factories  # Name -> callable taking the show() options and returning a ready view
+        self.views = {}
+        self.builds = 0  # Views built so far, stays at the number of screens once each has been visited
+
+    def get(self, name, **options):
+        """ The view, ready to show: built with the options the first time, reset with them after that """
+        view = self.views.get(name)
+        if view is None:
+            view = self.views[name] = self.factories[name](**options)
+            self.builds += 1
+        else:
+            view.reset(**options)
+        return view
+
+    def show(self, name, **options):
+        view = self.get(name, **options)
+        self.window.show_view(view)
+        return view